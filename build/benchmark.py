@@ -0,0 +1,534 @@
+"""Benchmarks of the image build, image size and container cold start."""
+
+import hashlib
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Iterable, Mapping
+from dataclasses import asdict, dataclass
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+import click
+from python_on_whales import Builder, Container, DockerClient
+from python_on_whales.components.buildx.imagetools.models import Manifest
+from python_on_whales.utils import run
+
+from build.constants import PLATFORMS
+from build.utils import get_context, get_image_reference
+
+BASELINE_PATH: Path = Path(__file__).parent.parent / "benchmarks" / "baseline.json"
+CONFIG_CREATOR: Path = Path(__file__).parent / "config" / "config_creator.py"
+RESULTS_PATH: Path = Path("benchmark-results.json")
+BENCHMARK_TAG: str = "benchmark"
+DEFAULT_TOLERANCE: float = 0.2
+
+
+@dataclass
+class LayerSize:
+    """Sizes of an image layer and the Dockerfile instruction creating it."""
+
+    instruction: str
+    size: int
+    compressed_size: int
+
+
+@dataclass
+class Regression:
+    """Metric exceeding its baseline by more than the tolerance."""
+
+    metric: str
+    baseline: float
+    value: float
+    limit: float
+
+    def __str__(self) -> str:
+        """Return a description of the regression.
+
+        :return:
+        """
+        return (
+            f"{self.metric}: {self.value:g} exceeds {self.limit:g} "
+            f"(baseline {self.baseline:g})"
+        )
+
+
+def time_build(
+    docker_client: DockerClient, builder: Builder | str, cache: bool, **kwargs
+) -> float:
+    """Return the seconds a build of the image takes.
+
+    :param docker_client:
+    :param builder:
+    :param cache: use the layer cache, otherwise all layers are built again
+    :param kwargs: further arguments of the build
+    :return:
+    """
+    started: float = time.perf_counter()
+    docker_client.buildx.build(
+        context_path=get_context(),
+        builder=builder,
+        cache=cache,
+        platforms=PLATFORMS,
+        **kwargs,
+    )
+    return time.perf_counter() - started
+
+
+def pair_layers(
+    history: Iterable[str], compressed_sizes: Iterable[int]
+) -> list[LayerSize]:
+    """Pair the layers of the image history with their compressed sizes.
+
+    :param history: JSON lines of docker history, newest instruction first
+    :param compressed_sizes: layer sizes of the registry manifest, oldest first
+    :return:
+    """
+    entries: list[dict] = [json.loads(line) for line in history if line.strip()]
+    # Instructions like ENV are listed without a layer
+    layers: list[tuple[str, int]] = [
+        (entry["CreatedBy"], int(entry["Size"]))
+        for entry in reversed(entries)
+        if int(entry["Size"]) > 0
+    ]
+    compressed: list[int] = list(compressed_sizes)
+    if len(layers) != len(compressed):
+        raise ValueError(
+            f"Image history has {len(layers)} layers, "
+            f"but the manifest {len(compressed)}"
+        )
+    return [
+        LayerSize(instruction, size, compressed_size)
+        for (instruction, size), compressed_size in zip(layers, compressed)
+    ]
+
+
+def get_layer_key(instruction: str) -> str:
+    """Return a metric key of a layer, kept while its instruction is unchanged.
+
+    Build arguments are left out, as values like the Steam build ID change with
+    every game update.
+
+    :param instruction: instruction from the image history
+    :return:
+    """
+    words: list[str] = instruction.removesuffix(" # buildkit").split()
+    if len(words) > 1 and words[1].startswith("|") and words[1][1:].isdigit():
+        del words[1 : int(words[1][1:]) + 2]
+    digest: str = hashlib.sha256(" ".join(words).encode()).hexdigest()[:8]
+    return f"{words[0].lower()}-{digest}"
+
+
+def get_layer_metrics(layers: Iterable[LayerSize]) -> dict[str, float]:
+    """Return the sizes of every layer keyed by its instruction.
+
+    :param layers:
+    :return:
+    """
+    metrics: dict[str, float] = {}
+    for layer in layers:
+        key: str = get_layer_key(layer.instruction)
+        number: int = 1
+        while f"layer.{key}.size.bytes" in metrics:
+            number += 1
+            key = f"{get_layer_key(layer.instruction)}-{number}"
+        metrics[f"layer.{key}.size.bytes"] = layer.size
+        metrics[f"layer.{key}.compressed_size.bytes"] = layer.compressed_size
+    return metrics
+
+
+def get_layer_sizes(docker_client: DockerClient, reference: str) -> list[LayerSize]:
+    """Return the layer sizes of an image pushed to a registry and pulled.
+
+    :param docker_client:
+    :param reference:
+    :return:
+    """
+    manifest: Manifest = docker_client.buildx.imagetools.inspect(reference)
+    if manifest.manifests:
+        repository: str = reference.rsplit(":", 1)[0]
+        variant = next(
+            variant
+            for variant in manifest.manifests
+            # Skip attestation manifests
+            if not variant.platform or variant.platform.os != "unknown"
+        )
+        manifest = docker_client.buildx.imagetools.inspect(
+            f"{repository}@{variant.digest}"
+        )
+    history: str = run(
+        [
+            *docker_client.image.docker_cmd,
+            "history",
+            "--no-trunc",
+            "--human=false",
+            "--format",
+            "{{json .}}",
+            reference,
+        ]
+    )
+    return pair_layers(
+        history.splitlines(), [layer.size or 0 for layer in manifest.layers or []]
+    )
+
+
+def time_config_creator(runs: int = 5) -> float:
+    """Return the median seconds the config creator takes to write a new config.
+
+    :param runs:
+    :return:
+    """
+    durations: list[float] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for number in range(runs):
+            started: float = time.perf_counter()
+            subprocess.run(
+                [
+                    sys.executable,
+                    str(CONFIG_CREATOR),
+                    "--output",
+                    str(Path(directory) / f"{number}.cfg"),
+                ],
+                check=True,
+                capture_output=True,
+            )
+            durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def parse_startup_records(logs: str) -> dict[str, dict]:
+    """Return the supervisor's timing records of the startup phases by phase.
+
+    :param logs:
+    :return:
+    """
+    records: dict[str, dict] = {}
+    for line in logs.splitlines():
+        if not line.startswith("{"):
+            continue
+        record: dict = json.loads(line)
+        if record.get("event") == "startup_phase":
+            records[record["phase"]] = record
+    return records
+
+
+def time_cold_start(
+    docker_client: DockerClient,
+    reference: str,
+    remove_wine_prefix: bool = False,
+    timeout: float = 600.0,
+    poll_interval: float = 0.1,
+) -> dict[str, float]:
+    """Return the seconds from running a container until the game process runs.
+
+    Also returns the durations of the startup phases timed by the supervisor.
+    Without the Wine prefix baked into the image, the metrics are named
+    cold_start.without_prefix.* and show the time the prefix saves.
+
+    :param docker_client:
+    :param reference:
+    :param remove_wine_prefix: remove the prefix first, so wineboot runs
+    :param timeout: seconds
+    :param poll_interval: seconds between reads of the container logs
+    :return: metrics
+    """
+    name: str = "cold_start"
+    started: float = time.perf_counter()
+    if remove_wine_prefix:
+        name = "cold_start.without_prefix"
+        container: Container = docker_client.run(
+            reference,
+            ["-c", 'rm -rf "$WINEPREFIX" && exec /srv/sotf/entrypoint.sh'],
+            entrypoint="bash",
+            detach=True,
+        )
+    else:
+        container = docker_client.run(reference, detach=True)
+    try:
+        while True:
+            records: dict[str, dict] = parse_startup_records(
+                docker_client.container.logs(container)
+            )
+            if "startup" in records:
+                metrics: dict[str, float] = {
+                    f"{name}.seconds": time.perf_counter() - started
+                }
+                for phase, record in records.items():
+                    metrics[f"{name}.{phase}.seconds"] = record["duration"]
+                return metrics
+            if not docker_client.container.inspect(container).state.running:
+                raise RuntimeError("Container exited before starting the game")
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"Game did not start within {timeout} seconds")
+            time.sleep(poll_interval)
+    finally:
+        docker_client.container.remove(container, force=True)
+
+
+def run_benchmarks(
+    docker_client: DockerClient, builder: Builder | str, registry: str
+) -> tuple[dict[str, float], list[LayerSize]]:
+    """Build, push and start the image, and return its metrics.
+
+    The full build rebuilds all layers, but keeps the steamcmd cache mount like
+    later builds on the same local builder.
+
+    :param docker_client:
+    :param builder:
+    :param registry: registry to push the image to, for its compressed sizes
+    :return: metrics and layer sizes
+    """
+    reference: str = get_image_reference(registry, BENCHMARK_TAG)
+    metrics: dict[str, float] = {
+        "build.full.seconds": time_build(docker_client, builder, cache=False),
+        "build.cached.seconds": time_build(docker_client, builder, cache=True),
+    }
+    time_build(docker_client, builder, cache=True, tags=[reference], push=True)
+    docker_client.image.pull(reference, quiet=True)
+
+    layers: list[LayerSize] = get_layer_sizes(docker_client, reference)
+    metrics["image.size.bytes"] = sum(layer.size for layer in layers)
+    metrics["image.compressed_size.bytes"] = sum(
+        layer.compressed_size for layer in layers
+    )
+    metrics.update(get_layer_metrics(layers))
+
+    metrics["config_creator.seconds"] = time_config_creator()
+    metrics.update(time_cold_start(docker_client, reference))
+    metrics.update(time_cold_start(docker_client, reference, remove_wine_prefix=True))
+    return metrics, layers
+
+
+def write_results(
+    path: Path, metrics: Mapping[str, float], layers: Iterable[LayerSize]
+) -> None:
+    """Write the metrics and layer sizes of a benchmark run.
+
+    :param path:
+    :param metrics:
+    :param layers:
+    :return:
+    """
+    path.write_text(
+        json.dumps(
+            {"metrics": metrics, "layers": [asdict(layer) for layer in layers]},
+            indent=2,
+        )
+    )
+
+
+def load_baseline(path: Path) -> dict:
+    """Load the baseline metrics and their tolerances.
+
+    :param path:
+    :return:
+    """
+    return json.loads(path.read_text())
+
+
+def write_baseline(path: Path, metrics: Mapping[str, float]) -> None:
+    """Store metrics as the new baseline, keeping the tolerances.
+
+    :param path:
+    :param metrics:
+    :return:
+    """
+    baseline: dict = load_baseline(path) if path.exists() else {"tolerances": {}}
+    baseline["metrics"] = dict(sorted(metrics.items()))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(baseline, indent=2) + "\n")
+
+
+def get_tolerance(metric: str, tolerances: Mapping[str, float]) -> float:
+    """Return the tolerance of the first pattern matching a metric.
+
+    :param metric:
+    :param tolerances: relative tolerances by glob pattern of metric names
+    :return:
+    """
+    for pattern, tolerance in tolerances.items():
+        if fnmatchcase(metric, pattern):
+            return tolerance
+    return DEFAULT_TOLERANCE
+
+
+class BaselineError(ValueError):
+    """Baseline missing metrics of the results, so they cannot be checked."""
+
+
+def is_layer_metric(metric: str) -> bool:
+    """Check if a metric is the size of a single layer.
+
+    Layers come and go with Dockerfile changes, the image size metrics cover them.
+
+    :param metric:
+    :return:
+    """
+    return metric.startswith("layer.")
+
+
+def compare(metrics: Mapping[str, float], baseline: Mapping) -> list[Regression]:
+    """Return the metrics exceeding their baseline by more than the tolerance.
+
+    Layers only found in the results or only in the baseline are not compared.
+
+    :param metrics:
+    :param baseline:
+    :return:
+    :raises BaselineError: if the baseline and the results have different metrics
+    """
+    references: dict[str, float] = baseline.get("metrics", {})
+    if not references:
+        raise BaselineError(
+            "Baseline has no metrics, record them with run --update-baseline"
+        )
+    unknown: list[str] = sorted(
+        metric
+        for metric in set(metrics) - set(references)
+        if not is_layer_metric(metric)
+    )
+    if unknown:
+        raise BaselineError(f"Metrics missing in the baseline: {', '.join(unknown)}")
+    missing: list[str] = sorted(
+        metric
+        for metric in set(references) - set(metrics)
+        if not is_layer_metric(metric)
+    )
+    if missing:
+        raise BaselineError(f"Metrics missing in the results: {', '.join(missing)}")
+
+    tolerances: dict[str, float] = baseline.get("tolerances", {})
+    regressions: list[Regression] = []
+    for metric, reference in references.items():
+        if metric not in metrics:
+            continue
+        limit: float = reference * (1 + get_tolerance(metric, tolerances))
+        if metrics[metric] > limit:
+            regressions.append(Regression(metric, reference, metrics[metric], limit))
+    return regressions
+
+
+def check(metrics: Mapping[str, float], baseline_path: Path) -> None:
+    """Print the metrics and fail if any regressed.
+
+    The check is skipped until metrics are recorded in the baseline.
+
+    :param metrics:
+    :param baseline_path:
+    :return:
+    """
+    baseline: dict = load_baseline(baseline_path)
+    references: dict[str, float] = baseline.get("metrics", {})
+    for metric, value in sorted(metrics.items()):
+        reference: float | None = references.get(metric)
+        change: str = f" ({value / reference - 1:+.1%})" if reference else ""
+        if references and reference is None:
+            change = " (new)"
+        click.echo(f"{metric}: {value:g}{change}")
+    for metric in sorted(set(references) - set(metrics)):
+        click.echo(f"{metric}: removed")
+    if not references:
+        click.echo(
+            f"Skipped the check, {baseline_path} has no metrics. "
+            "Record them with run --update-baseline"
+        )
+        return
+    try:
+        regressions: list[Regression] = compare(metrics, baseline)
+    except BaselineError as e:
+        raise click.ClickException(str(e)) from e
+    if regressions:
+        raise click.ClickException(
+            "Regressions against the baseline:\n"
+            + "\n".join(str(regression) for regression in regressions)
+        )
+
+
+@click.group()
+def main() -> None:
+    """Benchmark the image and check the results against a stored baseline.
+
+    :return:
+    """
+
+
+@main.command(name="run")
+@click.option(
+    "--registry",
+    default="localhost:5000",
+    show_default=True,
+    help="Registry the benchmark image is pushed to",
+)
+@click.option(
+    "--results",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=RESULTS_PATH,
+    show_default=True,
+    help="Write the metrics and layer sizes to this file",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=BASELINE_PATH,
+    show_default=True,
+)
+@click.option(
+    "--update-baseline",
+    is_flag=True,
+    help="Store the results as the new baseline instead of checking them",
+)
+def run_command(
+    registry: str, results: Path, baseline: Path, update_baseline: bool
+) -> None:
+    """Benchmark building, pushing and starting the image.
+
+    :param registry:
+    :param results:
+    :param baseline:
+    :param update_baseline:
+    :return:
+    """
+    docker_client: DockerClient = DockerClient()
+    builder: Builder = docker_client.buildx.create(
+        driver="docker-container", driver_options=dict(network="host")
+    )
+    try:
+        metrics, layers = run_benchmarks(docker_client, builder, registry)
+    finally:
+        docker_client.buildx.stop(builder)
+        docker_client.buildx.remove(builder)
+
+    write_results(results, metrics, layers)
+    if update_baseline:
+        write_baseline(baseline, metrics)
+        click.echo(f"Baseline written to {baseline}")
+    else:
+        check(metrics, baseline)
+
+
+@main.command(name="check")
+@click.argument(
+    "results",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=BASELINE_PATH,
+    show_default=True,
+)
+def check_command(results: Path, baseline: Path) -> None:
+    """Check benchmark results against the baseline.
+
+    :param results:
+    :param baseline:
+    :return:
+    """
+    check(json.loads(results.read_text())["metrics"], baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,283 +1,959 @@
 """Config creator for Sons of the Forest"""
 # ruff: noqa: D400
 
+import argparse
+import hashlib
 import json
 import os
-from typing import Any, Callable
+import sys
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any
 
+SCHEMA_VERSION: int = 1
 
-def check_value(key: str, allowed_values: list, error_message: str) -> None:
+TYPE_NAMES: dict[type, str] = {
+    str: "String",
+    int: "Integer",
+    float: "Float",
+    bool: "Bool",
+}
+JSON_SCHEMA_TYPES: dict[type, str] = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+}
+SECTION_TITLES: dict[str | None, str] = {
+    None: "Server Configuration",
+    "GameSettings": "Game Configuration",
+    "CustomGameModeSettings": "Custom game mode settings",
+}
+
+
+class ConfigError(ValueError):
+    """Invalid settings, holding every error found in one validation pass"""
+
+    def __init__(self, errors: list[str]):
+        """
+        Initialize the error
+
+        :param errors:
+        """
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+@dataclass(frozen=True)
+class Setting:
+    """Config setting and the environment variable it is read from"""
+
+    env_var: str
+    key: str
+    type: type
+    default: Any
+    description: str
+    allowed_values: tuple[str, ...] | None = None
+    section: str | None = None
+    values: str | None = None
+
+
+def parse_bool(value: str) -> bool:
     """
-    Check if the value is valid
+    Parse a bool value
 
-    :param key:
-    :param allowed_values:
-    :param error_message:
+    :param value:
     :return:
     """
-    value = os.getenv(key)
-    if value not in allowed_values:
-        raise ValueError(f"Wrong Value! {key} needs {error_message}")
+    if value.lower() not in ["true", "false"]:
+        raise ValueError(f"{value} is not a bool")
+    return value.lower() == "true"
+
+
+PARSERS: dict[type, Callable[[str], Any]] = {
+    str: str,
+    int: int,
+    float: float,
+    bool: parse_bool,
+}
 
 
-def check_bool_value(key: str, default: bool = False) -> bool:
+def format_choices(values: Sequence[str]) -> str:
     """
-    Check bool value
+    Format allowed values as "A, B or C"
 
-    :param key:
-    :param default:
+    :param values:
     :return:
     """
-    value = os.getenv(key)
-    if value is None:
-        return default
-    return value.lower() in ["true"] if value else False
+    if len(values) == 1:
+        return values[0]
+    return f"{', '.join(values[:-1])} or {values[-1]}"
 
 
-def check_int_value(key: str, default: int = 0) -> int:
+def compile_setting(setting: Setting) -> Callable[[str], Any]:
     """
-    Check int value
+    Compile a setting into a validator converting its raw environment value
 
-    :param key:
-    :param default:
+    :param setting:
     :return:
     """
-    value = os.getenv(key)
-    if value is None:
-        return default
-    return int(value) if value else default
+    parser: Callable[[str], Any] = PARSERS[setting.type]
+    allowed: frozenset[str] | None = None
+    if setting.allowed_values:
+        allowed = frozenset(setting.allowed_values)
+        expected: str = format_choices(setting.allowed_values)
+    else:
+        expected = TYPE_NAMES[setting.type]
+    message: str = f"Wrong Value! {setting.env_var} needs {expected}"
 
+    def validate(value: str) -> Any:
+        if allowed is not None and value not in allowed:
+            raise ValueError(message)
+        try:
+            return parser(value)
+        except ValueError:
+            raise ValueError(message) from None
 
-def check_float_value(key: str, default: float = 1.0) -> float:
+    return validate
+
+
+def format_default(value: Any) -> str:
     """
-    Check float value
+    Format a default value for documentation
 
-    :param key:
-    :param default:
+    :param value:
     :return:
     """
-    value = os.getenv(key)
-    if value is None:
-        return default
-    return float(value) if value else default
-
-
-def set_game_setting(
-    config: dict[str, Any],
-    env_var: str,
-    setting_key: str,
-    value_check: [type | Callable],
-) -> None:
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+class ConfigSchema:
+    """Declarative config schema, compiled once into validators"""
+
+    def __init__(self, settings: Iterable[Setting]):
+        """
+        Initialize the schema
+
+        :param settings:
+        """
+        self.settings: tuple[Setting, ...] = tuple(settings)
+        self.sections: tuple[str, ...] = tuple(
+            dict.fromkeys(
+                setting.section for setting in self.settings if setting.section
+            )
+        )
+        self._validators: tuple[tuple[Setting, Callable[[str], Any]], ...] = tuple(
+            (setting, compile_setting(setting)) for setting in self.settings
+        )
+
+    def create_config(
+        self, environ: Mapping[str, str], defaults: bool = True
+    ) -> dict[str, Any]:
+        """
+        Create the config from a snapshot of the environment
+
+        Base settings fall back to their default, section settings are only set
+        when present in the environment. All invalid values are collected and
+        raised together.
+
+        :param environ:
+        :param defaults: set base settings missing in the environment to defaults
+        :return:
+        """
+        config: dict[str, Any] = {}
+        errors: list[str] = []
+
+        for setting, validate in self._validators:
+            target: dict[str, Any] = (
+                config.setdefault(setting.section, {}) if setting.section else config
+            )
+            value: str | None = environ.get(setting.env_var)
+            if value is None or (value == "" and setting.type is not str):
+                if defaults and setting.section is None:
+                    target[setting.key] = setting.default
+                continue
+            try:
+                target[setting.key] = validate(value)
+            except ValueError as e:
+                errors.append(str(e))
+
+        if errors:
+            raise ConfigError(errors)
+        return config
+
+    def snapshot(self, environ: Mapping[str, str]) -> dict[str, str]:
+        """
+        Return the environment variables used by the schema
+
+        :param environ:
+        :return:
+        """
+        return {
+            setting.env_var: environ[setting.env_var]
+            for setting in self.settings
+            if setting.env_var in environ
+        }
+
+    def validate(self, environ: Mapping[str, str]) -> list[str]:
+        """
+        Return all errors of a server definition
+
+        :param environ:
+        :return:
+        """
+        try:
+            self.create_config(environ)
+        except ConfigError as e:
+            return e.errors
+        return []
+
+    def json_schema(self) -> dict[str, Any]:
+        """
+        Export a JSON Schema of the created config
+
+        :return:
+        """
+        schema: dict[str, Any] = {
+            "$schema": "https://json-schema.org/draft/2020-12/schema",
+            "title": "Sons of the Forest dedicated server config",
+            "type": "object",
+            "properties": {},
+            "required": [],
+        }
+        for setting in self.settings:
+            properties: dict[str, Any] = {
+                "type": JSON_SCHEMA_TYPES[setting.type],
+                "default": setting.default,
+                "description": setting.description,
+            }
+            if setting.allowed_values:
+                properties["enum"] = list(setting.allowed_values)
+            if setting.section:
+                section: dict[str, Any] = schema["properties"].setdefault(
+                    setting.section,
+                    {"type": "object", "properties": {}, "additionalProperties": False},
+                )
+                section["properties"][setting.key] = properties
+            else:
+                schema["properties"][setting.key] = properties
+                schema["required"].append(setting.key)
+        schema["required"].extend(self.sections)
+        return schema
+
+    def markdown_table(self, section: str | None = None) -> str:
+        """
+        Export the settings of a section as Markdown table
+
+        :param section:
+        :return:
+        """
+        rows: list[list[str]] = [["Key", "Values", "Default Value", "Description"]]
+        for setting in self.settings:
+            if setting.section != section:
+                continue
+            values: str = setting.values or (
+                "<br/>".join(setting.allowed_values)
+                if setting.allowed_values
+                else TYPE_NAMES[setting.type]
+            )
+            rows.append(
+                [
+                    setting.env_var,
+                    values,
+                    format_default(setting.default),
+                    setting.description,
+                ]
+            )
+        widths: list[int] = [max(len(row[i]) for row in rows) for i in range(4)]
+        lines: list[str] = [
+            "| "
+            + " | ".join(cell.ljust(width) for cell, width in zip(row, widths))
+            + " |"
+            for row in rows
+        ]
+        lines.insert(1, "|" + "|".join("-" * (width + 2) for width in widths) + "|")
+        return "\n".join(lines)
+
+    def markdown(self) -> str:
+        """
+        Export all settings as Markdown tables with headings
+
+        :return:
+        """
+        return "\n\n".join(
+            f"### {SECTION_TITLES[section]}\n{self.markdown_table(section)}"
+            for section in (None, *self.sections)
+        )
+
+
+SETTINGS: tuple[Setting, ...] = (
+    Setting(
+        env_var="IPADDRESS",
+        key="IpAddress",
+        type=str,
+        default="0.0.0.0",
+        values="Any IPv4 address formatted string",
+        description=(
+            "Listening interface for the game server, usually 0.0.0.0 if "
+            "listening on all interfaces."
+        ),
+    ),
+    Setting(
+        env_var="GAMEPORT",
+        key="GamePort",
+        type=int,
+        default=8766,
+        description="UDP port used for gameplay netcode (Bolt).",
+    ),
+    Setting(
+        env_var="QUERYPORT",
+        key="QueryPort",
+        type=int,
+        default=27016,
+        description=(
+            "UDP port used by Steam to list the server and enable the discovery "
+            "services."
+        ),
+    ),
+    Setting(
+        env_var="BLOBSYNCPORT",
+        key="BlobSyncPort",
+        type=int,
+        default=9700,
+        description=(
+            "BlobSyncPort UDP port used by the BlobSync system to initialize "
+            "game systems and exchange data."
+        ),
+    ),
+    Setting(
+        env_var="SERVERNAME",
+        key="ServerName",
+        type=str,
+        default="My Sotf Server",
+        description=(
+            "Name of the server visible in the server list, and in the Steam contacts."
+        ),
+    ),
+    Setting(
+        env_var="MAXPLAYERS",
+        key="MaxPlayers",
+        type=int,
+        default=8,
+        description=(
+            "The maximum number of players allowed simultaneously on the "
+            "server. (1 - 8)"
+        ),
+    ),
+    Setting(
+        env_var="PASSWORD",
+        key="Password",
+        type=str,
+        default="",
+        description=(
+            "Adds a password to make your server “private”. Upon connection, "
+            "this password will be requested before the client can proceed. "
+            "(Max. 40 chars)"
+        ),
+    ),
+    Setting(
+        env_var="LANONLY",
+        key="LanOnly",
+        type=bool,
+        default=False,
+        description="Allows or restricts the server visibility to LAN only.",
+    ),
+    Setting(
+        env_var="SAVESLOT",
+        key="SaveSlot",
+        type=int,
+        default=1,
+        description=(
+            "When creating a new save, this number will be the id of the save."
+        ),
+    ),
+    Setting(
+        env_var="SAVEMODE",
+        key="SaveMode",
+        type=str,
+        default="Continue",
+        allowed_values=("New", "Continue"),
+        description=(
+            "Game save initialization mode.<br/>“**continue**”: will create a "
+            "new save on SaveSlot if it doesn't exist, or load it if it "
+            "exist.<br/>“**new**”: will create a new game, with a new game id, "
+            "and overwrite any game previously saved on the SaveSlot. If the "
+            "server stops and restarts, the previous save will be overwritten "
+            "for as long as the mode is set to “**new**”."
+        ),
+    ),
+    Setting(
+        env_var="GAMEMODE",
+        key="GameMode",
+        type=str,
+        default="Normal",
+        allowed_values=(
+            "Normal",
+            "Hard",
+            "Hardsurvival",
+            "Peaceful",
+            "Creative",
+            "Custom",
+        ),
+        description=(
+            "Sets the difficulty game mode when creating a new save. This "
+            "parameter is ignored if loading a save (save mode set to "
+            "“**continue**” with a save that exists on the slot). If the game "
+            "mode is set to “**custom**”, then the custom game mode settings "
+            "will be read from **CustomGameModeSettings** option, described "
+            "later."
+        ),
+    ),
+    Setting(
+        env_var="SAVEINTERVAL",
+        key="SaveInterval",
+        type=int,
+        default=600,
+        description=(
+            "How often the game server automatically saves the game to "
+            "SaveSlot, in seconds."
+        ),
+    ),
+    Setting(
+        env_var="IDLEDAYCYCLESPEED",
+        key="IdleDayCycleSpeed",
+        type=float,
+        default=0.0,
+        description=(
+            "A multiplier to how quickly the time passes compared to normal "
+            "gameplay when the server is considered idle (no player connected)."
+        ),
+    ),
+    Setting(
+        env_var="IDLETARGETFRAMERATE",
+        key="IdleTargetFramerate",
+        type=int,
+        default=5,
+        description=(
+            "Target framerate of the server when it's considered idle (no "
+            "player connected)."
+        ),
+    ),
+    Setting(
+        env_var="ACTIVETARGETFRAMERATE",
+        key="ActiveTargetFramerate",
+        type=int,
+        default=60,
+        description=(
+            "Target framerate of the server when it's NOT considered idle (one "
+            "or more player connected)."
+        ),
+    ),
+    Setting(
+        env_var="LOGFILESENABLED",
+        key="LogFilesEnabled",
+        type=bool,
+        default=True,
+        description=(
+            "Defines if the logs will be written to files. The logs will be "
+            "output in **<user data folder>/logs**."
+        ),
+    ),
+    Setting(
+        env_var="TIMESTAMPLOGFILENAMES",
+        key="TimestampLogFilenames",
+        type=bool,
+        default=True,
+        description=(
+            "Enabled log files timestamping.<br/>“**true**”: every time the "
+            "server runs will dump log output to a new file, with filename "
+            "having the following format: **sotf_log_{DateTime:yyyy-MM-dd_HH-"
+            "mm-ss}.txt** <br/>“**false**”: the filename will be sotf_log.txt "
+            "and previous log will be overwritten if it already exists."
+        ),
+    ),
+    Setting(
+        env_var="TIMESTAMPLOGENTRIES",
+        key="TimestampLogEntries",
+        type=bool,
+        default=True,
+        description="Enables each log entry written to file to be timestamped.",
+    ),
+    Setting(
+        env_var="SKIPNETWORKACCESSIBILITYTEST",
+        key="SkipNetworkAccessibilityTest",
+        type=bool,
+        default=False,
+        description=(
+            "Opt-out of network accessibility self tests: retrieval of the "
+            "public IP and listing on Steam Master Server, as well as port "
+            "accessibility check. Please note that only IPv4 is officially "
+            "supported."
+        ),
+    ),
+    Setting(
+        env_var="TREEREGROWTH",
+        key="Gameplay.TreeRegrowth",
+        type=bool,
+        default=True,
+        section="GameSettings",
+        description="Enable automatic tree regrowth, triggered when sleeping.",
+    ),
+    Setting(
+        env_var="STRUCTUREDAMAGE",
+        key="Structure.Damage",
+        type=bool,
+        default=True,
+        section="GameSettings",
+        description="Allow buildings to be damaged.",
+    ),
+    Setting(
+        env_var="CHEATS",
+        key="GameSetting.Multiplayer.Cheats",
+        type=bool,
+        default=False,
+        section="CustomGameModeSettings",
+        description="Allows cheats on the server.",
+    ),
+    Setting(
+        env_var="ENEMYSPAWN",
+        key="GameSetting.Vail.EnemySpawn",
+        type=bool,
+        default=True,
+        section="CustomGameModeSettings",
+        description="Enable enemies spawning.",
+    ),
+    Setting(
+        env_var="ENEMYHEALTH",
+        key="GameSetting.Vail.EnemyHealth",
+        type=str,
+        default="Normal",
+        allowed_values=("Low", "Normal", "High"),
+        section="CustomGameModeSettings",
+        description="Adjust enemy starting health.",
+    ),
+    Setting(
+        env_var="ENEMYDAMAGE",
+        key="GameSetting.Vail.EnemyDamage",
+        type=str,
+        default="Normal",
+        allowed_values=("Low", "Normal", "High"),
+        section="CustomGameModeSettings",
+        description="Adjust damage enemies can do.",
+    ),
+    Setting(
+        env_var="ENEMYARMOUR",
+        key="GameSetting.Vail.EnemyArmour",
+        type=str,
+        default="Normal",
+        allowed_values=("Low", "Normal", "High"),
+        section="CustomGameModeSettings",
+        description="Adjust enemies armor strength.",
+    ),
+    Setting(
+        env_var="ENEMYAGGRESSION",
+        key="GameSetting.Vail.EnemyAggression",
+        type=str,
+        default="Normal",
+        allowed_values=("Low", "Normal", "High"),
+        section="CustomGameModeSettings",
+        description="Adjust enemy aggression level.",
+    ),
+    Setting(
+        env_var="ANIMALSPAWNRATE",
+        key="GameSetting.Vail.AnimalSpawnRate",
+        type=str,
+        default="Normal",
+        allowed_values=("Low", "Normal", "High"),
+        section="CustomGameModeSettings",
+        description="Adjust animal spawn rate.",
+    ),
+    Setting(
+        env_var="ENEMYSEARCHPARTIES",
+        key="GameSetting.Vail.EnemySearchParties",
+        type=str,
+        default="Normal",
+        allowed_values=("Low", "Normal", "High"),
+        section="CustomGameModeSettings",
+        description="Adjust the frequency of enemy search parties.",
+    ),
+    Setting(
+        env_var="STARTINGSEASON",
+        key="GameSetting.Environment.StartingSeason",
+        type=str,
+        default="Summer",
+        allowed_values=("Spring", "Summer", "Autumn", "Winter"),
+        section="CustomGameModeSettings",
+        description="Set environmental starting season.",
+    ),
+    Setting(
+        env_var="SEASONLENGTH",
+        key="GameSetting.Environment.SeasonLength",
+        type=str,
+        default="Default",
+        allowed_values=("Short", "Default", "Long", "Realistic"),
+        section="CustomGameModeSettings",
+        description="Adjust season length.",
+    ),
+    Setting(
+        env_var="DAYLENGTH",
+        key="GameSetting.Environment.DayLength",
+        type=str,
+        default="Default",
+        allowed_values=("Short", "Default", "Long", "Realistic"),
+        section="CustomGameModeSettings",
+        description="Adjust day length.",
+    ),
+    Setting(
+        env_var="PRECIPITATIONFREQUENCY",
+        key="GameSetting.Environment.PrecipitationFrequency",
+        type=str,
+        default="Default",
+        allowed_values=("Low", "Default", "High"),
+        section="CustomGameModeSettings",
+        description="Adjust the frequency of rain and snow.",
+    ),
+    Setting(
+        env_var="CONSUMABLEEFFECTS",
+        key="GameSetting.Survival.ConsumableEffects",
+        type=str,
+        default="Normal",
+        allowed_values=("Normal", "Hard"),
+        section="CustomGameModeSettings",
+        description="Enable damage taken when low hydration and low fullness.",
+    ),
+    Setting(
+        env_var="PLAYERSTATSDAMAGE",
+        key="GameSetting.Survival.PlayerStatsDamage",
+        type=str,
+        default="Normal",
+        allowed_values=("Off", "Normal", "Hard"),
+        section="CustomGameModeSettings",
+        description="Enable damage from each bad or rotten food and drink.",
+    ),
+    Setting(
+        env_var="COLDPENALTIES",
+        key="GameSetting.Survival.ColdPenalties",
+        type=str,
+        default="Normal",
+        allowed_values=("Off", "Normal", "Hard"),
+        section="CustomGameModeSettings",
+        description=(
+            "Adjusts the severity that cold will affect health and stamina "
+            "regeneration."
+        ),
+    ),
+    Setting(
+        env_var="STATREGENERATIONPENALTY",
+        key="GameSetting.Survival.StatRegenerationPenalty",
+        type=str,
+        default="Normal",
+        allowed_values=("Off", "Normal", "Hard"),
+        section="CustomGameModeSettings",
+        description="Reduces the rate that health and stamina will regenerate.",
+    ),
+    Setting(
+        env_var="REDUCEDFOODINCONTAINERS",
+        key="GameSetting.Survival.ReducedFoodInContainers",
+        type=bool,
+        default=False,
+        section="CustomGameModeSettings",
+        description="Reduces the amount of food found in containers.",
+    ),
+    Setting(
+        env_var="SINGLEUSECONTAINERS",
+        key="GameSetting.Survival.SingleUseContainers",
+        type=bool,
+        default=True,
+        section="CustomGameModeSettings",
+        description="Containers can only be opened once.",
+    ),
+    Setting(
+        env_var="BUILDINGRESISTANCE",
+        key="GameSetting.Survival.BuildingResistance",
+        type=str,
+        default="Normal",
+        allowed_values=("Low", "Normal", "High"),
+        section="CustomGameModeSettings",
+        description="Adjust building resistance to attacks.",
+    ),
+    Setting(
+        env_var="CREATIVEMODE",
+        key="GameSetting.Survival.CreativeMode",
+        type=bool,
+        default=False,
+        section="CustomGameModeSettings",
+        description="Enable creative mode game.",
+    ),
+    Setting(
+        env_var="PLAYERSIMMORTALMODE",
+        key="GameSetting.Survival.PlayersImmortalMode",
+        type=bool,
+        default=False,
+        section="CustomGameModeSettings",
+        description="Enable god mode for all players.",
+    ),
+    Setting(
+        env_var="FORCEPLACEFULLLOAD",
+        key="GameSetting.FreeForm.ForcePlaceFullLoad",
+        type=bool,
+        default=False,
+        section="CustomGameModeSettings",
+        description=(
+            "If true, everything players have in hands will be placed in a "
+            "single click (stones, stone floors, wood floors)"
+        ),
+    ),
+    Setting(
+        env_var="NOCUTTINGSSPAWN",
+        key="GameSetting.Construction.NoCuttingsSpawn",
+        type=bool,
+        default=False,
+        section="CustomGameModeSettings",
+        description="If true, disable cuttings spawning.",
+    ),
+    Setting(
+        env_var="ONEHITTOCUTTREE",
+        key="GameSetting.Survival.OneHitToCutTrees",
+        type=bool,
+        default=False,
+        section="CustomGameModeSettings",
+        description="Enable chopping tree with a single hit.",
+    ),
+)
+
+
+CONFIG_SCHEMA: ConfigSchema = ConfigSchema(SETTINGS)
+
+
+def to_environ(definition: Mapping[str, Any]) -> dict[str, str]:
     """
-    Process game settings and custom game settings
+    Convert a server definition with JSON values to environment variable strings
 
-    :param config:
-    :param env_var:
-    :param setting_key:
-    :param value_check:
+    :param definition:
     :return:
     """
-    if env_var in os.environ:
-        value = os.getenv(env_var)
-        if value_check is bool:
-            value = check_bool_value(key=env_var)
-        elif value_check is int:
-            value = check_int_value(key=env_var)
-        elif value_check is float:
-            value = check_float_value(key=env_var)
-        elif callable(value_check):
-            value_check(value)
-        config[setting_key] = value
-
-
-def main() -> None:
+    return {
+        key: (str(value).lower() if isinstance(value, bool) else str(value))
+        for key, value in definition.items()
+    }
+
+
+def load_definitions(path: str) -> list[dict[str, str]]:
     """
-    Create config
+    Load server definitions from a JSON file holding one or a list of objects
 
+    :param path:
     :return:
     """
+    with open(path) as file:
+        data: dict | list[dict] = json.load(file)
+    if isinstance(data, dict):
+        data = [data]
+    return [to_environ(definition) for definition in data]
+
+
+def validate_files(paths: Sequence[str]) -> bool:
+    """
+    Validate server definitions in bulk and print all errors
+
+    :param paths:
+    :return:
+    """
+    total: int = 0
+    invalid: int = 0
+    for path in paths:
+        for index, definition in enumerate(load_definitions(path)):
+            total += 1
+            errors: list[str] = CONFIG_SCHEMA.validate(definition)
+            if errors:
+                invalid += 1
+            for error in errors:
+                print(f"{path}[{index}]: {error}", file=sys.stderr)
+    print(f"{total - invalid} of {total} server definitions are valid")
+    return invalid == 0
+
+
+def config_hash(environ: Mapping[str, str], merge: bool = False) -> str:
+    """
+    Hash the relevant environment, the schema version and the merge mode
+
+    :param environ:
+    :param merge:
+    :return:
+    """
+    payload: str = json.dumps(
+        {
+            "schema_version": SCHEMA_VERSION,
+            "merge": merge,
+            "environ": CONFIG_SCHEMA.snapshot(environ),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def content_digest(content: bytes) -> str:
+    """
+    Hash the content of a config file
+
+    :param content:
+    :return:
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def get_hash_path(path: Path) -> Path:
+    """
+    Return the path of the hash file stored beside the config
+
+    :param path:
+    :return:
+    """
+    return path.with_name(f"{path.name}.sha256")
+
+
+def write_atomic(path: Path, content: str) -> None:
+    """
+    Write a file by renaming a complete temporary file into place
+
+    :param path:
+    :param content:
+    :return:
+    """
+    with NamedTemporaryFile(
+        "w", dir=path.parent, prefix=f".{path.name}.", delete=False
+    ) as file:
+        try:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+            os.chmod(file.name, 0o644)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+def merge_settings(base: dict[str, Any], override: dict[str, Any]) -> dict[str, Any]:
+    """
+    Merge settings, descending into sections
+
+    :param base:
+    :param override:
+    :return:
+    """
+    merged: dict[str, Any] = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_settings(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def create_config_file(
+    path: Path, environ: Mapping[str, str], merge: bool = False
+) -> bool:
+    """
+    Write the config file unless it is unchanged since written from this environment
+
+    With merge, settings edited by the operator in the existing config file are
+    kept unless the environment sets them.
+
+    :param path:
+    :param environ:
+    :param merge:
+    :return: whether the config file was written
+    """
+    hash_path: Path = get_hash_path(path)
+    current_hash: str = config_hash(environ, merge)
     try:
-        config: dict[str, Any] = {}
+        # The file's digest catches edits and corruption since it was written
+        stored: list[str] = hash_path.read_text().split()
+        if stored == [current_hash, content_digest(path.read_bytes())]:
+            return False
+    except FileNotFoundError:
+        pass
 
-        # Base game configuration
-        config["IpAddress"] = os.getenv("IPADDRESS", "0.0.0.0")
-        config["GamePort"] = check_int_value("GAMEPORT", 8766)
-        config["QueryPort"] = check_int_value("QUERYPORT", 27016)
-        config["BlobSyncPort"] = check_int_value("BLOBSYNCPORT", 9700)
-        config["ServerName"] = os.getenv("SERVERNAME", "My Sotf Server")
-        config["MaxPlayers"] = check_int_value("MAXPLAYERS", 8)
-        config["Password"] = os.getenv("PASSWORD", "")
-        config["LanOnly"] = check_bool_value("LANONLY")
-        config["SaveSlot"] = check_int_value("SAVESLOT", 1)
-        check_value("SAVEMODE", [None, "New", "Continue"], "New or Continue")
-        config["SaveMode"] = os.getenv("SAVEMODE", "Continue")
-        check_value(
-            "GAMEMODE",
-            [None, "Normal", "Hard", "Hardsurvival", "Peaceful", "Creative", "Custom"],
-            "Normal, Hard, Hardsurvival, Peaceful, Creative or Custom",
-        )
-        config["GameMode"] = os.getenv("GAMEMODE", "Normal")
-        config["SaveInterval"] = check_int_value("SAVEINTERVAL", 600)
-        config["IdleDayCycleSpeed"] = check_float_value("IDLEDAYCYCLESPEED", 0.0)
-        config["IdleTargetFramerate"] = check_int_value("IDLETARGETFRAMERATE", 5)
-        config["ActiveTargetFramerate"] = check_int_value("ACTIVETARGETFRAMERATE", 60)
-        config["LogFilesEnabled"] = check_bool_value("LOGFILESENABLED", default=True)
-        config["TimestampLogFilenames"] = check_bool_value(
-            "TIMESTAMPLOGFILENAMES", default=True
-        )
-        config["TimestampLogEntries"] = check_bool_value(
-            "TIMESTAMPLOGENTRIES", default=True
-        )
-        config["SkipNetworkAccessibilityTest"] = check_bool_value(
-            "SKIPNETWORKACCESSIBILITYTEST"
+    config: dict[str, Any] = CONFIG_SCHEMA.create_config(environ)
+    if merge and path.exists():
+        try:
+            existing: dict[str, Any] = json.loads(path.read_text())
+        except json.JSONDecodeError as e:
+            raise ConfigError([f"Cannot merge {path}: {e}"]) from None
+        config = merge_settings(
+            merge_settings(config, existing),
+            CONFIG_SCHEMA.create_config(environ, defaults=False),
         )
 
-        # Game settings
-        config["GameSettings"] = {}
-        set_game_setting(
-            config["GameSettings"], "TREEREGROWTH", "Gameplay.TreeRegrowth", bool
-        )
-        set_game_setting(
-            config["GameSettings"], "STRUCTUREDAMAGE", "Structure.Damage", bool
-        )
+    content: str = json.dumps(config, indent=4) + "\n"
+    write_atomic(path, content)
+    write_atomic(hash_path, f"{current_hash}\n{content_digest(content.encode())}\n")
+    return True
 
-        # Custom game settings
-        config["CustomGameModeSettings"] = {}
-        settings_mapping = {
-            "CHEATS": ("GameSetting.Multiplayer.Cheats", bool),
-            "ENEMYSPAWN": ("GameSetting.Vail.EnemySpawn", str),
-            "ENEMYHEALTH": (
-                "GameSetting.Vail.EnemyHealth",
-                lambda x: check_value(
-                    "ENEMYHEALTH", ["Low", "Normal", "High"], "Low, Normal or High"
-                ),
-            ),
-            "ENEMYDAMAGE": (
-                "GameSetting.Vail.EnemyDamage",
-                lambda x: check_value(
-                    "ENEMYDAMAGE", ["Low", "Normal", "High"], "Low, Normal or High"
-                ),
-            ),
-            "ENEMYARMOUR": (
-                "GameSetting.Vail.EnemyArmour",
-                lambda x: check_value(
-                    "ENEMYARMOUR", ["Low", "Normal", "High"], "Low, Normal or High"
-                ),
-            ),
-            "ENEMYAGGRESSION": (
-                "GameSetting.Vail.EnemyAggression",
-                lambda x: check_value(
-                    "ENEMYAGGRESSION", ["Low", "Normal", "High"], "Low, Normal or High"
-                ),
-            ),
-            "ANIMALSPAWNRATE": (
-                "GameSetting.Vail.AnimalSpawnRate",
-                lambda x: check_value(
-                    "ANIMALSPAWNRATE", ["Low", "Normal", "High"], "Low, Normal or High"
-                ),
-            ),
-            "ENEMYSEARCHPARTIES": (
-                "GameSetting.Vail.EnemySearchParties",
-                lambda x: check_value(
-                    "ENEMYSEARCHPARTIES",
-                    ["Low", "Normal", "High"],
-                    "Low, Normal or High",
-                ),
-            ),
-            "STARTINGSEASON": (
-                "GameSetting.Environment.StartingSeason",
-                lambda x: check_value(
-                    "STARTINGSEASON",
-                    ["Spring", "Summer", "Autumn", "Winter"],
-                    "Spring, Summer, Autumn or Winter",
-                ),
-            ),
-            "SEASONLENGTH": (
-                "GameSetting.Environment.SeasonLength",
-                lambda x: check_value(
-                    "SEASONLENGTH",
-                    ["Short", "Default", "Long", "Realistic"],
-                    "Short, Default, Long or Realistic",
-                ),
-            ),
-            "DAYLENGTH": (
-                "GameSetting.Environment.DayLength",
-                lambda x: check_value(
-                    "DAYLENGTH",
-                    ["Short", "Default", "Long", "Realistic"],
-                    "Short, Default, Long or Realistic",
-                ),
-            ),
-            "PRECIPITATIONFREQUENCY": (
-                "GameSetting.Environment.PrecipitationFrequency",
-                lambda x: check_value(
-                    "PRECIPITATIONFREQUENCY",
-                    ["Low", "Default", "High"],
-                    "Low, Default or High",
-                ),
-            ),
-            "CONSUMABLEEFFECTS": (
-                "GameSetting.Survival.ConsumableEffects",
-                lambda x: check_value(
-                    "CONSUMABLEEFFECTS", ["Normal", "Hard"], "Normal or Hard"
-                ),
-            ),
-            "PLAYERSTATSDAMAGE": (
-                "GameSetting.Survival.PlayerStatsDamage",
-                lambda x: check_value(
-                    "PLAYERSTATSDAMAGE",
-                    ["Off", "Normal", "Hard"],
-                    "Off, Normal or Hard",
-                ),
-            ),
-            "COLDPENALTIES": (
-                "GameSetting.Survival.ColdPenalties",
-                lambda x: check_value(
-                    "COLDPENALTIES", ["Off", "Normal", "Hard"], "Off, Normal or Hard"
-                ),
-            ),
-            "STATREGENERATIONPENALTY": (
-                "GameSetting.Survival.StatRegenerationPenalty",
-                lambda x: check_value(
-                    "STATREGENERATIONPENALTY",
-                    ["Off", "Normal", "Hard"],
-                    "Off, Normal or Hard",
-                ),
-            ),
-            "REDUCEDFOODINCONTAINERS": (
-                "GameSetting.Survival.ReducedFoodInContainers",
-                bool,
-            ),
-            "SINGLEUSECONTAINERS": ("GameSetting.Survival.SingleUseContainers", bool),
-            "BUILDINGRESISTANCE": (
-                "GameSetting.Survival.BuildingResistance",
-                lambda x: check_value(
-                    "BUILDINGRESISTANCE",
-                    ["Low", "Normal", "High"],
-                    "Low, Normal or High",
-                ),
-            ),
-            "CREATIVEMODE": ("GameSetting.Survival.CreativeMode", bool),
-            "PLAYERSIMMORTALMODE": ("GameSetting.Survival.PlayersImmortalMode", bool),
-            "FORCEPLACEFULLLOAD": ("GameSetting.FreeForm.ForcePlaceFullLoad", bool),
-            "NOCUTTINGSSPAWN": ("GameSetting.Construction.NoCuttingsSpawn", bool),
-            "ONEHITTOCUTTREE": ("GameSetting.Survival.OneHitToCutTrees", bool),
-        }
 
-        for env_var, (setting_key, value_check) in settings_mapping.items():
-            set_game_setting(
-                config=config["CustomGameModeSettings"],
-                env_var=env_var,
-                setting_key=setting_key,
-                value_check=value_check,
-            )
+def main(argv: Sequence[str] = ()) -> None:
+    """
+    Create config
 
-        print(json.dumps(config, indent=4))
+    :param argv:
+    :return:
+    """
+    parser = argparse.ArgumentParser(
+        description="Create the Sons of the Forest dedicated server config"
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--json-schema", action="store_true", help="print the config JSON Schema"
+    )
+    group.add_argument(
+        "--markdown", action="store_true", help="print the settings as Markdown"
+    )
+    group.add_argument(
+        "--validate",
+        nargs="+",
+        metavar="FILE",
+        help="validate JSON files with server definitions",
+    )
+    group.add_argument(
+        "--output",
+        type=Path,
+        help="write the config to this file, skipping unchanged configs",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="keep operator edits of an existing config file written with --output",
+    )
+    args = parser.parse_args(list(argv))
 
-    except Exception as e:
-        print(f"Error: {e}")
-        exit(1)
+    if args.json_schema:
+        print(json.dumps(CONFIG_SCHEMA.json_schema(), indent=4))
+    elif args.markdown:
+        print(CONFIG_SCHEMA.markdown())
+    elif args.validate:
+        if not validate_files(args.validate):
+            exit(1)
+    else:
+        environ: dict[str, str] = dict(os.environ)
+        try:
+            if args.output:
+                if create_config_file(args.output, environ, merge=args.merge):
+                    print(f"Config written to {args.output}")
+                else:
+                    print(f"Config {args.output} is up to date")
+            else:
+                config: dict[str, Any] = CONFIG_SCHEMA.create_config(environ)
+                print(json.dumps(config, indent=4))
+        except ConfigError as e:
+            for error in e.errors:
+                print(f"Error: {error}", file=sys.stderr)
+            exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
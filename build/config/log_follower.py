@@ -0,0 +1,578 @@
+"""Follow the server's log files and print structured events"""
+# ruff: noqa: D400
+
+import argparse
+import ctypes
+import ctypes.util
+import gzip
+import json
+import os
+import re
+import select
+import shutil
+import signal
+import struct
+import sys
+import threading
+import time
+from collections.abc import Sequence
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from types import FrameType
+from typing import TextIO
+
+LOGS_DIR: Path = Path("/srv/sotf/userdata/logs")
+# sotf_log.txt, or sotf_log_{DateTime:yyyy-MM-dd_HH-mm-ss}.txt with timestamped names
+LOG_PATTERN: str = "sotf_log*.txt"
+READ_SIZE: int = 64 * 1024
+MAX_LINE_LENGTH: int = 16 * 1024
+
+IN_MODIFY: int = 0x00000002
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+INOTIFY_EVENT: struct.Struct = struct.Struct("iIII")
+
+TIMESTAMP: re.Pattern = re.compile(
+    r"^\[?(?P<time>\d{4}[-/.]\d{2}[-/.]\d{2}[ T_]\d{2}[:.-]\d{2}[:.-]\d{2}"
+    r"(?:[.,]\d+)?)\]?\s*"
+)
+# First match wins, so more specific patterns go first
+EVENT_PATTERNS: tuple[tuple[str, re.Pattern], ...] = (
+    (
+        "player_joined",
+        re.compile(
+            r"\bPlayer ['\"]?(?P<player>.+?)['\"]?(?: \((?P<steam_id>\d+)\))?"
+            r" (?:has )?(?:joined|connected)\b",
+            re.IGNORECASE,
+        ),
+    ),
+    (
+        "player_left",
+        re.compile(
+            r"\bPlayer ['\"]?(?P<player>.+?)['\"]?(?: \((?P<steam_id>\d+)\))?"
+            r" (?:has )?(?:left|disconnected)\b",
+            re.IGNORECASE,
+        ),
+    ),
+    (
+        "game_saved",
+        re.compile(r"\b(?:game saved|saving game|save (?:complete|finished))\b", re.I),
+    ),
+    ("error", re.compile(r"^(?:Error|Exception)\b|\b\w*Exception\b:|\bERROR\b")),
+)
+# Every event pattern contains one of these in lower case, other lines are not parsed
+EVENT_KEYWORDS: tuple[bytes, ...] = (b"player", b"sav", b"error", b"exception")
+
+
+def parse_line(line: str) -> dict | None:
+    """
+    Parse a log line into an event
+
+    :param line:
+    :return: event, or None for lines without one
+    """
+    timestamp: re.Match | None = TIMESTAMP.match(line)
+    message: str = line[timestamp.end() :] if timestamp else line
+    for event, pattern in EVENT_PATTERNS:
+        match: re.Match | None = pattern.search(message)
+        if match:
+            fields: dict = {
+                key: value for key, value in match.groupdict().items() if value
+            }
+            return {
+                "event": event,
+                "time": timestamp["time"] if timestamp else None,
+                **fields,
+                "message": message,
+            }
+    return None
+
+
+class Inotify:
+    """Wait for changes in a directory with inotify"""
+
+    def __init__(
+        self,
+        path: Path,
+        mask: int = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE,
+    ):
+        """
+        Watch a directory
+
+        :param path:
+        :param mask: inotify events to wait for
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd: int = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            errno: int = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {path}")
+
+    def wait(self, timeout: float) -> list[str]:
+        """
+        Wait for changes
+
+        :param timeout: seconds
+        :return: names of the changed files
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data: bytes = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        names: list[str] = []
+        offset: int = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            *_, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            names.append(os.fsdecode(data[offset : offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    def close(self) -> None:
+        """
+        Stop watching
+
+        :return:
+        """
+        os.close(self.fd)
+
+
+class Poller:
+    """Wait a fixed interval where inotify is not available"""
+
+    def __init__(self, interval: float = 0.5):
+        """
+        Initialize the poller
+
+        :param interval: seconds
+        """
+        self.interval = interval
+
+    def wait(self, timeout: float) -> list[str]:
+        """
+        Wait for the interval
+
+        :param timeout: seconds
+        :return: no names, the changes are unknown
+        """
+        time.sleep(min(timeout, self.interval))
+        return []
+
+    def close(self) -> None:
+        """
+        Nothing to close
+
+        :return:
+        """
+
+
+def create_watcher(directory: Path) -> Inotify | Poller:
+    """
+    Return an inotify watcher, or a poller if inotify is not available
+
+    :param directory:
+    :return:
+    """
+    try:
+        return Inotify(directory)
+    except (OSError, AttributeError):
+        return Poller()
+
+
+@dataclass
+class Retention:
+    """Policy for old log files, which the server does not write anymore"""
+
+    days: float = 14.0
+    files: int = 50
+    compress: bool = True
+
+
+def compress_file(path: Path) -> Path:
+    """
+    Compress a file with gzip, keeping its modification time
+
+    :param path:
+    :return: compressed file
+    """
+    compressed: Path = path.with_name(path.name + ".gz")
+    temporary: Path = path.with_name(f".{compressed.name}.tmp")
+    stat: os.stat_result = path.stat()
+    with path.open("rb") as source, gzip.open(temporary, "wb") as target:
+        shutil.copyfileobj(source, target, READ_SIZE)
+    os.utime(temporary, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    temporary.replace(compressed)
+    path.unlink()
+    return compressed
+
+
+def apply_retention(
+    directory: Path,
+    retention: Retention,
+    current: Path | None,
+    pattern: str = LOG_PATTERN,
+) -> dict[str, int]:
+    """
+    Compress old log files and remove the ones beyond the retention
+
+    :param directory:
+    :param retention:
+    :param current: log file the server writes to, which is kept as it is
+    :param pattern:
+    :return: number of compressed and removed files
+    """
+    result: dict[str, int] = {"compressed": 0, "removed": 0}
+    old: list[Path] = []
+    for path in [*directory.glob(pattern), *directory.glob(f"{pattern}.gz")]:
+        if path == current:
+            continue
+        try:
+            if retention.compress and path.suffix != ".gz":
+                path = compress_file(path)
+                result["compressed"] += 1
+            old.append(path)
+        except FileNotFoundError:
+            continue
+
+    old.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+    cutoff: float = time.time() - retention.days * 86400
+    for index, path in enumerate(old):
+        if index >= retention.files or path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            result["removed"] += 1
+    return result
+
+
+@dataclass
+class FollowStats:
+    """Work done by the log follower"""
+
+    files: int = 0
+    lines: int = 0
+    events: int = 0
+    bytes_read: int = 0
+
+
+class LogFollower:
+    """Follow the newest log file across rotations and print its events"""
+
+    def __init__(
+        self,
+        directory: Path,
+        pattern: str = LOG_PATTERN,
+        output: TextIO | None = None,
+        retention: Retention | None = None,
+        read_size: int = READ_SIZE,
+        max_line_length: int = MAX_LINE_LENGTH,
+    ):
+        """
+        Initialize the follower
+
+        :param directory:
+        :param pattern: names of the log files
+        :param output: stream for the JSON events, stdout if None
+        :param retention: policy applied whenever the server starts a new log file
+        :param read_size: bytes read at once
+        :param max_line_length: longer lines are cut, which bounds the memory used
+        """
+        self.directory = directory
+        self.pattern = pattern
+        self.output: TextIO = output or sys.stdout
+        self.retention = retention
+        self.read_size = read_size
+        self.max_line_length = max_line_length
+        self.path: Path | None = None
+        self.file = None
+        self.inode: int | None = None
+        self.buffer: bytearray = bytearray()
+        self.discarding: bool = False
+        self.stats: FollowStats = FollowStats()
+
+    def emit(self, event: str, **fields) -> None:
+        """
+        Write a JSON record of an event
+
+        :param event:
+        :param fields:
+        :return:
+        """
+        self.output.write(json.dumps({"event": event, **fields}) + "\n")
+
+    def newest(self) -> Path | None:
+        """
+        Return the log file the server writes to
+
+        :return:
+        """
+        newest: tuple | None = None
+        for path in self.directory.glob(self.pattern):
+            try:
+                key: tuple = (path.stat().st_mtime_ns, path.name)
+            except FileNotFoundError:
+                continue
+            if newest is None or key > newest[0]:
+                newest = (key, path)
+        return newest[1] if newest else None
+
+    def open(self, path: Path, at_end: bool = False) -> None:
+        """
+        Switch to a log file
+
+        :param path:
+        :param at_end: only follow lines written from now on
+        :return:
+        """
+        self.close()
+        try:
+            self.file = path.open("rb")
+        except FileNotFoundError:
+            return
+        self.path = path
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        if at_end:
+            self.file.seek(0, os.SEEK_END)
+        self.stats.files += 1
+
+    def close(self) -> None:
+        """
+        Close the current log file, handling a last line without newline
+
+        :return:
+        """
+        if self.file is None:
+            return
+        if self.buffer:
+            self.handle_line(bytes(self.buffer))
+        self.buffer.clear()
+        self.discarding = False
+        self.file.close()
+        self.file = None
+
+    def handle_line(self, line: bytes) -> None:
+        """
+        Print the event of a log line
+
+        :param line:
+        :return:
+        """
+        self.stats.lines += 1
+        self.parse(line)
+
+    def handle_lines(self, block: bytes) -> None:
+        """
+        Print the events of complete log lines
+
+        Only the lines containing an event keyword are decoded and parsed.
+
+        :param block: lines ending with a newline
+        :return:
+        """
+        self.stats.lines += block.count(b"\n")
+        lowered: bytes = block.lower()
+        starts: set[int] = set()
+        for keyword in EVENT_KEYWORDS:
+            position: int = lowered.find(keyword)
+            while position >= 0:
+                starts.add(lowered.rfind(b"\n", 0, position) + 1)
+                position = lowered.find(keyword, lowered.find(b"\n", position))
+        for start in sorted(starts):
+            end: int = block.find(b"\n", start)
+            self.parse(block[start : min(end, start + self.max_line_length)])
+
+    def parse(self, line: bytes) -> None:
+        """
+        Print the event of a log line, if it has one
+
+        :param line:
+        :return:
+        """
+        event: dict | None = parse_line(
+            line.decode("utf-8", errors="replace").rstrip("\r")
+        )
+        if event is not None:
+            self.stats.events += 1
+            self.emit(**event, file=self.path.name)
+
+    def feed(self, data: bytes) -> None:
+        """
+        Split read data into lines
+
+        :param data:
+        :return:
+        """
+        if self.discarding:
+            end: int = data.find(b"\n")
+            if end < 0:
+                return
+            self.discarding = False
+            data = data[end + 1 :]
+        self.buffer += data
+        end = self.buffer.rfind(b"\n")
+        if end >= 0:
+            self.handle_lines(bytes(self.buffer[: end + 1]))
+            del self.buffer[: end + 1]
+        if len(self.buffer) > self.max_line_length:
+            self.handle_line(bytes(self.buffer[: self.max_line_length]))
+            self.buffer.clear()
+            self.discarding = True
+
+    def read(self) -> int:
+        """
+        Read everything written to the current log file since the last read
+
+        :return: bytes read
+        """
+        if self.file is None:
+            return 0
+        total: int = 0
+        while data := self.file.read(self.read_size):
+            total += len(data)
+            self.feed(data)
+        self.stats.bytes_read += total
+        return total
+
+    def check_rotation(self) -> None:
+        """
+        Switch files when the server starts a new one, or replaces or truncates it
+
+        :return:
+        """
+        if self.path is not None:
+            try:
+                stat: os.stat_result | None = self.path.stat()
+            except FileNotFoundError:
+                stat = None
+            if stat is None or stat.st_ino != self.inode:
+                self.read()
+                self.close()
+                self.path = None
+            elif stat.st_size < self.file.tell():
+                self.emit("log_truncated", file=self.path.name)
+                self.open(self.path)
+
+        newest: Path | None = self.newest()
+        if newest is not None and newest != self.path:
+            self.read()
+            self.follow(newest)
+
+    def follow(self, path: Path, at_end: bool = False) -> None:
+        """
+        Switch to a new log file and apply the retention to the older ones
+
+        :param path:
+        :param at_end: only follow lines written from now on
+        :return:
+        """
+        self.open(path, at_end)
+        self.emit("log_file", file=path.name)
+        if self.retention is not None:
+            result: dict[str, int] = apply_retention(
+                self.directory, self.retention, path, self.pattern
+            )
+            if any(result.values()):
+                self.emit("log_retention", **result)
+
+    def poll(self) -> None:
+        """
+        Handle rotations and read new lines
+
+        :return:
+        """
+        self.check_rotation()
+        self.read()
+        self.output.flush()
+
+    def run(
+        self,
+        stop: threading.Event,
+        from_start: bool = False,
+        since: float | None = None,
+    ) -> None:
+        """
+        Follow the logs until stopped
+
+        :param stop:
+        :param from_start: read the current log file from its start
+        :param since: read the current log file from its start if it was written
+            after this time, in seconds since the epoch
+        :return:
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        watcher: Inotify | Poller = create_watcher(self.directory)
+        current: Path | None = self.newest()
+        if current is not None:
+            written: bool = since is not None and current.stat().st_mtime >= since
+            self.follow(current, at_end=not (from_start or written))
+        try:
+            while True:
+                self.poll()
+                if stop.is_set():
+                    break
+                watcher.wait(timeout=1.0)
+        finally:
+            watcher.close()
+            self.close()
+            self.output.flush()
+
+
+def main(argv: Sequence[str] = ()) -> None:
+    """
+    Follow the logs, or print the events of existing log files
+
+    :param argv:
+    :return:
+    """
+    parser = argparse.ArgumentParser(
+        description="Print events of the server's log files as JSON lines"
+    )
+    parser.add_argument("--logs", type=Path, default=LOGS_DIR)
+    parser.add_argument("--pattern", default=LOG_PATTERN)
+    parser.add_argument(
+        "--from-start", action="store_true", help="read the current log file"
+    )
+    parser.add_argument(
+        "--since",
+        type=float,
+        help="read the current log file if it was written after this Unix time",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="read the current log file and exit"
+    )
+    parser.add_argument("--retention-days", type=float, default=14.0)
+    parser.add_argument("--retention-files", type=int, default=50)
+    parser.add_argument(
+        "--no-compress", action="store_true", help="do not gzip old log files"
+    )
+    args = parser.parse_args(list(argv))
+
+    follower = LogFollower(
+        args.logs,
+        args.pattern,
+        retention=Retention(
+            args.retention_days, args.retention_files, not args.no_compress
+        ),
+    )
+    stop: threading.Event = threading.Event()
+    if args.once:
+        stop.set()
+        follower.run(stop, from_start=True)
+        return
+
+    def handle_signal(signum: int, frame: FrameType | None) -> None:
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    follower.run(stop, from_start=args.from_start, since=args.since)
+    follower.emit("log_follower", **asdict(follower.stats))
+    follower.output.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,490 @@
+"""Incremental, deduplicated snapshots of Sons of the Forest saves"""
+# ruff: noqa: D400
+
+import argparse
+import hashlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import zlib
+from collections.abc import Sequence
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime
+from pathlib import Path, PurePosixPath
+from tempfile import NamedTemporaryFile
+from types import FrameType
+
+USERDATA_DIR: Path = Path("/srv/sotf/userdata")
+REPOSITORY_DIR: Path = Path("/srv/sotf/snapshots")
+CHUNK_SIZE: int = 256 * 1024
+SNAPSHOT_ID_FORMAT: str = "%Y%m%dT%H%M%S.%fZ"
+
+Signature = dict[str, tuple[int, int]]
+
+
+@dataclass
+class SnapshotStats:
+    """Work done by a snapshot or restore"""
+
+    files: int = 0
+    files_unchanged: int = 0
+    bytes_read: int = 0
+    bytes_stored: int = 0
+    chunks_stored: int = 0
+    duration: float = 0.0
+
+
+class RateLimiter:
+    """Token bucket limiting the bytes read and written per second"""
+
+    def __init__(self, bytes_per_second: int):
+        """
+        Initialize the limiter
+
+        :param bytes_per_second: 0 for no limit
+        """
+        self.bytes_per_second = bytes_per_second
+        self.allowance: float = bytes_per_second
+        self.updated: float = time.monotonic()
+
+    def consume(self, size: int) -> None:
+        """
+        Wait until size bytes may be transferred
+
+        :param size:
+        :return:
+        """
+        if self.bytes_per_second <= 0:
+            return
+        now: float = time.monotonic()
+        self.allowance = min(
+            self.bytes_per_second,
+            self.allowance + (now - self.updated) * self.bytes_per_second,
+        )
+        self.updated = now
+        self.allowance -= size
+        if self.allowance < 0:
+            time.sleep(-self.allowance / self.bytes_per_second)
+
+
+def write_atomic(path: Path, content: bytes) -> None:
+    """
+    Write a file by renaming a complete temporary file into place
+
+    :param path:
+    :param content:
+    :return:
+    """
+    with NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", delete=False
+    ) as file:
+        try:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+def find_save_dir(userdata: Path, slot: int) -> Path | None:
+    """
+    Return the save directory of a SaveSlot, named by the zero-padded slot number
+
+    :param userdata:
+    :param slot:
+    :return:
+    """
+    saves: Path = userdata / "Saves"
+    if not saves.is_dir():
+        return None
+    candidates: list[Path] = [
+        path
+        for path in saves.rglob("*")
+        if path.is_dir()
+        and path.name.isdigit()
+        and int(path.name) == slot
+        and any(child.is_file() for child in path.iterdir())
+    ]
+    return max(candidates, key=lambda path: path.stat().st_mtime, default=None)
+
+
+def get_slot(path: str) -> int:
+    """
+    Return the SaveSlot of a save path relative to the user data
+
+    :param path:
+    :return:
+    """
+    return int(PurePosixPath(path).name)
+
+
+def scan(directory: Path) -> Signature:
+    """
+    Return size and modification time of every file below a directory
+
+    :param directory:
+    :return:
+    """
+    signature: Signature = {}
+    for path in sorted(directory.rglob("*")):
+        if path.is_file() and not path.name.startswith("."):
+            stat: os.stat_result = path.stat()
+            signature[path.relative_to(directory).as_posix()] = (
+                stat.st_size,
+                stat.st_mtime_ns,
+            )
+    return signature
+
+
+class Repository:
+    """
+    Snapshots stored as manifests of content-addressed, compressed chunks
+
+    Chunks are named by the SHA-256 of their content, so every chunk is stored
+    once however many snapshots contain it. Files whose size and modification
+    time did not change since the last snapshot are not even read.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        rate_limiter: RateLimiter | None = None,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        """
+        Initialize the repository
+
+        :param path:
+        :param rate_limiter: limiter for the I/O of snapshots
+        :param chunk_size:
+        """
+        self.path = path
+        self.rate_limiter = rate_limiter or RateLimiter(0)
+        self.chunk_size = chunk_size
+        self.chunks_dir: Path = path / "chunks"
+        self.snapshots_dir: Path = path / "snapshots"
+
+    def chunk_path(self, digest: str) -> Path:
+        """
+        Return the path of a chunk
+
+        :param digest:
+        :return:
+        """
+        return self.chunks_dir / digest[:2] / digest
+
+    def store_chunk(self, data: bytes, stats: SnapshotStats) -> str:
+        """
+        Store a chunk unless it is already stored
+
+        :param data:
+        :param stats:
+        :return: digest of the chunk
+        """
+        digest: str = hashlib.sha256(data).hexdigest()
+        path: Path = self.chunk_path(digest)
+        if not path.exists():
+            compressed: bytes = zlib.compress(data)
+            self.rate_limiter.consume(len(compressed))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(path, compressed)
+            stats.bytes_stored += len(compressed)
+            stats.chunks_stored += 1
+        return digest
+
+    def load_chunk(self, digest: str) -> bytes:
+        """
+        Load a chunk
+
+        :param digest:
+        :return:
+        """
+        return zlib.decompress(self.chunk_path(digest).read_bytes())
+
+    def snapshots(self, slot: int | None = None) -> list[str]:
+        """
+        Return the IDs of all snapshots, oldest first
+
+        :param slot: only return the snapshots of this SaveSlot
+        :return:
+        """
+        if not self.snapshots_dir.is_dir():
+            return []
+        snapshots: list[str] = sorted(
+            path.stem for path in self.snapshots_dir.glob("*.json")
+        )
+        if slot is None:
+            return snapshots
+        return [
+            snapshot_id
+            for snapshot_id in snapshots
+            if get_slot(self.load_manifest(snapshot_id)["path"]) == slot
+        ]
+
+    def load_manifest(self, snapshot_id: str) -> dict:
+        """
+        Load the manifest of a snapshot
+
+        :param snapshot_id:
+        :return:
+        """
+        return json.loads((self.snapshots_dir / f"{snapshot_id}.json").read_text())
+
+    def find_snapshot(self, selector: str = "latest", slot: int | None = None) -> str:
+        """
+        Return the snapshot ID for a selector
+
+        :param selector: "latest", a snapshot ID, or an ISO time selecting the last
+            snapshot taken at or before it
+        :param slot: only select snapshots of this SaveSlot
+        :return:
+        """
+        snapshots: list[str] = self.snapshots(slot)
+        if selector in snapshots:
+            return selector
+        if slot is not None and selector in self.snapshots():
+            raise LookupError(f"Snapshot {selector} is not of SaveSlot {slot}")
+        if selector == "latest":
+            candidates: list[str] = snapshots
+        else:
+            at: datetime = datetime.fromisoformat(selector)
+            if at.tzinfo is None:
+                at = at.replace(tzinfo=UTC)
+            limit: str = at.astimezone(UTC).strftime(SNAPSHOT_ID_FORMAT)
+            candidates = [snapshot for snapshot in snapshots if snapshot <= limit]
+        if not candidates:
+            raise LookupError(f"No snapshot found for {selector}")
+        return candidates[-1]
+
+    def create_snapshot(
+        self, directory: Path, relative_to: Path
+    ) -> tuple[str | None, SnapshotStats]:
+        """
+        Snapshot a save directory, reusing the chunks of unchanged files
+
+        The snapshot is discarded if a file changes while it is being read.
+
+        :param directory: save directory
+        :param relative_to: directory the save directory is restored relative to
+        :return: ID of the snapshot, None if discarded, and its statistics
+        """
+        started: float = time.monotonic()
+        stats: SnapshotStats = SnapshotStats()
+        path: str = directory.relative_to(relative_to).as_posix()
+        previous: dict = {}
+        # Other slots share the repository, compare with this save's last snapshot
+        for previous_id in reversed(self.snapshots()):
+            manifest: dict = self.load_manifest(previous_id)
+            if manifest["path"] == path:
+                previous = manifest["files"]
+                break
+
+        signature: Signature = scan(directory)
+        files: dict[str, dict] = {}
+        for name, (size, mtime_ns) in signature.items():
+            stats.files += 1
+            entry: dict | None = previous.get(name)
+            if entry and (entry["size"], entry["mtime_ns"]) == (size, mtime_ns):
+                stats.files_unchanged += 1
+                files[name] = entry
+                continue
+            chunks: list[str] = []
+            with open(directory / name, "rb") as file:
+                while data := file.read(self.chunk_size):
+                    self.rate_limiter.consume(len(data))
+                    stats.bytes_read += len(data)
+                    chunks.append(self.store_chunk(data, stats))
+            files[name] = {
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "mode": (directory / name).stat().st_mode & 0o777,
+                "chunks": chunks,
+            }
+
+        stats.duration = time.monotonic() - started
+        if scan(directory) != signature:
+            return None, stats
+
+        snapshot_id: str = datetime.now(UTC).strftime(SNAPSHOT_ID_FORMAT)
+        manifest = {"id": snapshot_id, "path": path, "files": files}
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        write_atomic(
+            self.snapshots_dir / f"{snapshot_id}.json",
+            json.dumps(manifest, sort_keys=True).encode(),
+        )
+        stats.duration = time.monotonic() - started
+        return snapshot_id, stats
+
+    def restore(self, snapshot_id: str, relative_to: Path) -> SnapshotStats:
+        """
+        Restore a save directory exactly to a snapshot
+
+        Files matching the snapshot are kept, files not in the snapshot removed.
+
+        :param snapshot_id:
+        :param relative_to: directory the save directory is restored relative to
+        :return:
+        """
+        started: float = time.monotonic()
+        stats: SnapshotStats = SnapshotStats()
+        manifest: dict = self.load_manifest(snapshot_id)
+        directory: Path = relative_to / manifest["path"]
+        directory.mkdir(parents=True, exist_ok=True)
+        current: Signature = scan(directory)
+
+        for name, entry in manifest["files"].items():
+            stats.files += 1
+            if current.get(name) == (entry["size"], entry["mtime_ns"]):
+                stats.files_unchanged += 1
+                continue
+            path: Path = directory / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            content: bytes = b"".join(
+                self.load_chunk(chunk) for chunk in entry["chunks"]
+            )
+            write_atomic(path, content)
+            os.chmod(path, entry["mode"])
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            stats.bytes_read += len(content)
+
+        for name in current.keys() - manifest["files"].keys():
+            (directory / name).unlink()
+        stats.duration = time.monotonic() - started
+        return stats
+
+
+def log_event(event: str, **fields) -> None:
+    """
+    Print a JSON record of an event
+
+    :param event:
+    :param fields:
+    :return:
+    """
+    print(json.dumps({"event": event, **fields}), flush=True)
+
+
+def watch(
+    repository: Repository,
+    userdata: Path,
+    slot: int,
+    stop: threading.Event,
+    interval: float = 5.0,
+    settle: float = 10.0,
+) -> None:
+    """
+    Snapshot the save directory after each completed save
+
+    A save counts as completed once its files did not change for settle seconds.
+    A last snapshot is taken when stopped, after the game saved on shutdown.
+
+    :param repository:
+    :param userdata:
+    :param slot:
+    :param stop:
+    :param interval: seconds between checks of the save directory
+    :param settle: seconds the files must be unchanged
+    :return:
+    """
+    snapshotted: Signature | None = None
+    seen: Signature | None = None
+    changed: float = time.monotonic()
+    while True:
+        stopping: bool = stop.wait(interval)
+        directory: Path | None = find_save_dir(userdata, slot)
+        if directory is not None:
+            signature: Signature = scan(directory)
+            if signature != seen:
+                seen = signature
+                changed = time.monotonic()
+            if signature != snapshotted and (
+                stopping or time.monotonic() - changed >= settle
+            ):
+                snapshot_id, stats = repository.create_snapshot(directory, userdata)
+                if snapshot_id is not None:
+                    snapshotted = signature
+                    log_event("snapshot", id=snapshot_id, **asdict(stats))
+        if stopping:
+            return
+
+
+def main(argv: Sequence[str] = ()) -> None:
+    """
+    Create, watch, list and restore snapshots
+
+    :param argv:
+    :return:
+    """
+    parser = argparse.ArgumentParser(
+        description="Incremental, deduplicated snapshots of the server's saves"
+    )
+    parser.add_argument("--repository", type=Path, default=REPOSITORY_DIR)
+    parser.add_argument("--userdata", type=Path, default=USERDATA_DIR)
+    parser.add_argument("--slot", type=int, default=1, help="SaveSlot of the save")
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=8 * 1024 * 1024,
+        help="bytes per second read and written by snapshots, 0 for no limit",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="snapshot the save now")
+    watch_parser = commands.add_parser("watch", help="snapshot every completed save")
+    watch_parser.add_argument("--interval", type=float, default=5.0)
+    watch_parser.add_argument("--settle", type=float, default=10.0)
+    commands.add_parser("list", help="list snapshots")
+    restore_parser = commands.add_parser("restore", help="restore a snapshot")
+    restore_parser.add_argument(
+        "snapshot",
+        nargs="?",
+        default="latest",
+        help="snapshot ID, ISO time of the latest snapshot to restore, or latest",
+    )
+    args = parser.parse_args(list(argv))
+
+    repository: Repository = Repository(args.repository, RateLimiter(args.rate_limit))
+    if args.command == "create":
+        directory: Path | None = find_save_dir(args.userdata, args.slot)
+        if directory is None:
+            print(f"Error: No save found for SaveSlot {args.slot}", file=sys.stderr)
+            exit(1)
+        snapshot_id, stats = repository.create_snapshot(directory, args.userdata)
+        if snapshot_id is None:
+            print("Error: Save changed during the snapshot", file=sys.stderr)
+            exit(1)
+        log_event("snapshot", id=snapshot_id, **asdict(stats))
+    elif args.command == "watch":
+        # Stay in the background of the game server
+        os.nice(10)
+        stop: threading.Event = threading.Event()
+
+        def handle_signal(signum: int, frame: FrameType | None) -> None:
+            stop.set()
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+        watch(repository, args.userdata, args.slot, stop, args.interval, args.settle)
+    elif args.command == "list":
+        for snapshot_id in repository.snapshots(args.slot):
+            files: dict = repository.load_manifest(snapshot_id)["files"]
+            size: int = sum(entry["size"] for entry in files.values())
+            print(f"{snapshot_id} {len(files)} files {size} bytes")
+    elif args.snapshot == "latest" and not repository.snapshots(args.slot):
+        print("No snapshots to restore")
+    else:
+        try:
+            snapshot_id = repository.find_snapshot(args.snapshot, args.slot)
+        except (LookupError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            exit(1)
+        stats = repository.restore(snapshot_id, args.userdata)
+        log_event("restore", id=snapshot_id, **asdict(stats))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
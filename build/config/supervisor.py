@@ -0,0 +1,878 @@
+"""Startup supervisor for the Sons of the Forest dedicated server"""
+# ruff: noqa: D400
+
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+DISPLAY: str = ":99"
+SOTF_DIR: Path = Path("/srv/sotf")
+USERDATA_DIR: Path = SOTF_DIR / "userdata"
+CONFIG_PATH: Path = USERDATA_DIR / "dedicatedserver.cfg"
+CONFIG_CREATOR: Path = Path(__file__).with_name("config_creator.py")
+SNAPSHOT: Path = Path(__file__).with_name("snapshot.py")
+LOG_FOLLOWER: Path = Path(__file__).with_name("log_follower.py")
+XVFB_COMMAND: tuple[str, ...] = ("Xvfb",)
+WINEBOOT_COMMAND: tuple[str, ...] = ("wineboot", "-r")
+WINESERVER_COMMAND: tuple[str, ...] = ("wineserver", "-w")
+WINE_INF_PATHS: tuple[Path, ...] = (
+    Path("/usr/share/wine/wine.inf"),
+    Path("/usr/lib/wine/wine.inf"),
+)
+GAME_COMMAND: tuple[str, ...] = (
+    "wine",
+    str(SOTF_DIR / "SonsOfTheForestDS.exe"),
+    "-userdatapath",
+    str(USERDATA_DIR),
+)
+
+PROC_NET_UDP: tuple[Path, ...] = (Path("/proc/net/udp"), Path("/proc/net/udp6"))
+CGROUP_ROOT: Path = Path("/sys/fs/cgroup")
+A2S_INFO: bytes = b"\xff\xff\xff\xffTSource Engine Query\x00"
+
+
+class StartupError(RuntimeError):
+    """A startup phase failed"""
+
+
+def parse_bool(value: str) -> bool:
+    """
+    Parse a bool value
+
+    :param value:
+    :return:
+    """
+    if value.lower() not in ["true", "false"]:
+        raise ValueError(f"{value} is not a bool")
+    return value.lower() == "true"
+
+
+def parse_positive(parser: Callable[[str], Any]) -> Callable[[str], Any]:
+    """
+    Return a parser rejecting negative numbers
+
+    :param parser:
+    :return:
+    """
+
+    def parse(value: str) -> Any:
+        number = parser(value)
+        if number < 0:
+            raise ValueError(f"{value} is negative")
+        return number
+
+    return parse
+
+
+# Environment variable: parser, default and expected value for error messages
+SETTINGS: dict[str, tuple[Callable[[str], Any], str, str]] = {
+    "MERGECONFIG": (parse_bool, "false", "true or false"),
+    "HIBERNATEAFTER": (parse_positive(float), "0", "seconds"),
+    # Server browsers query public servers all the time, which would wake them
+    "HIBERNATEWAKEONQUERY": (parse_bool, "false", "true or false"),
+    "SNAPSHOTS": (parse_bool, "false", "true or false"),
+    "SNAPSHOTRATELIMIT": (parse_positive(int), str(8 * 1024 * 1024), "bytes"),
+    "LOGEVENTS": (parse_bool, "false", "true or false"),
+    "LOGRETENTIONDAYS": (parse_positive(float), "14", "days"),
+    "LOGRETENTIONFILES": (parse_positive(int), "50", "a number of files"),
+}
+
+
+def read_settings(environ: Mapping[str, str]) -> dict[str, Any]:
+    """
+    Read the supervisor settings from the environment
+
+    :param environ:
+    :return:
+    """
+    settings: dict[str, Any] = {}
+    errors: list[str] = []
+    for env_var, (parser, default, expected) in SETTINGS.items():
+        try:
+            settings[env_var] = parser(environ.get(env_var) or default)
+        except ValueError:
+            errors.append(f"Wrong Value! {env_var} needs {expected}")
+    if errors:
+        raise ValueError("\n".join(errors))
+    return settings
+
+
+def get_wine_prefix(environ: Mapping[str, str]) -> Path:
+    """
+    Return the Wine prefix used by the server
+
+    :param environ:
+    :return:
+    """
+    if "WINEPREFIX" in environ:
+        return Path(environ["WINEPREFIX"])
+    return Path(environ.get("HOME", str(Path.home()))) / ".wine"
+
+
+def wine_prefix_is_current(
+    prefix: Path, wine_inf_paths: Sequence[Path] = WINE_INF_PATHS
+) -> bool:
+    """
+    Check if the Wine prefix is initialized and up to date with the installed Wine
+
+    Wine stores the modification time of its wine.inf in .update-timestamp and
+    updates the prefix when they differ.
+
+    :param prefix:
+    :param wine_inf_paths: candidate locations of the installed wine.inf
+    :return:
+    """
+    if not (prefix / "system.reg").exists():
+        return False
+    for wine_inf in wine_inf_paths:
+        if wine_inf.exists():
+            try:
+                timestamp: str = (prefix / ".update-timestamp").read_text().split()[0]
+            except (FileNotFoundError, IndexError):
+                return False
+            return timestamp in ("disable", str(int(wine_inf.stat().st_mtime)))
+    return True
+
+
+def query_player_count(address: tuple[str, int], timeout: float = 1.0) -> int | None:
+    """
+    Return the number of players from an A2S_INFO query, None if not answered
+
+    :param address: host and query port
+    :param timeout:
+    :return:
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            sock.sendto(A2S_INFO, address)
+            response: bytes = sock.recv(1400)
+            if response[4:5] == b"A":
+                sock.sendto(A2S_INFO + response[5:9], address)
+                response = sock.recv(1400)
+    except OSError:
+        return None
+    if response[4:5] != b"I":
+        return None
+    try:
+        # Skip protocol, name, map, folder, game and app ID
+        offset: int = 6
+        for _ in range(4):
+            offset = response.index(b"\x00", offset) + 1
+        return response[offset + 2]
+    except (ValueError, IndexError):
+        return None
+
+
+def read_receive_queue(
+    ports: Iterable[int], paths: Sequence[Path] = PROC_NET_UDP
+) -> int:
+    """
+    Return the bytes waiting in the receive queues of UDP sockets on these ports
+
+    :param ports: local ports
+    :param paths: socket tables of the network namespace
+    :return:
+    """
+    wanted: set[int] = set(ports)
+    queued: int = 0
+    for path in paths:
+        try:
+            lines: list[str] = path.read_text().splitlines()[1:]
+        except FileNotFoundError:
+            continue
+        for line in lines:
+            fields: list[str] = line.split()
+            if int(fields[1].rsplit(":", 1)[1], 16) in wanted:
+                queued += int(fields[4].split(":")[1], 16)
+    return queued
+
+
+class SignalFreezer:
+    """Suspend the game's process group with SIGSTOP"""
+
+    name: str = "signal"
+
+    def __init__(self, pid: int):
+        """
+        Initialize the freezer
+
+        :param pid: leader of the game's process group
+        """
+        self.pgid: int = os.getpgid(pid)
+
+    def freeze(self) -> None:
+        """
+        Stop all processes of the group
+
+        :return:
+        """
+        os.killpg(self.pgid, signal.SIGSTOP)
+
+    def thaw(self) -> None:
+        """
+        Continue all processes of the group
+
+        :return:
+        """
+        try:
+            os.killpg(self.pgid, signal.SIGCONT)
+        except ProcessLookupError:
+            pass
+
+    def close(self) -> None:
+        """
+        Nothing to clean up for signals
+
+        :return:
+        """
+
+
+class CgroupFreezer:
+    """Suspend the game in its own cgroup with the cgroup v2 freezer"""
+
+    name: str = "cgroup"
+
+    def __init__(self, path: Path, pid: int):
+        """
+        Create the cgroup and move the game into it
+
+        :param path:
+        :param pid:
+        """
+        path.mkdir(exist_ok=True)
+        if not (path / "cgroup.freeze").exists():
+            raise FileNotFoundError(f"No cgroup v2 freezer in {path}")
+        (path / "cgroup.procs").write_text(f"{pid}\n")
+        self.path = path
+
+    def freeze(self) -> None:
+        """
+        Freeze the cgroup
+
+        :return:
+        """
+        (self.path / "cgroup.freeze").write_text("1\n")
+
+    def thaw(self) -> None:
+        """
+        Thaw the cgroup
+
+        :return:
+        """
+        (self.path / "cgroup.freeze").write_text("0\n")
+
+    def close(self) -> None:
+        """
+        Remove the cgroup, moving processes outliving the game like wineserver out
+
+        :return:
+        """
+        self.thaw()
+        for pid in (self.path / "cgroup.procs").read_text().split():
+            (self.path.parent / "cgroup.procs").write_text(f"{pid}\n")
+        self.path.rmdir()
+
+
+def create_freezer(
+    pid: int, cgroup_root: Path = CGROUP_ROOT
+) -> CgroupFreezer | SignalFreezer:
+    """
+    Use the cgroup freezer if the container may create cgroups, else SIGSTOP
+
+    :param pid:
+    :param cgroup_root:
+    :return:
+    """
+    try:
+        return CgroupFreezer(cgroup_root / "sotf-game", pid)
+    except OSError:
+        return SignalFreezer(pid)
+
+
+class Hibernator:
+    """
+    Suspend the idle game and resume it on incoming traffic
+
+    The game is suspended after no players were connected for idle_timeout
+    seconds. While suspended, packets for the game wait in its socket receive
+    queues, so a growing queue on a wake port resumes the game without taking
+    the ports over or losing the packets.
+    """
+
+    def __init__(
+        self,
+        freezer: CgroupFreezer | SignalFreezer,
+        query_address: tuple[str, int],
+        wake_ports: Sequence[int],
+        idle_timeout: float,
+        log: Callable[..., None],
+        check_interval: float = 30.0,
+        wake_interval: float = 0.05,
+        wake_timeout: float = 30.0,
+        proc_net_udp: Sequence[Path] = PROC_NET_UDP,
+    ):
+        """
+        Initialize the hibernator
+
+        :param freezer:
+        :param query_address: query port of the game
+        :param wake_ports: ports whose traffic resumes the game
+        :param idle_timeout: seconds without players before suspending
+        :param log: function logging an event with its fields
+        :param check_interval: seconds between player count queries
+        :param wake_interval: seconds between receive queue checks while suspended
+        :param wake_timeout: seconds to wait for the resumed game to answer
+        :param proc_net_udp:
+        """
+        self.freezer = freezer
+        self.query_address = query_address
+        self.wake_ports = list(wake_ports)
+        self.idle_timeout = idle_timeout
+        self.log = log
+        self.check_interval = check_interval
+        self.wake_interval = wake_interval
+        self.wake_timeout = wake_timeout
+        self.proc_net_udp = proc_net_udp
+        self.idle_since: float | None = None
+        self.suspended_at: float | None = None
+        self.suspended_total: float = 0.0
+        self.queued: int = 0
+        self.stopping: threading.Event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def suspended(self) -> bool:
+        """
+        Check if the game is suspended
+
+        :return:
+        """
+        return self.suspended_at is not None
+
+    def check(self) -> None:
+        """
+        Query the player count and suspend the game once it was idle long enough
+
+        :return:
+        """
+        players: int | None = query_player_count(self.query_address)
+        now: float = time.monotonic()
+        if players != 0:
+            # Busy, or not answering while starting up or loading
+            self.idle_since = None
+            return
+        if self.idle_since is None:
+            self.idle_since = now
+        if now - self.idle_since >= self.idle_timeout:
+            self.suspend()
+
+    def suspend(self) -> None:
+        """
+        Suspend the game
+
+        :return:
+        """
+        with self._lock:
+            # Never freeze a game that is shutting down
+            if self.suspended or self.stopping.is_set():
+                return
+            self.freezer.freeze()
+            self.suspended_at = time.monotonic()
+            self.queued = read_receive_queue(self.wake_ports, self.proc_net_udp)
+        self.log(
+            "hibernation",
+            action="suspend",
+            freezer=self.freezer.name,
+            idle=round(self.suspended_at - (self.idle_since or self.suspended_at), 6),
+        )
+
+    def resume(self, trigger: str) -> None:
+        """
+        Resume the game and log how long it was suspended and how fast it woke up
+
+        :param trigger: what resumed the game
+        :return:
+        """
+        with self._lock:
+            if self.suspended_at is None:
+                return
+            detected: float = time.monotonic()
+            self.freezer.thaw()
+            suspended: float = detected - self.suspended_at
+            self.suspended_total += suspended
+            self.suspended_at = None
+            self.idle_since = None
+        extra: dict = {}
+        if trigger == "traffic":
+            deadline: float = detected + self.wake_timeout
+            # A stopping game might never answer again
+            while time.monotonic() < deadline and not self.stopping.is_set():
+                if query_player_count(self.query_address) is not None:
+                    extra["wake_latency"] = round(time.monotonic() - detected, 6)
+                    break
+        self.log(
+            "hibernation",
+            action="resume",
+            trigger=trigger,
+            suspended=round(suspended, 6),
+            suspended_total=round(self.suspended_total, 6),
+            **extra,
+        )
+
+    def traffic_received(self) -> bool:
+        """
+        Check if packets arrived on a wake port since the game was suspended
+
+        :return:
+        """
+        return read_receive_queue(self.wake_ports, self.proc_net_udp) > self.queued
+
+    def run(self, stop: threading.Event) -> None:
+        """
+        Watch the game until stopped, resuming it when stopping
+
+        :param stop: also stops suspending the game once set
+        :return:
+        """
+        self.stopping = stop
+        while not stop.is_set():
+            if not self.suspended:
+                self.check()
+                if not self.suspended:
+                    stop.wait(self.check_interval)
+            elif self.traffic_received():
+                self.resume("traffic")
+            else:
+                stop.wait(self.wake_interval)
+        self.resume("stop")
+
+
+class Supervisor:
+    """Start the server's dependencies concurrently and supervise the game process"""
+
+    def __init__(
+        self,
+        game_args: Sequence[str] = (),
+        environ: Mapping[str, str] | None = None,
+        config_path: Path = CONFIG_PATH,
+        display: str = DISPLAY,
+        xvfb_command: Sequence[str] = XVFB_COMMAND,
+        wineboot_command: Sequence[str] = WINEBOOT_COMMAND,
+        wineserver_command: Sequence[str] = WINESERVER_COMMAND,
+        game_command: Sequence[str] = GAME_COMMAND,
+        wine_inf_paths: Sequence[Path] = WINE_INF_PATHS,
+        ready_timeout: float = 60.0,
+        cgroup_root: Path = CGROUP_ROOT,
+        hibernation_options: Mapping | None = None,
+    ):
+        """
+        Initialize the supervisor
+
+        :param game_args: extra arguments passed to the game server
+        :param environ:
+        :param config_path:
+        :param display:
+        :param xvfb_command:
+        :param wineboot_command:
+        :param wineserver_command:
+        :param game_command:
+        :param wine_inf_paths:
+        :param ready_timeout: seconds to wait for the X server to become ready
+        :param cgroup_root: cgroup of the container, for the hibernation freezer
+        :param hibernation_options: extra keyword arguments of the hibernator
+        """
+        self.environ: dict[str, str] = dict(os.environ if environ is None else environ)
+        self.environ["DISPLAY"] = display
+        self.display = display
+        self.game_args = list(game_args)
+        self.config_path = config_path
+        self.xvfb_command = list(xvfb_command)
+        self.wineboot_command = list(wineboot_command)
+        self.wineserver_command = list(wineserver_command)
+        self.game_command = list(game_command)
+        self.wine_inf_paths = list(wine_inf_paths)
+        self.ready_timeout = ready_timeout
+        self.cgroup_root = cgroup_root
+        self.hibernation_options: dict = dict(hibernation_options or {})
+        self.settings: dict[str, Any] = {}
+        self.started: float = time.monotonic()
+        self.xvfb: subprocess.Popen | None = None
+        self.game: subprocess.Popen | None = None
+        self.snapshots: subprocess.Popen | None = None
+        self.log_follower: subprocess.Popen | None = None
+        self.hibernator: Hibernator | None = None
+        self.hibernator_stop: threading.Event = threading.Event()
+        self.hibernator_thread: threading.Thread | None = None
+        self.stop_signal: int | None = None
+
+    def log_event(self, event: str, **fields) -> None:
+        """
+        Print a JSON record of an event
+
+        :param event:
+        :param fields:
+        :return:
+        """
+        print(json.dumps({"event": event, **fields}), flush=True)
+
+    def log_phase(
+        self, phase: str, started: float, status: str = "ok", **extra
+    ) -> None:
+        """
+        Print a JSON timing record for a startup phase
+
+        :param phase:
+        :param started: monotonic time the phase started
+        :param status:
+        :param extra:
+        :return:
+        """
+        finished: float = time.monotonic()
+        self.log_event(
+            "startup_phase",
+            phase=phase,
+            status=status,
+            start=round(started - self.started, 6),
+            duration=round(finished - started, 6),
+            **extra,
+        )
+
+    def timed(self, phase: str, function: Callable[[], dict | None]) -> None:
+        """
+        Run a startup phase and log its timing
+
+        :param phase:
+        :param function: phase returning extra fields for the timing record
+        :return:
+        """
+        started: float = time.monotonic()
+        try:
+            extra: dict | None = function()
+        except Exception as e:
+            self.log_phase(phase, started, status="failed", error=str(e))
+            raise
+        self.log_phase(phase, started, **(extra or {}))
+
+    def read_settings(self) -> None:
+        """
+        Validate the supervisor settings before anything is started
+
+        :return:
+        """
+        self.settings = read_settings(self.environ)
+
+    def start_xvfb(self) -> None:
+        """
+        Start the virtual X server and wait until it accepts connections
+
+        Xvfb writes the display number to the -displayfd pipe once it is ready.
+
+        :return:
+        """
+        number: str = self.display.lstrip(":")
+        for stale in (
+            Path(f"/tmp/.X{number}-lock"),
+            Path(f"/tmp/.X11-unix/X{number}"),
+        ):
+            stale.unlink(missing_ok=True)
+
+        read_fd, write_fd = os.pipe()
+        try:
+            self.xvfb = subprocess.Popen(
+                [
+                    *self.xvfb_command,
+                    self.display,
+                    "-screen",
+                    "0",
+                    "1024x768x16",
+                    "-nolisten",
+                    "tcp",
+                    "-nolisten",
+                    "unix",
+                    "-displayfd",
+                    str(write_fd),
+                ],
+                pass_fds=(write_fd,),
+                env=self.environ,
+            )
+        finally:
+            os.close(write_fd)
+        try:
+            ready, _, _ = select.select([read_fd], [], [], self.ready_timeout)
+            if not ready:
+                raise StartupError(f"X server not ready after {self.ready_timeout}s")
+            if not os.read(read_fd, 64).strip():
+                raise StartupError("X server exited before becoming ready")
+        finally:
+            os.close(read_fd)
+
+    def init_wine_prefix(self) -> dict:
+        """
+        Use the Wine prefix baked into the image, or initialize it with wineboot
+
+        wineboot only runs if the prefix is missing or older than the installed
+        Wine. It is then awaited until the Wine server wrote the prefix to disk.
+
+        :return:
+        """
+        prefix: Path = get_wine_prefix(self.environ)
+        if wine_prefix_is_current(prefix, self.wine_inf_paths):
+            return {"prefix": "image"}
+        subprocess.run(self.wineboot_command, env=self.environ, check=True)
+        subprocess.run(self.wineserver_command, env=self.environ, check=True)
+        if not (prefix / "system.reg").exists():
+            raise StartupError("Wine prefix was not initialized")
+        return {"prefix": "wineboot"}
+
+    def create_config(self) -> None:
+        """
+        Create the server config
+
+        :return:
+        """
+        command: list[str] = [
+            sys.executable,
+            str(CONFIG_CREATOR),
+            "--output",
+            str(self.config_path),
+        ]
+        if self.settings["MERGECONFIG"]:
+            command.append("--merge")
+        subprocess.run(command, env=self.environ, check=True)
+
+    def snapshot_command(self, *args: str) -> list[str]:
+        """
+        Return a command of the snapshot tool for the configured SaveSlot
+
+        :param args:
+        :return:
+        """
+        try:
+            slot: int = json.loads(self.config_path.read_text()).get("SaveSlot", 1)
+        except (FileNotFoundError, ValueError):
+            # The config phase might still be writing the file
+            slot = int(self.environ.get("SAVESLOT") or 1)
+        return [
+            sys.executable,
+            str(SNAPSHOT),
+            "--repository",
+            self.environ.get("SNAPSHOTDIR", str(SOTF_DIR / "snapshots")),
+            "--userdata",
+            str(self.config_path.parent),
+            "--slot",
+            str(slot),
+            *args,
+        ]
+
+    def restore_snapshot(self) -> dict:
+        """
+        Restore the save to the snapshot selected by SNAPSHOTRESTORE
+
+        :return:
+        """
+        selector: str = self.environ["SNAPSHOTRESTORE"]
+        subprocess.run(
+            self.snapshot_command("restore", selector), env=self.environ, check=True
+        )
+        return {"snapshot": selector}
+
+    def start_snapshots(self) -> None:
+        """
+        Snapshot every completed save in the background if SNAPSHOTS is true
+
+        :return:
+        """
+        if not self.settings["SNAPSHOTS"]:
+            return
+        self.snapshots = subprocess.Popen(
+            self.snapshot_command(
+                "--rate-limit",
+                str(self.settings["SNAPSHOTRATELIMIT"]),
+                "watch",
+            ),
+            env=self.environ,
+        )
+
+    def start_log_follower(self) -> None:
+        """
+        Print events of the server's log files if LOGEVENTS is true
+
+        :return:
+        """
+        if not self.settings["LOGEVENTS"]:
+            return
+        self.log_follower = subprocess.Popen(
+            [
+                sys.executable,
+                str(LOG_FOLLOWER),
+                "--logs",
+                str(self.config_path.parent / "logs"),
+                "--retention-days",
+                str(self.settings["LOGRETENTIONDAYS"]),
+                "--retention-files",
+                str(self.settings["LOGRETENTIONFILES"]),
+                "--since",
+                str(time.time()),
+            ],
+            env=self.environ,
+        )
+
+    def handle_signal(self, signum: int, frame: FrameType | None) -> None:
+        """
+        Forward a stop signal to the game, or stop the startup if it is not running
+
+        :param signum:
+        :param frame:
+        :return:
+        """
+        self.stop_signal = signum
+        if self.hibernator is not None:
+            # Keeps the hibernator from suspending the game again while it stops
+            self.hibernator_stop.set()
+            # A suspended game cannot handle the signal
+            self.hibernator.resume("signal")
+        if self.game is not None and self.game.poll() is None:
+            self.game.send_signal(signum)
+
+    def start_hibernator(self) -> None:
+        """
+        Suspend the game while idle if HIBERNATEAFTER sets the idle seconds
+
+        :return:
+        """
+        idle_timeout: float = self.settings["HIBERNATEAFTER"]
+        if idle_timeout <= 0:
+            return
+        config: dict = json.loads(self.config_path.read_text())
+        query_port: int = config.get("QueryPort", 27016)
+        wake_ports: list[int] = [config.get("GamePort", 8766)]
+        if self.settings["HIBERNATEWAKEONQUERY"]:
+            wake_ports.append(query_port)
+
+        self.hibernator = Hibernator(
+            freezer=create_freezer(self.game.pid, self.cgroup_root),
+            query_address=("127.0.0.1", query_port),
+            wake_ports=wake_ports,
+            idle_timeout=idle_timeout,
+            log=self.log_event,
+            **self.hibernation_options,
+        )
+        self.hibernator_thread = threading.Thread(
+            target=self.hibernator.run, args=(self.hibernator_stop,), daemon=True
+        )
+        self.hibernator_thread.start()
+
+    def start(self) -> None:
+        """
+        Run the startup phases concurrently, then launch the game
+
+        :return:
+        """
+        try:
+            # Bad settings must not stop the container after the game started
+            self.timed("settings", self.read_settings)
+        except ValueError as e:
+            raise StartupError("Startup failed") from e
+        phases: dict[str, Callable[[], dict | None]] = {
+            "xvfb": self.start_xvfb,
+            "wineboot": self.init_wine_prefix,
+            "config": self.create_config,
+        }
+        if self.environ.get("SNAPSHOTRESTORE"):
+            phases["restore"] = self.restore_snapshot
+        with ThreadPoolExecutor(max_workers=len(phases)) as executor:
+            futures = [
+                executor.submit(self.timed, phase, function)
+                for phase, function in phases.items()
+            ]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                if future.exception():
+                    raise StartupError("Startup failed") from future.exception()
+
+        if self.stop_signal is None:
+            self.start_log_follower()
+            started: float = time.monotonic()
+            self.game = subprocess.Popen(
+                [*self.game_command, *self.game_args],
+                env=self.environ,
+                process_group=0,
+            )
+            self.log_phase("game", started, pid=self.game.pid)
+            self.log_phase("startup", self.started)
+            self.start_hibernator()
+            self.start_snapshots()
+
+    def stop(self) -> None:
+        """
+        Stop the hibernator, the log follower, the snapshots and the X server
+
+        The snapshot tool takes a last snapshot of the save written on shutdown.
+
+        :return:
+        """
+        if self.hibernator_thread is not None:
+            self.hibernator_stop.set()
+            self.hibernator_thread.join()
+            try:
+                self.hibernator.freezer.close()
+            except OSError as e:
+                print(f"Warning: Freezer not removed: {e}", file=sys.stderr)
+        if self.log_follower is not None and self.log_follower.poll() is None:
+            self.log_follower.terminate()
+            self.log_follower.wait()
+        if self.snapshots is not None and self.snapshots.poll() is None:
+            self.snapshots.terminate()
+            self.snapshots.wait()
+        if self.xvfb is not None and self.xvfb.poll() is None:
+            self.xvfb.terminate()
+            self.xvfb.wait()
+
+    def run(self) -> int:
+        """
+        Start the server and wait for the game process to exit
+
+        :return: exit code of the game process
+        """
+        handlers: dict = {
+            signum: signal.signal(signum, self.handle_signal)
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+        }
+        try:
+            self.start()
+            if self.game is None:
+                return 0
+            return self.game.wait()
+        except StartupError as e:
+            print(f"Error: {e.__cause__ or e}", file=sys.stderr)
+            return 1
+        finally:
+            self.stop()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+
+def main(argv: Sequence[str] = ()) -> None:
+    """
+    Run the supervisor
+
+    :param argv: arguments passed to the game server
+    :return:
+    """
+    exit(Supervisor(game_args=argv).run())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,3 +1,10 @@
 """Constants for image build."""
 
+from pathlib import Path
+
 PLATFORMS: list[str] = ["linux/amd64"]
+IMAGE_REPOSITORY: str = "pfeiffermax/sotf-dedicated-game-server"
+SOTF_APP_ID: int = 2465200
+DEFAULT_BRANCH: str = "release"
+CACHE_DIR: Path = Path.home() / ".cache" / "sotf-dedicated-game-server-docker"
+PRODUCT_INFO_CACHE_TTL: float = 300.0
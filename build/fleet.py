@@ -0,0 +1,258 @@
+"""Fleet CLI generating configs and a compose file for many servers on one host."""
+
+import json
+import re
+from collections.abc import Iterable, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import click
+import yaml
+
+from build.config.config_creator import (
+    CONFIG_SCHEMA,
+    ConfigError,
+    create_config_file,
+    to_environ,
+    write_atomic,
+)
+from build.constants import IMAGE_REPOSITORY
+
+PORT_VARIABLES: tuple[str, ...] = ("GAMEPORT", "QUERYPORT", "BLOBSYNCPORT")
+FIRST_PORT: int = 8766
+LAST_PORT: int = 65535
+SERVICE_NAME: re.Pattern = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9_.-]*$")
+USERDATA_PATH: str = "/srv/sotf/userdata"
+
+
+@dataclass
+class Instance:
+    """One server of the fleet and the environment its config is created from."""
+
+    name: str
+    environ: dict[str, str]
+
+    @property
+    def ports(self) -> list[int]:
+        """Return the game, query and BlobSync ports.
+
+        :return:
+        """
+        return [int(self.environ[variable]) for variable in PORT_VARIABLES]
+
+
+def load_spec(path: Path) -> dict[str, Any]:
+    """Load a fleet spec from a JSON or YAML file.
+
+    :param path:
+    :return:
+    """
+    if path.suffix in (".yaml", ".yml"):
+        return yaml.safe_load(path.read_text())
+    return json.loads(path.read_text())
+
+
+def expand_instances(spec: Mapping[str, Any]) -> list[Instance]:
+    """Return one instance per server, merging shared defaults and overrides.
+
+    A server with a count expands to that many numbered instances.
+
+    :param spec:
+    :return:
+    """
+    defaults: dict[str, str] = to_environ(spec.get("defaults", {}))
+    instances: list[Instance] = []
+    names: set[str] = set()
+    errors: list[str] = []
+    for index, server in enumerate(spec.get("servers", [])):
+        name: str = str(server.get("name", f"sotf-{index + 1}"))
+        try:
+            count: int = int(server.get("count", 1))
+        except (TypeError, ValueError):
+            errors.append(f"{name}: count needs Integer")
+            continue
+        environ: dict[str, str] = {
+            **defaults,
+            **to_environ(server.get("environment", {})),
+        }
+        if count > 1 and any(variable in environ for variable in PORT_VARIABLES):
+            errors.append(f"{name}: servers with a count cannot set ports")
+            continue
+        for number in range(1, count + 1):
+            instance_name: str = f"{name}-{number}" if count > 1 else name
+            if not SERVICE_NAME.match(instance_name):
+                errors.append(f"{instance_name}: invalid server name")
+            elif instance_name in names:
+                errors.append(f"{instance_name}: duplicate server name")
+            names.add(instance_name)
+            instances.append(Instance(instance_name, dict(environ)))
+    if errors:
+        raise ConfigError(errors)
+    return instances
+
+
+def allocate_ports(
+    instances: Sequence[Instance],
+    first_port: int = FIRST_PORT,
+    last_port: int = LAST_PORT,
+) -> None:
+    """Assign unused ports to every instance without explicitly set ports.
+
+    Explicitly set ports are reserved first, then the free ports from first_port
+    on are handed out in order, so all ports on the host are distinct.
+
+    :param instances:
+    :param first_port:
+    :param last_port:
+    :return:
+    """
+    owners: dict[int, str] = {}
+    errors: list[str] = []
+    for instance in instances:
+        for variable in PORT_VARIABLES:
+            value: str | None = instance.environ.get(variable)
+            if value is None or not value.isdigit():
+                # Invalid values are reported by the config validation
+                continue
+            port: int = int(value)
+            if port in owners:
+                errors.append(
+                    f"{instance.name}: {variable} {port} is already used by "
+                    f"{owners[port]}"
+                )
+            owners[port] = instance.name
+
+    port = first_port
+    for instance in instances:
+        for variable in PORT_VARIABLES:
+            if variable in instance.environ:
+                continue
+            while port in owners:
+                port += 1
+            if port > last_port:
+                raise ConfigError(
+                    [
+                        *errors,
+                        f"No free ports left between {first_port} and {last_port}",
+                    ]
+                )
+            instance.environ[variable] = str(port)
+            owners[port] = instance.name
+    if errors:
+        raise ConfigError(errors)
+
+
+def validate_instances(instances: Iterable[Instance]) -> None:
+    """Validate the configs of all instances and raise all errors together.
+
+    :param instances:
+    :return:
+    """
+    errors: list[str] = [
+        f"{instance.name}: {error}"
+        for instance in instances
+        for error in CONFIG_SCHEMA.validate(instance.environ)
+    ]
+    if errors:
+        raise ConfigError(errors)
+
+
+def create_compose(instances: Iterable[Instance], image: str) -> dict[str, Any]:
+    """Return a compose file running every instance with its own userdata.
+
+    Containers get the same environment the config was created from, so they keep
+    the generated config instead of writing a new one.
+
+    :param instances:
+    :param image:
+    :return:
+    """
+    return {
+        "services": {
+            instance.name: {
+                "image": image,
+                "restart": "unless-stopped",
+                "environment": instance.environ,
+                "ports": [f"{port}:{port}/udp" for port in instance.ports],
+                "volumes": [f"./{instance.name}/userdata:{USERDATA_PATH}"],
+            }
+            for instance in instances
+        }
+    }
+
+
+def generate_fleet(
+    spec: Mapping[str, Any], output: Path, workers: int = 16
+) -> tuple[list[Instance], int]:
+    """Generate the configs of all instances and the compose file in one pass.
+
+    Everything is validated before any file is written. Configs of instances
+    whose environment did not change are skipped.
+
+    :param spec:
+    :param output: directory holding one userdata directory per instance
+    :param workers: number of threads writing config files
+    :return: instances and the number of written configs
+    """
+    instances: list[Instance] = expand_instances(spec)
+    ports: dict[str, int] = spec.get("ports", {})
+    allocate_ports(
+        instances,
+        first_port=int(ports.get("first", FIRST_PORT)),
+        last_port=int(ports.get("last", LAST_PORT)),
+    )
+    validate_instances(instances)
+    output.mkdir(parents=True, exist_ok=True)
+
+    def write_config(instance: Instance) -> bool:
+        userdata: Path = output / instance.name / "userdata"
+        userdata.mkdir(parents=True, exist_ok=True)
+        return create_config_file(userdata / "dedicatedserver.cfg", instance.environ)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        written: int = sum(executor.map(write_config, instances))
+
+    compose: dict[str, Any] = create_compose(
+        instances, spec.get("image", f"{IMAGE_REPOSITORY}:latest")
+    )
+    # JSON is valid YAML, so docker compose reads the file as is
+    write_atomic(output / "compose.yaml", json.dumps(compose, indent=2) + "\n")
+    return instances, written
+
+
+@click.command()
+@click.argument(
+    "spec_path",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--output",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=Path("fleet"),
+    show_default=True,
+    help="Directory for the compose file and the userdata of each server",
+)
+def main(spec_path: Path, output: Path) -> None:
+    """Generate configs and a compose file for a fleet of servers on one host.
+
+    :param spec_path:
+    :param output:
+    :return:
+    """
+    try:
+        instances, written = generate_fleet(load_spec(spec_path), output)
+    except ConfigError as e:
+        for error in e.errors:
+            click.echo(f"Error: {error}", err=True)
+        raise SystemExit(1) from None
+    click.echo(
+        f"{len(instances)} servers, {written} configs written, "
+        f"compose file {output / 'compose.yaml'}"
+    )
+
+
+if __name__ == "__main__":
+    # pylint: disable=no-value-for-parameter
+    main()
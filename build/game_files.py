@@ -0,0 +1,105 @@
+"""Cache keys and reporting for the game files layer."""
+
+import re
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+GAME_FILES_STAGE: str = "game-files"
+STEP_HEADER: re.Pattern = re.compile(
+    rf"^#(\d+) \[(?:\S+ )?{GAME_FILES_STAGE} \d+/\d+\] RUN "
+)
+DOWNLOAD_PROGRESS: re.Pattern = re.compile(
+    r"downloading, progress: [\d.]+ \((\d+) / (\d+)\)"
+)
+
+
+def get_depot_manifests(
+    app_info: dict, branch: str = "public", platform: str = "windows"
+) -> dict[str, str]:
+    """Return the manifest IDs of the app's depots for a branch and OS.
+
+    Depots without a manifest for the branch fall back to the public branch,
+    which is the branch Steam lists manifests of the default release under.
+
+    :param app_info: product info of the app
+    :param branch:
+    :param platform:
+    :return: manifest ID by depot ID
+    """
+    manifests: dict[str, str] = {}
+    for depot_id, depot in app_info["depots"].items():
+        if not depot_id.isdigit() or not isinstance(depot, dict):
+            continue
+        oslist: str = depot.get("config", {}).get("oslist", "")
+        if oslist and platform not in oslist.split(","):
+            continue
+        depot_manifests: dict = depot.get("manifests", {})
+        manifest: dict | str | None = depot_manifests.get(
+            branch, depot_manifests.get("public")
+        )
+        if manifest is None:
+            continue
+        manifests[depot_id] = (
+            str(manifest["gid"]) if isinstance(manifest, dict) else str(manifest)
+        )
+    return manifests
+
+
+def get_build_args(build_id: str, manifests: dict[str, str]) -> dict[str, str]:
+    """Return the build args keying the game files layer.
+
+    :param build_id:
+    :param manifests: manifest ID by depot ID
+    :return:
+    """
+    return {
+        "SOTF_BUILD_ID": build_id,
+        "SOTF_DEPOT_MANIFESTS": ",".join(
+            f"{depot_id}:{manifests[depot_id]}"
+            for depot_id in sorted(manifests, key=int)
+        ),
+    }
+
+
+@dataclass
+class GameFilesReport:
+    """Cache usage and download size of the game files layer in one build."""
+
+    cache_hit: bool | None = None
+    bytes_downloaded: int = 0
+
+    def __str__(self) -> str:
+        """Summarize the report.
+
+        :return:
+        """
+        if self.cache_hit is None:
+            return "Game files layer: not built"
+        if self.cache_hit:
+            return "Game files layer: cache hit, 0 bytes downloaded"
+        return f"Game files layer: cache miss, {self.bytes_downloaded} bytes downloaded"
+
+
+def report_game_files(logs: Iterable[str], report: GameFilesReport) -> Iterator[str]:
+    """Pass through plain BuildKit logs while filling in the game files report.
+
+    :param logs: lines of a build with plain progress output
+    :param report:
+    :return:
+    """
+    steps: set[str] = set()
+    for line in logs:
+        header: re.Match | None = STEP_HEADER.match(line)
+        if header:
+            steps.add(header.group(1))
+        elif line.startswith("#"):
+            step: str = line[1:].split(" ", 1)[0]
+            if step in steps:
+                if line.rstrip().endswith(" CACHED"):
+                    report.cache_hit = True
+                elif " DONE " in line:
+                    report.cache_hit = False
+                progress: re.Match | None = DOWNLOAD_PROGRESS.search(line)
+                if progress:
+                    report.bytes_downloaded = int(progress.group(2))
+        yield line
@@ -0,0 +1,593 @@
+"""Monitor querying servers over the Steam A2S protocol and exporting metrics."""
+
+import asyncio
+import json
+import socket
+import struct
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import click
+
+A2S_HEADER: bytes = b"\xff\xff\xff\xff"
+A2S_INFO: bytes = A2S_HEADER + b"TSource Engine Query\x00"
+A2S_PLAYER: bytes = A2S_HEADER + b"U"
+NO_CHALLENGE: bytes = A2S_HEADER
+CHALLENGE_RESPONSE: bytes = b"A"
+INFO_RESPONSE: bytes = b"I"
+PLAYER_RESPONSE: bytes = b"D"
+DEFAULT_QUERY_PORT: int = 27016
+RECEIVE_BUFFER_SIZE: int = 4 * 1024 * 1024
+
+Address = tuple[str, int]
+
+
+class A2SError(Exception):
+    """Invalid or unexpected A2S response."""
+
+
+@dataclass
+class ServerInfo:
+    """Server details from an A2S_INFO response."""
+
+    name: str
+    map: str
+    game: str
+    players: int
+    max_players: int
+    bots: int
+    version: str
+
+
+@dataclass
+class Player:
+    """Player from an A2S_PLAYER response."""
+
+    name: str
+    score: int
+    duration: float
+
+
+class PacketReader:
+    """Read little-endian values from an A2S response."""
+
+    def __init__(self, data: bytes):
+        """Initialize the reader.
+
+        :param data:
+        """
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt: str) -> tuple:
+        """Read values in struct format.
+
+        :param fmt:
+        :return:
+        """
+        try:
+            values: tuple = struct.unpack_from(f"<{fmt}", self.data, self.offset)
+        except struct.error as e:
+            raise A2SError(f"Truncated response: {e}") from None
+        self.offset += struct.calcsize(f"<{fmt}")
+        return values
+
+    def byte(self) -> int:
+        """Read an unsigned byte.
+
+        :return:
+        """
+        return self.unpack("B")[0]
+
+    def string(self) -> str:
+        """Read a null-terminated UTF-8 string.
+
+        :return:
+        """
+        end: int = self.data.find(b"\x00", self.offset)
+        if end == -1:
+            raise A2SError("Unterminated string in response")
+        value: str = self.data[self.offset : end].decode("utf-8", errors="replace")
+        self.offset = end + 1
+        return value
+
+
+def parse_info(data: bytes) -> ServerInfo:
+    """Parse the payload of an A2S_INFO response.
+
+    :param data: response without header and type byte
+    :return:
+    """
+    reader = PacketReader(data)
+    reader.byte()  # protocol
+    name: str = reader.string()
+    map_name: str = reader.string()
+    reader.string()  # folder
+    game: str = reader.string()
+    reader.unpack("h")  # app ID
+    players, max_players, bots = reader.unpack("BBB")
+    reader.unpack("cc")  # server type, environment
+    reader.unpack("BB")  # visibility, VAC
+    version: str = reader.string()
+    return ServerInfo(name, map_name, game, players, max_players, bots, version)
+
+
+def parse_players(data: bytes) -> list[Player]:
+    """Parse the payload of an A2S_PLAYER response.
+
+    :param data: response without header and type byte
+    :return:
+    """
+    reader = PacketReader(data)
+    players: list[Player] = []
+    for _ in range(reader.byte()):
+        reader.byte()  # index
+        name: str = reader.string()
+        score, duration = reader.unpack("lf")
+        players.append(Player(name, score, duration))
+    return players
+
+
+class A2SProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint routing responses to the pending request of their sender."""
+
+    def __init__(self):
+        """Initialize the protocol."""
+        self.transport: asyncio.DatagramTransport | None = None
+        self.pending: dict[Address, asyncio.Future] = {}
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        """Store the transport.
+
+        :param transport:
+        :return:
+        """
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Address) -> None:
+        """Resolve the request pending for the sender.
+
+        :param data:
+        :param addr:
+        :return:
+        """
+        future: asyncio.Future | None = self.pending.get(addr[:2])
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        """Ignore ICMP errors, unanswered requests time out.
+
+        :param exc:
+        :return:
+        """
+
+
+class A2SClient:
+    """Query many servers concurrently over one UDP socket.
+
+    Only one request per server is in flight at a time, so responses are matched
+    to requests by their sender address.
+    """
+
+    def __init__(self, timeout: float = 2.0):
+        """Initialize the client.
+
+        :param timeout: seconds to wait for each response
+        """
+        self.timeout = timeout
+        self.protocol: A2SProtocol | None = None
+        self._open_lock = asyncio.Lock()
+        self._locks: dict[Address, asyncio.Lock] = {}
+
+    async def open(self) -> None:
+        """Open the UDP socket.
+
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        transport, self.protocol = await loop.create_datagram_endpoint(
+            A2SProtocol, local_addr=("0.0.0.0", 0)
+        )
+        # Responses of many servers may arrive at once, the kernel caps the size
+        transport.get_extra_info("socket").setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE
+        )
+
+    def close(self) -> None:
+        """Close the UDP socket.
+
+        :return:
+        """
+        if self.protocol is not None and self.protocol.transport is not None:
+            self.protocol.transport.close()
+        self.protocol = None
+
+    async def request(self, address: Address, payload: bytes) -> tuple[bytes, float]:
+        """Send a request and wait for the response from the same address.
+
+        :param address: IP address and port
+        :param payload:
+        :return: response and round-trip seconds
+        """
+        if self.protocol is None:
+            async with self._open_lock:
+                if self.protocol is None:
+                    await self.open()
+        lock: asyncio.Lock = self._locks.setdefault(address, asyncio.Lock())
+        async with lock:
+            future: asyncio.Future = asyncio.get_running_loop().create_future()
+            self.protocol.pending[address] = future
+            start: float = time.perf_counter()
+            try:
+                self.protocol.transport.sendto(payload, address)
+                response: bytes = await asyncio.wait_for(future, self.timeout)
+            finally:
+                self.protocol.pending.pop(address, None)
+            latency: float = time.perf_counter() - start
+        if not response.startswith(A2S_HEADER) or len(response) < 5:
+            raise A2SError("Unsupported response, split packets are not supported")
+        return response[4:], latency
+
+    async def challenge_request(
+        self, address: Address, payload: bytes, expected: bytes, challenge: bytes
+    ) -> tuple[bytes, float]:
+        """Send a request, answering a challenge if the server sends one.
+
+        :param address:
+        :param payload: request without challenge
+        :param expected: type byte of the expected response
+        :param challenge: challenge to send with the first request
+        :return: response payload and round-trip seconds of the answered request
+        """
+        response, latency = await self.request(address, payload + challenge)
+        if response[:1] == CHALLENGE_RESPONSE:
+            response, latency = await self.request(address, payload + response[1:5])
+        if response[:1] != expected:
+            raise A2SError(f"Unexpected response type {response[:1]!r}")
+        return response[1:], latency
+
+    async def query_info(self, address: Address) -> tuple[ServerInfo, float]:
+        """Query server details.
+
+        :param address:
+        :return: server info and round-trip seconds
+        """
+        response, latency = await self.challenge_request(
+            address, A2S_INFO, INFO_RESPONSE, b""
+        )
+        return parse_info(response), latency
+
+    async def query_players(self, address: Address) -> tuple[list[Player], float]:
+        """Query connected players.
+
+        :param address:
+        :return: players and round-trip seconds
+        """
+        response, latency = await self.challenge_request(
+            address, A2S_PLAYER, PLAYER_RESPONSE, NO_CHALLENGE
+        )
+        return parse_players(response), latency
+
+
+@dataclass
+class TargetStatus:
+    """Latest query results of one server."""
+
+    target: str
+    up: bool = False
+    info: ServerInfo | None = None
+    players: list[Player] | None = None
+    latency: dict[str, float] = field(default_factory=dict)
+    last_response: float | None = None
+    failures: int = 0
+    error: str | None = None
+
+
+def parse_target(target: str) -> Address:
+    """Return host and query port of a target, defaulting to the SOTF query port.
+
+    :param target: ``host`` or ``host:port``
+    :return:
+    """
+    host, _, port = target.rpartition(":")
+    if not host:
+        return target, DEFAULT_QUERY_PORT
+    return host, int(port)
+
+
+def get_fleet_targets(compose_path: Path, host: str = "127.0.0.1") -> list[str]:
+    """Return the query port targets of all servers in a fleet compose file.
+
+    :param compose_path: compose file written by the fleet generator
+    :param host:
+    :return:
+    """
+    services: dict = json.loads(compose_path.read_text())["services"]
+    return [
+        f"{host}:{service['environment']['QUERYPORT']}" for service in services.values()
+    ]
+
+
+def escape_label(value: str) -> str:
+    """Escape a Prometheus label value.
+
+    :param value:
+    :return:
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Monitor:
+    """Query servers periodically and export their state as Prometheus metrics."""
+
+    def __init__(
+        self,
+        targets: Sequence[str],
+        interval: float = 15.0,
+        timeout: float = 2.0,
+        max_in_flight: int = 64,
+    ):
+        """Initialize the monitor.
+
+        :param targets: servers as ``host:port`` of their query port
+        :param interval: seconds between polls
+        :param timeout: seconds to wait for each response
+        :param max_in_flight: maximum number of servers queried at the same time
+        """
+        self.targets = targets
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.client: A2SClient = A2SClient(timeout=timeout)
+        self.status: dict[str, TargetStatus] = {
+            target: TargetStatus(target) for target in targets
+        }
+        self._addresses: dict[str, Address] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def resolve(self, target: str) -> Address:
+        """Resolve a target to the IP address responses are received from.
+
+        :param target:
+        :return:
+        """
+        if target not in self._addresses:
+            host, port = parse_target(target)
+            addresses: list = await asyncio.get_running_loop().getaddrinfo(
+                host, port, type=socket.SOCK_DGRAM
+            )
+            ipv4: list = [
+                address for address in addresses if address[0] == socket.AF_INET
+            ]
+            self._addresses[target] = (ipv4 or addresses)[0][4][:2]
+        return self._addresses[target]
+
+    async def check(self, target: str) -> TargetStatus:
+        """Query one server and update its status.
+
+        :param target:
+        :return:
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        status: TargetStatus = self.status[target]
+        async with self._semaphore:
+            try:
+                address: Address = await self.resolve(target)
+                status.info, status.latency["info"] = await self.client.query_info(
+                    address
+                )
+                (
+                    status.players,
+                    status.latency["players"],
+                ) = await self.client.query_players(address)
+            except (OSError, TimeoutError, A2SError) as e:
+                if status.up or status.failures == 0:
+                    click.echo(f"{target} stopped responding: {e!r}", err=True)
+                status.up = False
+                status.failures += 1
+                status.error = repr(e)
+                return status
+
+        if not status.up and status.last_response is not None:
+            click.echo(f"{target} is responding again")
+        status.up = True
+        status.failures = 0
+        status.error = None
+        status.last_response = time.time()
+        return status
+
+    async def poll(self) -> list[TargetStatus]:
+        """Query all servers at once.
+
+        :return:
+        """
+        return await asyncio.gather(*(self.check(target) for target in self.targets))
+
+    def metrics(self) -> str:
+        """Render the status of all servers in the Prometheus text format.
+
+        :return:
+        """
+        families: dict[str, tuple[str, list[str]]] = {
+            "sotf_up": ("Whether the server answered the last queries.", []),
+            "sotf_players": ("Players connected to the server.", []),
+            "sotf_max_players": ("Maximum number of players of the server.", []),
+            "sotf_query_latency_seconds": ("Round-trip time of A2S queries.", []),
+            "sotf_last_response_timestamp_seconds": (
+                "Unix time of the last answered queries.",
+                [],
+            ),
+            "sotf_query_failures": ("Consecutive unanswered polls.", []),
+        }
+        for target, status in self.status.items():
+            labels: str = f'target="{escape_label(target)}"'
+            families["sotf_up"][1].append(f"sotf_up{{{labels}}} {int(status.up)}")
+            families["sotf_query_failures"][1].append(
+                f"sotf_query_failures{{{labels}}} {status.failures}"
+            )
+            if status.last_response is not None:
+                families["sotf_last_response_timestamp_seconds"][1].append(
+                    f"sotf_last_response_timestamp_seconds{{{labels}}} "
+                    f"{status.last_response:.3f}"
+                )
+            if status.info is not None:
+                players: int = (
+                    len(status.players)
+                    if status.players is not None
+                    else status.info.players
+                )
+                families["sotf_players"][1].append(
+                    f"sotf_players{{{labels}}} {players}"
+                )
+                families["sotf_max_players"][1].append(
+                    f"sotf_max_players{{{labels}}} {status.info.max_players}"
+                )
+            for query, latency in status.latency.items():
+                families["sotf_query_latency_seconds"][1].append(
+                    f'sotf_query_latency_seconds{{{labels},query="{query}"}} '
+                    f"{latency:.6f}"
+                )
+
+        lines: list[str] = []
+        for name, (description, samples) in families.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+    async def handle_http(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer a metrics request.
+
+        :param reader:
+        :param writer:
+        :return:
+        """
+        try:
+            request_line: bytes = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts: list[str] = request_line.decode(errors="replace").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+                status_line: str = "200 OK"
+                body: bytes = self.metrics().encode()
+                content_type: str = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status_line = "404 Not Found"
+                body = b"Not Found\n"
+                content_type = "text/plain; charset=utf-8"
+            writer.write(
+                f"HTTP/1.1 {status_line}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> asyncio.Server:
+        """Start the metrics endpoint.
+
+        :param host:
+        :param port:
+        :return:
+        """
+        return await asyncio.start_server(self.handle_http, host, port)
+
+    async def run(
+        self, host: str = "0.0.0.0", port: int = 9877, rounds: int | None = None
+    ) -> None:
+        """Serve metrics and poll until stopped.
+
+        :param host:
+        :param port:
+        :param rounds: number of polls, unlimited if None
+        :return:
+        """
+        server: asyncio.Server = await self.serve(host, port)
+        polls: int = 0
+        try:
+            while rounds is None or polls < rounds:
+                polls += 1
+                started: float = time.monotonic()
+                await self.poll()
+                if rounds is None or polls < rounds:
+                    await asyncio.sleep(
+                        max(0.0, self.interval - (time.monotonic() - started))
+                    )
+        finally:
+            server.close()
+            await server.wait_closed()
+            self.client.close()
+
+
+@click.command()
+@click.option(
+    "--target",
+    "targets",
+    multiple=True,
+    help="Query port of a server as host:port, can be given multiple times",
+)
+@click.option(
+    "--fleet",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Monitor all servers of a compose file written by the fleet generator",
+)
+@click.option(
+    "--listen",
+    default="0.0.0.0:9877",
+    show_default=True,
+    help="Address of the metrics endpoint",
+)
+@click.option(
+    "--interval",
+    type=float,
+    default=15.0,
+    show_default=True,
+    help="Seconds between polls",
+)
+@click.option(
+    "--timeout",
+    type=float,
+    default=2.0,
+    show_default=True,
+    help="Seconds to wait for each response",
+)
+def main(
+    targets: tuple[str, ...],
+    fleet: Path | None,
+    listen: str,
+    interval: float,
+    timeout: float,
+) -> None:
+    """Monitor servers over their query port and serve Prometheus metrics.
+
+    :param targets:
+    :param fleet:
+    :param listen:
+    :param interval:
+    :param timeout:
+    :return:
+    """
+    all_targets: list[str] = list(targets)
+    if fleet:
+        all_targets += get_fleet_targets(fleet)
+    if not all_targets:
+        raise click.UsageError("Give at least one --target or --fleet")
+    host, port = parse_target(listen)
+
+    monitor: Monitor = Monitor(all_targets, interval=interval, timeout=timeout)
+    click.echo(
+        f"Monitoring {len(all_targets)} servers, metrics on http://{listen}/metrics"
+    )
+    asyncio.run(monitor.run(host, port))
+
+
+if __name__ == "__main__":
+    # pylint: disable=no-value-for-parameter
+    main()
@@ -0,0 +1,174 @@
+"""Steam product info cache."""
+
+import json
+import os
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Protocol
+
+from steam.client import SteamClient
+
+
+class SteamTransport(Protocol):
+    """Source of Steam product info for a single app."""
+
+    def get_product_info(self, app_id: int) -> dict:
+        """Return the product info for an app.
+
+        :param app_id:
+        :return:
+        """
+
+
+class SteamClientTransport:
+    """Fetch product info with one anonymous Steam client, logged in on demand."""
+
+    def __init__(self, timeout: int = 10):
+        """Initialize the transport.
+
+        :param timeout:
+        """
+        self.timeout = timeout
+        self._client: SteamClient | None = None
+
+    @property
+    def client(self) -> SteamClient:
+        """Return a logged-in Steam client, logging in again if the session dropped.
+
+        :return:
+        """
+        if self._client is None:
+            self._client = SteamClient()
+            self._client.verbose_debug = False
+        if not self._client.logged_on:
+            self._client.anonymous_login()
+        return self._client
+
+    def get_product_info(self, app_id: int) -> dict:
+        """Return the product info for an app.
+
+        :param app_id:
+        :return:
+        """
+        info: dict | None = self.client.get_product_info(
+            apps=[app_id], timeout=self.timeout
+        )
+        if info is None:
+            raise TimeoutError(f"No product info received for app {app_id}")
+        return info["apps"][app_id]
+
+    def close(self) -> None:
+        """Log out and disconnect the Steam client.
+
+        :return:
+        """
+        if self._client is not None:
+            self._client.logout()
+            self._client = None
+
+
+class FileTransport:
+    """Read product info from a JSON file instead of Steam, for offline use."""
+
+    def __init__(self, path: Path):
+        """Initialize the transport.
+
+        :param path: JSON file holding the product info of one app
+        """
+        self.path = path
+
+    def get_product_info(self, app_id: int) -> dict:
+        """Return the product info stored in the file.
+
+        :param app_id:
+        :return:
+        """
+        return json.loads(self.path.read_text())
+
+
+class ProductInfoCache:
+    """Product info stored on disk and refreshed after a TTL."""
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: float,
+        transport: SteamTransport,
+    ):
+        """Initialize the cache.
+
+        :param path: JSON file holding the cached product info
+        :param ttl: seconds a cached entry is used without asking Steam
+        :param transport:
+        """
+        self.path = path
+        self.ttl = ttl
+        self.transport = transport
+
+    def _load(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _store(self, entries: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(
+            "w", dir=self.path.parent, prefix=f".{self.path.name}.", delete=False
+        ) as file:
+            json.dump(entries, file)
+        os.replace(file.name, self.path)
+
+    def get_app_info(self, app_id: int) -> dict:
+        """Return product info for an app, from the cache while it is fresh.
+
+        If Steam cannot be reached, a stale cached entry is returned instead.
+
+        :param app_id:
+        :return:
+        """
+        entries: dict = self._load()
+        entry: dict | None = entries.get(str(app_id))
+        if entry and time.time() - entry["fetched_at"] < self.ttl:
+            return entry["info"]
+
+        try:
+            info: dict = self.transport.get_product_info(app_id)
+        except Exception:
+            if entry:
+                return entry["info"]
+            raise
+
+        entries[str(app_id)] = {
+            "fetched_at": time.time(),
+            "change_number": info.get("_change_number"),
+            "info": info,
+        }
+        self._store(entries)
+        return info
+
+    def get_change_number(self, app_id: int) -> int | None:
+        """Return the change number of the cached product info.
+
+        :param app_id:
+        :return:
+        """
+        entry: dict | None = self._load().get(str(app_id))
+        return entry["change_number"] if entry else None
+
+    def get_build_ids(self, app_id: int, branches: Iterable[str]) -> dict[str, str]:
+        """Return the build IDs of several branches from one product info lookup.
+
+        :param app_id:
+        :param branches:
+        :return:
+        """
+        available: dict = self.get_app_info(app_id)["depots"]["branches"]
+        build_ids: dict[str, str] = {}
+        for branch in branches:
+            if branch not in available:
+                raise KeyError(f"Branch {branch} not found for app {app_id}")
+            build_ids[branch] = str(available[branch]["buildid"])
+        return build_ids
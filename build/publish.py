@@ -1,19 +1,312 @@
 """Publish CLI."""
 
+import asyncio
+import time
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from os import getenv
 from pathlib import Path
+from threading import Lock
 
 import click
 from python_on_whales import Builder, DockerClient
+from python_on_whales.components.buildx.imagetools.models import Manifest
 
-from build.constants import PLATFORMS
+from build.constants import CACHE_DIR, DEFAULT_BRANCH, PLATFORMS
+from build.game_files import GameFilesReport, get_build_args, report_game_files
+from build.product_info import FileTransport, ProductInfoCache, SteamClientTransport
 from build.utils import (
     create_tag,
     get_context,
     get_image_reference,
-    get_sotf_build_id,
-    tag_exists,
+    get_product_info_cache,
+    get_sotf_build_ids,
+    get_sotf_depot_manifests,
+    get_tag_index,
 )
+from build.watcher import BuildWatcher, backoff
+
+
+@dataclass(frozen=True)
+class RegistryTarget:
+    """Registry to publish to, with its own credentials."""
+
+    registry: str
+    username: str | None = None
+    password: str | None = None
+
+
+@dataclass
+class PushReport:
+    """Outcome of pushing one image to one registry."""
+
+    registry: str
+    attempts: int = 0
+    duration: float = 0.0
+    # Compressed size of the image in the registry, including layers it had already
+    image_bytes: int = 0
+    error: Exception | None = None
+
+    def __str__(self) -> str:
+        """Summarize the report.
+
+        :return:
+        """
+        if self.error is not None:
+            return (
+                f"Push to {self.registry}: failed after {self.attempts} attempts: "
+                f"{self.error}"
+            )
+        return (
+            f"Push to {self.registry}: image of {self.image_bytes} bytes "
+            f"in {self.duration:.1f}s, {self.attempts} attempts"
+        )
+
+
+def read_registry_credentials(path: Path | None = None) -> list[str]:
+    """Return the registry credentials of REGISTRY_CREDENTIALS and a file.
+
+    Both hold one ``registry=username:password`` entry per line. Credentials are
+    never passed as arguments, as process listings show them.
+
+    :param path: credentials file
+    :return:
+    """
+    lines: list[str] = getenv("REGISTRY_CREDENTIALS", "").splitlines()
+    if path is not None:
+        lines += path.read_text().splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def parse_registry_targets(
+    registries: Sequence[str],
+    credentials: Sequence[str],
+    docker_hub_username: str | None = None,
+    docker_hub_password: str | None = None,
+) -> list[RegistryTarget]:
+    """Return the registries to publish to with their credentials.
+
+    Registries without credentials of their own use the Docker Hub credentials.
+
+    :param registries:
+    :param credentials: credentials as ``registry=username:password``
+    :param docker_hub_username:
+    :param docker_hub_password:
+    :return:
+    """
+    logins: dict[str, tuple[str, str]] = {}
+    for entry in credentials:
+        registry, separator, login = entry.partition("=")
+        username, colon, password = login.partition(":")
+        if not separator or not colon:
+            raise click.BadParameter(
+                f"Credentials of {registry} must be given as "
+                "registry=username:password",
+                param_hint="REGISTRY_CREDENTIALS",
+            )
+        logins[registry] = (username, password)
+    return [
+        RegistryTarget(
+            registry, *logins.get(registry, (docker_hub_username, docker_hub_password))
+        )
+        for registry in registries
+    ]
+
+
+class Publisher:
+    """Build images once and push them to several registries in parallel.
+
+    The image is built once in a shared BuildX builder. Each registry push then
+    reuses the build result from the builder's cache, so pushes only upload
+    layers. A failing push is retried and never blocks the other registries.
+    Building the same Steam build again only pushes to the registries that
+    failed before.
+    """
+
+    def __init__(
+        self,
+        targets: Sequence[RegistryTarget],
+        cache_to: str | None,
+        cache_from: str | None,
+        platforms: Sequence[str] = PLATFORMS,
+        push_attempts: int = 3,
+        retry_delay: float = 5.0,
+        docker_client: DockerClient | None = None,
+    ):
+        """Initialize the publisher.
+
+        :param targets: registries to push to
+        :param cache_to:
+        :param cache_from:
+        :param platforms:
+        :param push_attempts: attempts per registry before a push fails
+        :param retry_delay: base seconds of the backoff between attempts
+        :param docker_client:
+        """
+        self.targets = targets
+        self.cache_to = cache_to
+        self.cache_from = cache_from
+        self.platforms = list(platforms)
+        self.push_attempts = push_attempts
+        self.retry_delay = retry_delay
+        self.docker_client: DockerClient = docker_client or DockerClient()
+        self.builder: Builder | None = None
+        self.logged_in: set[RegistryTarget] = set()
+        # Targets each branch and build ID was pushed to
+        self.pushed: dict[tuple[str, str], set[RegistryTarget]] = {}
+        self._lock = Lock()
+
+    def get_builder(self) -> Builder:
+        """Create the builder on first use.
+
+        :return:
+        """
+        with self._lock:
+            if self.builder is None:
+                self.builder = self.docker_client.buildx.create(
+                    driver="docker-container", driver_options=dict(network="host")
+                )
+            return self.builder
+
+    def login(self, target: RegistryTarget) -> None:
+        """Log in to a registry once, if it has credentials.
+
+        :param target:
+        :return:
+        """
+        # Logins write to the same Docker config file, so they must not overlap
+        with self._lock:
+            if target in self.logged_in:
+                return
+            if target.username and target.password:
+                self.docker_client.login(
+                    server=target.registry,
+                    username=target.username,
+                    password=target.password,
+                )
+            self.logged_in.add(target)
+
+    def get_image_size(self, reference: str) -> int:
+        """Return the bytes of all layers and configs of an image in a registry.
+
+        :param reference:
+        :return:
+        """
+        manifest: Manifest = self.docker_client.buildx.imagetools.inspect(reference)
+        if not manifest.manifests:
+            sizes: list[int | None] = [layer.size for layer in manifest.layers or []]
+            if manifest.config:
+                sizes.append(manifest.config.size)
+            return sum(size or 0 for size in sizes)
+        repository: str = reference.rsplit(":", 1)[0]
+        return sum(
+            self.get_image_size(f"{repository}@{variant.digest}")
+            for variant in manifest.manifests
+            # Skip attestation manifests
+            if not variant.platform or variant.platform.os != "unknown"
+        )
+
+    def push(
+        self,
+        target: RegistryTarget,
+        tags: Sequence[str],
+        build_args: dict[str, str],
+    ) -> PushReport:
+        """Push the built image to a registry, retrying failed attempts.
+
+        :param target:
+        :param tags: image tags without registry and repository
+        :param build_args:
+        :return:
+        """
+        report: PushReport = PushReport(registry=target.registry)
+        references: list[str] = [
+            get_image_reference(target.registry, tag) for tag in tags
+        ]
+        while report.attempts < self.push_attempts:
+            report.attempts += 1
+            start: float = time.monotonic()
+            try:
+                self.login(target)
+                self.docker_client.buildx.build(
+                    context_path=get_context(),
+                    tags=references,
+                    build_args=build_args,
+                    platforms=self.platforms,
+                    builder=self.get_builder(),
+                    cache_from=self.cache_from,
+                    push=True,
+                )
+                report.duration = time.monotonic() - start
+                report.image_bytes = self.get_image_size(references[0])
+                report.error = None
+                return report
+            except Exception as e:
+                report.error = e
+                if report.attempts < self.push_attempts:
+                    time.sleep(backoff(report.attempts, self.retry_delay, 60.0))
+        return report
+
+    def build(
+        self, branch: str, build_id: str, manifests: dict[str, str]
+    ) -> list[PushReport]:
+        """Build the image for a Steam build once and push it to all registries.
+
+        :param branch:
+        :param build_id:
+        :param manifests: depot manifest IDs of the build
+        :return: one report per registry not yet pushed to
+        """
+        pushed: set[RegistryTarget] = self.pushed.setdefault((branch, build_id), set())
+        targets: list[RegistryTarget] = [
+            target for target in self.targets if target not in pushed
+        ]
+        if not targets:
+            return []
+        moving_tag: str = "latest" if branch == DEFAULT_BRANCH else branch
+        tags: list[str] = [create_tag(build_id), moving_tag]
+        build_args: dict[str, str] = get_build_args(build_id, manifests)
+        if branch != DEFAULT_BRANCH:
+            build_args["SOTF_BRANCH"] = branch
+
+        # Build without output, the result stays in the builder's cache
+        report: GameFilesReport = GameFilesReport()
+        logs = self.docker_client.buildx.build(
+            context_path=get_context(),
+            build_args=build_args,
+            platforms=self.platforms,
+            builder=self.get_builder(),
+            cache_to=self.cache_to,
+            cache_from=self.cache_from,
+            progress="plain",
+            stream_logs=True,
+        )
+        for line in report_game_files(logs, report):
+            click.echo(line, nl=False)
+        click.echo(report)
+
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            push_reports: list[PushReport] = list(
+                executor.map(
+                    lambda target: self.push(target, tags, build_args), targets
+                )
+            )
+        for target, push_report in zip(targets, push_reports):
+            click.echo(push_report)
+            if push_report.error is None:
+                pushed.add(target)
+        return push_reports
+
+    def close(self) -> None:
+        """Remove the builder.
+
+        :return:
+        """
+        if self.builder is not None:
+            self.docker_client.buildx.stop(self.builder)
+            self.docker_client.buildx.remove(self.builder)
+            self.builder = None
 
 
 @click.command()
@@ -28,68 +321,167 @@ from build.utils import (
     help="Docker Hub password",
 )
 @click.option(
-    "--registry", envvar="REGISTRY", default="docker.io", help="Docker registry"
+    "--registry",
+    "registries",
+    envvar="REGISTRY",
+    multiple=True,
+    default=["docker.io"],
+    show_default=True,
+    help="Docker registry, can be given multiple times to publish to all of them",
+)
+@click.option(
+    "--registry-credentials-file",
+    envvar="REGISTRY_CREDENTIALS_FILE",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="File with registry credentials as registry=username:password per line, "
+    "like REGISTRY_CREDENTIALS. Registries without credentials use the Docker Hub "
+    "credentials",
+)
+@click.option(
+    "--platform",
+    "platforms",
+    multiple=True,
+    default=PLATFORMS,
+    show_default=True,
+    help="Image platform, can be given multiple times",
+)
+@click.option(
+    "--branch",
+    "branches",
+    multiple=True,
+    default=[DEFAULT_BRANCH],
+    show_default=True,
+    help="Steam branch to publish, can be given multiple times",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Keep polling Steam and the registry, and publish new builds",
+)
+@click.option(
+    "--interval",
+    type=float,
+    default=300.0,
+    show_default=True,
+    help="Seconds between polls in watch mode",
+)
+@click.option(
+    "--max-concurrent-builds",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Maximum number of builds running at the same time",
+)
+@click.option(
+    "--steam-product-info",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Read Steam product info from this JSON file instead of Steam (offline)",
 )
 def main(
     docker_hub_username: str,
     docker_hub_password: str,
-    registry: str,
+    registries: tuple[str, ...],
+    registry_credentials_file: Path | None,
+    platforms: tuple[str, ...],
+    branches: tuple[str, ...],
+    watch: bool,
+    interval: float,
+    max_concurrent_builds: int,
+    steam_product_info: Path | None,
 ) -> None:
-    """Build and publish image to Docker Hub.
+    """Build and publish images for new Steam builds to Docker registries.
 
     :param docker_hub_username:
     :param docker_hub_password:
-    :param registry:
+    :param registries:
+    :param registry_credentials_file:
+    :param platforms:
+    :param branches:
+    :param watch:
+    :param interval:
+    :param max_concurrent_builds:
+    :param steam_product_info:
     :return:
     """
     github_ref_name: str = getenv("GITHUB_REF_NAME")
-    context: Path = get_context()
 
-    click.echo("Checking Rust server build ID for release branch...")
-    current_sotf_server_build_id = get_sotf_build_id()
-    click.echo(f"Current Rust server build ID: {current_sotf_server_build_id}")
+    if github_ref_name:
+        cache_to: str = f"type=gha,mode=max,scope={github_ref_name}"
+        cache_from: str = f"type=gha,scope={github_ref_name}"
+    else:
+        cache_to = f"type=local,mode=max,dest=/tmp,scope={github_ref_name}"
+        cache_from = f"type=local,src=/tmp,scope={github_ref_name}"
 
-    if tag_exists(current_sotf_server_build_id):
-        click.echo(
-            "Image for this build ID already exists. Skipping Docker image build..."
+    if steam_product_info:
+        product_info_cache: ProductInfoCache = ProductInfoCache(
+            path=CACHE_DIR / "offline_product_info.json",
+            ttl=0,
+            transport=FileTransport(steam_product_info),
+        )
+    elif watch:
+        product_info_cache = ProductInfoCache(
+            path=CACHE_DIR / "product_info.json",
+            ttl=0,
+            transport=SteamClientTransport(),
         )
     else:
-        click.echo("Building Rust server Docker image...")
-
-        tag = create_tag(current_sotf_server_build_id)
-        image_reference_version: str = get_image_reference(registry, tag)
-        image_reference_latest: str = get_image_reference(registry, "latest")
-        if github_ref_name:
-            cache_to: str = f"type=gha,mode=max,scope={github_ref_name}"
-            cache_from: str = f"type=gha,scope={github_ref_name}"
-        else:
-            cache_to = f"type=local,mode=max,dest=/tmp,scope={github_ref_name}"
-            cache_from = f"type=local,src=/tmp,scope={github_ref_name}"
+        product_info_cache = get_product_info_cache()
 
-        docker_client: DockerClient = DockerClient()
-        builder: Builder = docker_client.buildx.create(
-            driver="docker-container", driver_options=dict(network="host")
-        )
+    targets: list[RegistryTarget] = parse_registry_targets(
+        registries,
+        read_registry_credentials(registry_credentials_file),
+        docker_hub_username,
+        docker_hub_password,
+    )
+    publisher: Publisher = Publisher(
+        targets=targets,
+        cache_to=cache_to,
+        cache_from=cache_from,
+        platforms=platforms,
+    )
 
-        docker_client.login(
-            server=registry,
-            username=docker_hub_username,
-            password=docker_hub_password,
+    def build(branch: str, build_id: str) -> None:
+        manifests: dict[str, str] = watcher.call_steam(
+            get_sotf_depot_manifests, branch, product_info_cache
         )
+        failed: list[str] = [
+            report.registry
+            for report in publisher.build(branch, build_id, manifests)
+            if report.error is not None
+        ]
+        if failed:
+            raise RuntimeError(f"Push to {', '.join(failed)} failed")
 
-        docker_client.buildx.build(
-            context_path=context,
-            tags=[image_reference_version, image_reference_latest],
-            platforms=PLATFORMS,
-            builder=builder,
-            cache_to=cache_to,
-            cache_from=cache_from,
-            push=True,
-        )
+    watcher: BuildWatcher = BuildWatcher(
+        get_build_ids=lambda: get_sotf_build_ids(branches, product_info_cache),
+        tag_sources=[
+            get_tag_index(target.registry, target.username, target.password)
+            for target in targets
+        ],
+        build=build,
+        interval=interval,
+        max_concurrent_builds=max_concurrent_builds,
+    )
 
-        # Cleanup
-        docker_client.buildx.stop(builder)
-        docker_client.buildx.remove(builder)
+    try:
+        if watch:
+            click.echo(f"Watching Steam branches {', '.join(branches)}...")
+            asyncio.run(watcher.run())
+        else:
+            click.echo(f"Checking server build IDs for {', '.join(branches)}...")
+            if not asyncio.run(watcher.run_once()):
+                click.echo(
+                    "Images for these build IDs already exist. "
+                    "Skipping Docker image build..."
+                )
+            if watcher.failed:
+                failed: str = ", ".join(
+                    f"{tag} for branch {branch}"
+                    for tag, branch in sorted(watcher.failed)
+                )
+                raise click.ClickException(f"Failed to publish {failed}")
+    finally:
+        publisher.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+"""Index of image tags published to a registry."""
+
+import json
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import ClassVar
+from urllib.parse import urljoin
+
+import requests
+from requests.auth import AuthBase
+
+
+def docker_hub_tags_url(repository: str, page_size: int = 100) -> str:
+    """Return the first page URL of the Docker Hub tags endpoint.
+
+    :param repository: repository including namespace, e.g. ``namespace/name``
+    :param page_size:
+    :return:
+    """
+    namespace, name = repository.split("/", 1)
+    return (
+        f"https://hub.docker.com/v2/namespaces/{namespace}/repositories/{name}/tags"
+        f"?page_size={page_size}"
+    )
+
+
+def registry_tags_url(registry: str, repository: str, page_size: int = 100) -> str:
+    """Return the first page URL of a Registry v2 tags list.
+
+    :param registry: registry host, optionally with scheme
+    :param repository:
+    :param page_size:
+    :return:
+    """
+    if "://" not in registry:
+        registry = f"https://{registry}"
+    return f"{registry.rstrip('/')}/v2/{repository}/tags/list?n={page_size}"
+
+
+class TagIndex:
+    """Tags of a repository, stored on disk and refreshed with conditional requests.
+
+    Both the Docker Hub API, paginated with ``next`` in the response body, and the
+    Registry v2 API, paginated with a ``Link`` header, are supported. Every page is
+    stored with its ETag, so unchanged pages are answered with 304 Not Modified.
+    """
+
+    # Indexes of several registries may share one file and refresh concurrently
+    _store_lock: ClassVar[Lock] = Lock()
+
+    def __init__(
+        self,
+        url: str,
+        path: Path,
+        auth: AuthBase | None = None,
+        timeout: float = 10.0,
+    ):
+        """Initialize the tag index.
+
+        :param url: first page of the tags endpoint
+        :param path: JSON file holding the stored pages
+        :param auth:
+        :param timeout:
+        """
+        self.url = url
+        self.path = path
+        self.auth = auth
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._tags: set[str] | None = None
+
+    def _load(self) -> dict:
+        try:
+            stored: dict = json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return stored.get(self.url, {})
+
+    def _store(self, pages: dict) -> None:
+        with self._store_lock:
+            try:
+                stored: dict = json.loads(self.path.read_text())
+            except (FileNotFoundError, json.JSONDecodeError):
+                stored = {}
+            stored[self.url] = pages
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(
+                "w", dir=self.path.parent, prefix=f".{self.path.name}.", delete=False
+            ) as file:
+                json.dump(stored, file)
+            os.replace(file.name, self.path)
+
+    def _fetch_page(self, url: str, stored_page: dict | None) -> dict:
+        headers: dict[str, str] = {}
+        if stored_page and stored_page.get("etag"):
+            headers["If-None-Match"] = stored_page["etag"]
+        response = self.session.get(
+            url, headers=headers, auth=self.auth, timeout=self.timeout
+        )
+        if response.status_code == 304 and stored_page:
+            return stored_page
+        response.raise_for_status()
+
+        body: dict = response.json()
+        if "results" in body:
+            tags: list[str] = [tag["name"] for tag in body["results"]]
+            next_url: str | None = body.get("next")
+        else:
+            tags = body.get("tags") or []
+            next_link: dict | None = response.links.get("next")
+            next_url = urljoin(url, next_link["url"]) if next_link else None
+        return {"etag": response.headers.get("ETag"), "tags": tags, "next": next_url}
+
+    def refresh(self) -> set[str]:
+        """Follow all pages of the tags endpoint and store the result.
+
+        :return:
+        """
+        stored_pages: dict = self._load()
+        pages: dict = {}
+        url: str | None = self.url
+        while url and url not in pages:
+            pages[url] = self._fetch_page(url, stored_pages.get(url))
+            url = pages[url]["next"]
+        self._store(pages)
+        self._tags = {tag for page in pages.values() for tag in page["tags"]}
+        return self._tags
+
+    @property
+    def tags(self) -> set[str]:
+        """Return all tags, refreshing the index on first access.
+
+        :return:
+        """
+        if self._tags is None:
+            self.refresh()
+        return self._tags
+
+    def __contains__(self, tag: str) -> bool:
+        """Check if the repository has exactly this tag.
+
+        :param tag:
+        :return:
+        """
+        return tag in self.tags
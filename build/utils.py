@@ -1,9 +1,20 @@
 """Utilities for image publishing."""
 
+from collections.abc import Iterable
+from functools import cache
 from pathlib import Path
 
-import requests
-from steam.client import SteamClient
+from requests.auth import HTTPBasicAuth
+
+from build.constants import (
+    CACHE_DIR,
+    IMAGE_REPOSITORY,
+    PRODUCT_INFO_CACHE_TTL,
+    SOTF_APP_ID,
+)
+from build.game_files import get_depot_manifests
+from build.product_info import ProductInfoCache, SteamClientTransport
+from build.tag_index import TagIndex, docker_hub_tags_url, registry_tags_url
 
 
 def get_context() -> Path:
@@ -24,39 +35,105 @@ def get_image_reference(
     :param image_version:
     :return:
     """
-    reference: str = f"{registry}/pfeiffermax/sotf-dedicated-game-server:{tag}"
+    reference: str = f"{registry}/{IMAGE_REPOSITORY}:{tag}"
     return reference
 
 
-def get_sotf_build_id() -> str:
-    """Pull the SOTF server's build ID using the Steam Client.
+@cache
+def get_product_info_cache() -> ProductInfoCache:
+    """Return the shared product info cache, backed by one Steam client.
 
     :return:
     """
-    client = SteamClient()
-    client.anonymous_login()
-    client.verbose_debug = False
-    info: dict = client.get_product_info(apps=[2465200], timeout=1)
-    build_id: str = info["apps"][2465200]["depots"]["branches"]["release"]["buildid"]
-    return build_id
+    return ProductInfoCache(
+        path=CACHE_DIR / "product_info.json",
+        ttl=PRODUCT_INFO_CACHE_TTL,
+        transport=SteamClientTransport(),
+    )
 
 
-def tag_exists(build_id: str) -> bool:
-    """Pull tag data from Docker Hub and check if tag with this build_id already exists.
+def get_sotf_build_ids(
+    branches: Iterable[str] = ("release",),
+    product_info_cache: ProductInfoCache | None = None,
+) -> dict[str, str]:
+    """Return the SOTF server's build IDs for several branches in one lookup.
 
-    :param build_id:
+    :param branches:
+    :param product_info_cache:
     :return:
     """
-    response = requests.get(
-        "https://hub.docker.com/v2/namespaces/pfeiffermax/repositories/sotf-dedicated-game-server/tags"
-    )
-    response.raise_for_status()
-    tags: dict = response.json()["results"]
-    matching_tags: list[dict] = [tag for tag in tags if (build_id in tag["name"])]
-    if matching_tags:
-        return True
+    if product_info_cache is None:
+        product_info_cache = get_product_info_cache()
+    return product_info_cache.get_build_ids(SOTF_APP_ID, branches)
+
+
+def get_sotf_build_id(
+    branch: str = "release",
+    product_info_cache: ProductInfoCache | None = None,
+) -> str:
+    """Pull the SOTF server's build ID using the cached Steam product info.
+
+    :param branch:
+    :param product_info_cache:
+    :return:
+    """
+    return get_sotf_build_ids([branch], product_info_cache)[branch]
+
+
+def get_sotf_depot_manifests(
+    branch: str = "release",
+    product_info_cache: ProductInfoCache | None = None,
+) -> dict[str, str]:
+    """Return the manifest IDs of the SOTF server's Windows depots for a branch.
+
+    :param branch:
+    :param product_info_cache:
+    :return:
+    """
+    if product_info_cache is None:
+        product_info_cache = get_product_info_cache()
+    return get_depot_manifests(product_info_cache.get_app_info(SOTF_APP_ID), branch)
+
+
+@cache
+def get_tag_index(
+    registry: str = "docker.io",
+    username: str | None = None,
+    password: str | None = None,
+) -> TagIndex:
+    """Return the shared index of tags published to a registry.
+
+    Docker Hub is queried through its tags API, other registries through the
+    Registry v2 API. Like the Docker daemon, registries on localhost are accessed
+    without TLS.
+
+    :param registry:
+    :param username:
+    :param password:
+    :return:
+    """
+    if registry == "docker.io":
+        url: str = docker_hub_tags_url(IMAGE_REPOSITORY)
     else:
-        return False
+        host: str = registry.split(":")[0]
+        scheme: str = "http" if host in ("localhost", "127.0.0.1") else "https"
+        url = registry_tags_url(f"{scheme}://{registry}", IMAGE_REPOSITORY)
+    auth: HTTPBasicAuth | None = None
+    if username and password and registry != "docker.io":
+        auth = HTTPBasicAuth(username, password)
+    return TagIndex(url=url, path=CACHE_DIR / "tag_index.json", auth=auth)
+
+
+def tag_exists(build_id: str, tag_index: TagIndex | None = None) -> bool:
+    """Check if the image tag for this build_id has already been published.
+
+    :param build_id:
+    :param tag_index:
+    :return:
+    """
+    if tag_index is None:
+        tag_index = get_tag_index()
+    return create_tag(build_id) in tag_index
 
 
 def create_tag(build_id: str) -> str:
@@ -0,0 +1,181 @@
+"""Watcher starting image builds for new Steam builds."""
+
+import asyncio
+import random
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Protocol, TypeVar
+
+import click
+
+from build.utils import create_tag
+
+T = TypeVar("T")
+
+
+class TagSource(Protocol):
+    """Tags published to a registry."""
+
+    tags: set[str]
+
+    def refresh(self) -> set[str]:
+        """Fetch the current tags.
+
+        :return:
+        """
+
+
+def jitter(delay: float, spread: float = 0.1) -> float:
+    """Return the delay randomly changed by up to the spread in both directions.
+
+    :param delay:
+    :param spread:
+    :return:
+    """
+    return delay * random.uniform(1 - spread, 1 + spread)
+
+
+def backoff(failures: int, base: float, maximum: float) -> float:
+    """Return an exponential backoff delay with full jitter.
+
+    :param failures: number of consecutive failures
+    :param base:
+    :param maximum:
+    :return:
+    """
+    return random.uniform(0, min(maximum, base * 2 ** (failures - 1)))
+
+
+class BuildWatcher:
+    """Poll Steam branches and registries, and build images for new Steam builds.
+
+    A build is started for every build ID whose tag is missing in at least one
+    registry. Events for the same build ID and branch are coalesced. Branches
+    sharing a build ID are built each, so every branch's moving tag is pushed. At
+    most max_concurrent_builds builds run at the same time.
+    """
+
+    def __init__(
+        self,
+        get_build_ids: Callable[[], dict[str, str]],
+        tag_sources: Sequence[TagSource],
+        build: Callable[[str, str], None],
+        interval: float = 300.0,
+        max_concurrent_builds: int = 1,
+        max_backoff: float = 3600.0,
+    ):
+        """Initialize the watcher.
+
+        :param get_build_ids: return the current build ID of each watched branch
+        :param tag_sources:
+        :param build: build and push the image for a branch and build ID
+        :param interval: seconds between polls
+        :param max_concurrent_builds:
+        :param max_backoff: maximum seconds to wait after failed polls
+        """
+        self.get_build_ids = get_build_ids
+        self.tag_sources = tag_sources
+        self.build = build
+        self.interval = interval
+        self.max_concurrent_builds = max_concurrent_builds
+        self.max_backoff = max_backoff
+        # Tag and branch of running builds, the branch selects the moving tag
+        self.started: set[tuple[str, str]] = set()
+        self.failed: dict[tuple[str, str], Exception] = {}
+        self.tasks: set[asyncio.Task] = set()
+        # The Steam client is not thread safe, all Steam requests use one thread
+        self.steam_executor = ThreadPoolExecutor(max_workers=1)
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def call_steam(self, function: Callable[..., T], *args) -> T:
+        """Call a function using Steam on the Steam thread, e.g. from a build.
+
+        :param function:
+        :param args:
+        :return:
+        """
+        return self.steam_executor.submit(function, *args).result()
+
+    async def poll(self) -> list[tuple[str, str]]:
+        """Poll Steam and all registries at once and start builds for new build IDs.
+
+        :return: branch and build ID of every started build
+        """
+        loop = asyncio.get_running_loop()
+        build_ids, *_ = await asyncio.gather(
+            loop.run_in_executor(self.steam_executor, self.get_build_ids),
+            *(asyncio.to_thread(source.refresh) for source in self.tag_sources),
+        )
+
+        started: list[tuple[str, str]] = []
+        for branch, build_id in build_ids.items():
+            key: tuple[str, str] = (create_tag(build_id), branch)
+            if key in self.started:
+                continue
+            if all(key[0] in source.tags for source in self.tag_sources):
+                continue
+            self.started.add(key)
+            self.failed.pop(key, None)
+            task: asyncio.Task = asyncio.create_task(self._build(branch, build_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            started.append((branch, build_id))
+        return started
+
+    async def _build(self, branch: str, build_id: str) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_builds)
+        tag: str = create_tag(build_id)
+        key: tuple[str, str] = (tag, branch)
+        async with self._semaphore:
+            click.echo(f"Building image for build ID {build_id} of branch {branch}...")
+            try:
+                await asyncio.to_thread(self.build, branch, build_id)
+            except Exception as e:
+                click.echo(f"Build of {tag} for branch {branch} failed: {e}", err=True)
+                self.failed[key] = e
+                # Allow the next poll to retry the build
+                self.started.discard(key)
+            else:
+                click.echo(f"Image {tag} for branch {branch} published")
+
+    async def wait_for_builds(self) -> None:
+        """Wait until all started builds are finished.
+
+        :return:
+        """
+        while self.tasks:
+            await asyncio.gather(*self.tasks)
+
+    async def run_once(self) -> list[tuple[str, str]]:
+        """Poll once and wait for the started builds, without retrying failed polls.
+
+        :return: branch and build ID of every started build
+        """
+        started: list[tuple[str, str]] = await self.poll()
+        await self.wait_for_builds()
+        return started
+
+    async def run(self, rounds: int | None = None) -> None:
+        """Poll until stopped, backing off with jitter after failed polls.
+
+        :param rounds: number of polls, unlimited if None
+        :return:
+        """
+        failures: int = 0
+        polls: int = 0
+        while rounds is None or polls < rounds:
+            polls += 1
+            try:
+                for branch, build_id in await self.poll():
+                    click.echo(f"New build ID {build_id} on branch {branch}")
+            except Exception as e:
+                failures += 1
+                delay: float = backoff(failures, self.interval / 10, self.max_backoff)
+                click.echo(f"Polling failed: {e}, retrying in {delay:.1f}s", err=True)
+            else:
+                failures = 0
+                delay = jitter(self.interval)
+            if rounds is None or polls < rounds:
+                await asyncio.sleep(delay)
+        await self.wait_for_builds()
@@ -1,8 +1,14 @@
 """Basic test fixtures."""
 
+from collections.abc import Iterator
+from http.server import ThreadingHTTPServer
+from threading import Thread
+
 import pytest
 from python_on_whales import Builder, DockerClient
 
+from tests.fakes import TAGS, FakeTagsHandler
+
 
 @pytest.fixture(scope="session")
 def docker_client() -> DockerClient:
@@ -26,3 +32,20 @@ def buildx_builder(docker_client: DockerClient) -> Builder:
     yield builder
     docker_client.buildx.stop(builder)
     docker_client.buildx.remove(builder)
+
+
+@pytest.fixture
+def tags_server() -> Iterator[str]:
+    """Provide a local HTTP server serving tag lists.
+
+    :return:
+    """
+    FakeTagsHandler.tags = list(TAGS)
+    FakeTagsHandler.requests = []
+    FakeTagsHandler.not_modified = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTagsHandler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,286 @@
+"""Fakes for tests."""
+
+import asyncio
+import json
+import struct
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler
+from threading import Lock
+from typing import ClassVar
+from urllib.parse import parse_qs, urlparse
+
+from python_on_whales.components.buildx.imagetools.models import Manifest
+
+
+class FakeSteamTransport:
+    """Steam responder serving product info from memory."""
+
+    def __init__(
+        self,
+        branches: dict[str, str],
+        change_number: int = 1,
+        depots: dict[str, dict] | None = None,
+    ):
+        """Initialize the fake responder.
+
+        :param branches:
+        :param change_number:
+        :param depots: depot entries keyed by depot ID
+        """
+        self.branches = branches
+        self.change_number = change_number
+        self.depots = depots or {}
+        self.requests: int = 0
+        self.fail: bool = False
+
+    def get_product_info(self, app_id: int) -> dict:
+        """Return fake product info.
+
+        :param app_id:
+        :return:
+        """
+        self.requests += 1
+        if self.fail:
+            raise TimeoutError("Steam did not answer")
+        return {
+            "appid": str(app_id),
+            "_change_number": self.change_number,
+            "depots": {
+                **self.depots,
+                "branches": {
+                    name: {"buildid": build_id}
+                    for name, build_id in self.branches.items()
+                },
+            },
+        }
+
+
+TAGS: list[str] = [f"build-{build_id}" for build_id in range(1000, 1025)] + ["latest"]
+
+
+class FakeTagsHandler(BaseHTTPRequestHandler):
+    """Serve paginated tag lists in Registry v2 and Docker Hub format."""
+
+    tags: ClassVar[list[str]] = TAGS
+    requests: ClassVar[list[str]] = []
+    not_modified: ClassVar[int] = 0
+
+    def log_message(self, format, *args):
+        """Silence request logging.
+
+        :param format:
+        :param args:
+        :return:
+        """
+
+    def do_GET(self):
+        """Serve one page of tags.
+
+        :return:
+        """
+        url = urlparse(self.path)
+        query: dict = parse_qs(url.query)
+        self.requests.append(self.path)
+
+        if url.path.endswith("/tags/list"):
+            page_size: int = int(query.get("n", ["10"])[0])
+            last: str | None = query.get("last", [None])[0]
+            start: int = self.tags.index(last) + 1 if last else 0
+            page: list[str] = self.tags[start : start + page_size]
+            body: dict = {"name": "pfeiffermax/sotf", "tags": page}
+            next_link: str | None = None
+            if start + page_size < len(self.tags):
+                next_link = f"{url.path}?n={page_size}&last={page[-1]}"
+        else:
+            page_size = int(query.get("page_size", ["10"])[0])
+            number: int = int(query.get("page", ["1"])[0])
+            start = (number - 1) * page_size
+            page = self.tags[start : start + page_size]
+            next_url: str | None = None
+            if start + page_size < len(self.tags):
+                next_url = (
+                    f"http://{self.headers['Host']}{url.path}"
+                    f"?page_size={page_size}&page={number + 1}"
+                )
+            body = {"next": next_url, "results": [{"name": tag} for tag in page]}
+            next_link = None
+
+        etag: str = f'"{hash(tuple(page))}"'
+        if self.headers.get("If-None-Match") == etag:
+            FakeTagsHandler.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        payload: bytes = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        if next_link:
+            self.send_header("Link", f'<{next_link}>; rel="next"')
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeBuildx:
+    """BuildX commands recording builds and pushes without running Docker."""
+
+    def __init__(self, push_failures: dict[str, int], push_duration: float = 0.0):
+        """Initialize the fake BuildX.
+
+        :param push_failures: number of failing push attempts by registry
+        :param push_duration: seconds each push takes
+        """
+        self.push_failures = push_failures
+        self.push_duration = push_duration
+        self.builds: list[dict] = []
+        self.pushes: list[str] = []
+        self.running_pushes: int = 0
+        self.max_running_pushes: int = 0
+        self.imagetools = self
+        self._lock = Lock()
+
+    def create(self, **kwargs) -> str:
+        """Create a fake builder.
+
+        :param kwargs:
+        :return:
+        """
+        return "builder"
+
+    def stop(self, builder: str) -> None:
+        """Stop a fake builder.
+
+        :param builder:
+        :return:
+        """
+
+    def remove(self, builder: str) -> None:
+        """Remove a fake builder.
+
+        :param builder:
+        :return:
+        """
+
+    def build(self, **kwargs) -> Iterator[str] | None:
+        """Record a build, pushing to the registry of its first tag.
+
+        :param kwargs:
+        :return:
+        """
+        if not kwargs.get("push"):
+            self.builds.append(kwargs)
+            return iter(["#7 [game-files 2/2] RUN steamcmd\n", "#7 CACHED\n"])
+
+        registry: str = kwargs["tags"][0].split("/", 1)[0]
+        with self._lock:
+            self.pushes.append(registry)
+            self.running_pushes += 1
+            self.max_running_pushes = max(self.max_running_pushes, self.running_pushes)
+        time.sleep(self.push_duration)
+        with self._lock:
+            self.running_pushes -= 1
+            if self.push_failures.get(registry, 0):
+                self.push_failures[registry] -= 1
+                raise RuntimeError(f"{registry} unavailable")
+        return None
+
+    def inspect(self, reference: str) -> Manifest:
+        """Return the manifest of a pushed image.
+
+        :param reference:
+        :return:
+        """
+        return Manifest(
+            mediaType="application/vnd.oci.image.manifest.v1+json",
+            schemaVersion=2,
+            layers=[{"size": 1000}, {"size": 200}],
+            config={"size": 10},
+        )
+
+
+class FakeDockerClient:
+    """Docker client recording registry logins."""
+
+    def __init__(self, buildx: FakeBuildx):
+        """Initialize the fake Docker client.
+
+        :param buildx:
+        """
+        self.buildx = buildx
+        self.logins: list[str] = []
+
+    def login(self, server: str, username: str, password: str) -> None:
+        """Record a login.
+
+        :param server:
+        :param username:
+        :param password:
+        :return:
+        """
+        self.logins.append(server)
+
+
+class FakeA2SServer(asyncio.DatagramProtocol):
+    """Answer A2S_INFO and A2S_PLAYER queries, requiring a challenge like Steam."""
+
+    challenge: bytes = b"\x01\x02\x03\x04"
+
+    def __init__(self, name: str = "Fake", players: tuple[str, ...] = ("Kelvin",)):
+        """Initialize the fake server.
+
+        :param name:
+        :param players:
+        """
+        self.name = name
+        self.players = players
+        self.max_players = 8
+        self.transport: asyncio.DatagramTransport | None = None
+        self.queries: int = 0
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        """Store the transport.
+
+        :param transport:
+        :return:
+        """
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        """Answer a query.
+
+        :param data:
+        :param addr:
+        :return:
+        """
+        self.queries += 1
+        header: bytes = b"\xff\xff\xff\xff"
+        kind: bytes = data[4:5]
+        if kind == b"T" and data.endswith(self.challenge):
+            response: bytes = (
+                b"I\x11"
+                + b"\x00".join(
+                    text.encode()
+                    for text in (self.name, "Forest", "sotf", "Sons Of The Forest")
+                )
+                + b"\x00"
+                + struct.pack("<hBBB", 0, len(self.players), self.max_players, 0)
+                + b"dw\x00\x01"
+                + b"1.0\x00"
+            )
+        elif kind == b"U" and data[5:9] == self.challenge:
+            response = b"D" + bytes([len(self.players)])
+            for index, player in enumerate(self.players):
+                response += (
+                    bytes([index])
+                    + player.encode()
+                    + b"\x00"
+                    + struct.pack("<lf", 0, 60)
+                )
+        elif kind in (b"T", b"U"):
+            response = b"A" + self.challenge
+        else:
+            return
+        self.transport.sendto(header + response, addr)
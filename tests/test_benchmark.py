@@ -0,0 +1,220 @@
+"""Tests benchmark results and their baseline check."""
+
+import json
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner, Result
+
+from build.benchmark import (
+    BASELINE_PATH,
+    BaselineError,
+    LayerSize,
+    compare,
+    get_layer_key,
+    get_layer_metrics,
+    get_tolerance,
+    main,
+    pair_layers,
+    parse_startup_records,
+    time_config_creator,
+    write_baseline,
+)
+
+HISTORY: list[str] = [
+    json.dumps({"CreatedBy": created_by, "Size": str(size)})
+    for created_by, size in (
+        ('ENTRYPOINT ["/srv/sotf/entrypoint.sh"]', 0),
+        ("COPY entrypoint.sh /srv/sotf/", 120),
+        ("COPY /srv/sotf /srv/sotf", 7_000_000_000),
+        ("ENV WINEPREFIX=/root/.wine", 0),
+        ("RUN apt install -y wine", 900_000_000),
+    )
+]
+BASELINE: dict = {
+    "tolerances": {"build.*.seconds": 0.5, "*.bytes": 0.05, "*": 0.2},
+    "metrics": {
+        "build.full.seconds": 600.0,
+        "image.size.bytes": 8_000_000_000,
+        "config_creator.seconds": 0.1,
+    },
+}
+
+
+def test_pair_layers():
+    """Test pairing history layers with compressed sizes, oldest layer first.
+
+    :return:
+    """
+    layers: list[LayerSize] = pair_layers(HISTORY, [300_000_000, 2_500_000_000, 90])
+
+    assert layers == [
+        LayerSize("RUN apt install -y wine", 900_000_000, 300_000_000),
+        LayerSize("COPY /srv/sotf /srv/sotf", 7_000_000_000, 2_500_000_000),
+        LayerSize("COPY entrypoint.sh /srv/sotf/", 120, 90),
+    ]
+    with pytest.raises(ValueError):
+        pair_layers(HISTORY, [300_000_000])
+
+
+def test_get_layer_metrics():
+    """Test keying layer metrics by their instruction instead of their position.
+
+    :return:
+    """
+    game_files: str = (
+        "RUN |1 STEAM_BUILD=100 /bin/sh -c steamcmd +app_update 2465200 # buildkit"
+    )
+    updated: str = game_files.replace("STEAM_BUILD=100", "STEAM_BUILD=101")
+    copy: str = "COPY entrypoint.sh /srv/sotf/ # buildkit"
+
+    metrics: dict[str, float] = get_layer_metrics(
+        [LayerSize(game_files, 100, 50), LayerSize(copy, 1, 1), LayerSize(copy, 2, 2)]
+    )
+
+    key: str = get_layer_key(game_files)
+    assert key.startswith("run-")
+    assert get_layer_key(updated) == key
+    assert get_layer_key(copy) != key
+    assert metrics[f"layer.{key}.size.bytes"] == 100
+    assert metrics[f"layer.{key}.compressed_size.bytes"] == 50
+    assert metrics[f"layer.{get_layer_key(copy)}-2.size.bytes"] == 2
+    assert len(metrics) == 6
+
+
+def test_compare():
+    """Test that only metrics exceeding their tolerance are regressions.
+
+    :return:
+    """
+    metrics: dict[str, float] = {
+        "build.full.seconds": 880.0,
+        "image.size.bytes": 8_500_000_000,
+        "config_creator.seconds": 0.09,
+    }
+
+    (regression,) = compare(metrics, BASELINE)
+    # Added and removed layers are not compared
+    assert compare(
+        {**metrics, "layer.copy-0123abcd.size.bytes": 1.0},
+        {**BASELINE, "metrics": {**BASELINE["metrics"], "layer.run-a.size.bytes": 1}},
+    ) == [regression]
+
+    assert regression.metric == "image.size.bytes"
+    assert regression.limit == pytest.approx(8_400_000_000)
+    assert "exceeds" in str(regression)
+    assert (
+        get_tolerance("layer.run-0123abcd.size.bytes", BASELINE["tolerances"]) == 0.05
+    )
+    assert get_tolerance("cold_start.seconds", {}) == 0.2
+
+
+@pytest.mark.parametrize(
+    "metrics,baseline,message",
+    [
+        ({"build.full.seconds": 1.0}, {"metrics": {}}, "has no metrics"),
+        (
+            {**BASELINE["metrics"], "cold_start.seconds": 30.0},
+            BASELINE,
+            "missing in the baseline: cold_start.seconds",
+        ),
+        (
+            {"build.full.seconds": 600.0},
+            BASELINE,
+            "missing in the results: config_creator.seconds, image.size.bytes",
+        ),
+    ],
+)
+def test_compare_needs_matching_baseline(metrics: dict, baseline: dict, message: str):
+    """Test that results cannot pass a baseline not covering their metrics.
+
+    :param metrics:
+    :param baseline:
+    :param message:
+    :return:
+    """
+    with pytest.raises(BaselineError, match=message):
+        compare(metrics, baseline)
+
+
+def test_parse_startup_records():
+    """Test reading the supervisor's timing records from container logs.
+
+    :return:
+    """
+    logs: str = "\n".join(
+        [
+            '{"event": "startup_phase", "phase": "config", "duration": 0.05}',
+            "Config written to /srv/sotf/userdata/dedicatedserver.cfg",
+            '{"event": "snapshot", "id": "20240501T200000.000000Z"}',
+            '{"event": "startup_phase", "phase": "startup", "duration": 1.2}',
+        ]
+    )
+
+    records: dict[str, dict] = parse_startup_records(logs)
+
+    assert set(records) == {"config", "startup"}
+    assert records["startup"]["duration"] == 1.2
+
+
+def test_time_config_creator():
+    """Test timing config creator runs.
+
+    :return:
+    """
+    assert 0 < time_config_creator(runs=2) < 10
+
+
+def test_check_command(tmp_path: Path):
+    """Test that the check fails for regressions, passes and skips without baseline.
+
+    :param tmp_path:
+    :return:
+    """
+    baseline_path: Path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps(BASELINE))
+    results_path: Path = tmp_path / "results.json"
+    metrics: dict[str, float] = {
+        **BASELINE["metrics"],
+        "build.full.seconds": 1000.0,
+    }
+    results_path.write_text(json.dumps({"metrics": metrics, "layers": []}))
+    runner = CliRunner()
+
+    failed: Result = runner.invoke(
+        main, ["check", str(results_path), "--baseline", str(baseline_path)]
+    )
+
+    assert failed.exit_code == 1
+    assert "build.full.seconds: 1000 (+66.7%)" in failed.output
+    assert "build.full.seconds: 1000 exceeds 900" in failed.output
+
+    write_baseline(baseline_path, metrics)
+    passed: Result = runner.invoke(
+        main, ["check", str(results_path), "--baseline", str(baseline_path)]
+    )
+
+    assert passed.exit_code == 0
+    assert json.loads(baseline_path.read_text()) == {
+        "tolerances": BASELINE["tolerances"],
+        "metrics": dict(sorted(metrics.items())),
+    }
+
+    baseline_path.write_text(json.dumps({"tolerances": {}, "metrics": {}}))
+    empty: Result = runner.invoke(
+        main, ["check", str(results_path), "--baseline", str(baseline_path)]
+    )
+
+    assert empty.exit_code == 0
+    assert "Skipped the check" in empty.output
+
+
+def test_stored_baseline():
+    """Test that the stored baseline has a default tolerance.
+
+    :return:
+    """
+    baseline: dict = json.loads(BASELINE_PATH.read_text())
+
+    assert "*" in baseline["tolerances"]
+    assert all(isinstance(value, int | float) for value in baseline["metrics"].values())
@@ -2,164 +2,70 @@
 # ruff: noqa: D400
 
 import json
-import os
+from pathlib import Path
 
 import pytest
 
+from build.config import config_creator
 from build.config.config_creator import (
-    check_bool_value,
-    check_float_value,
-    check_int_value,
-    check_value,
+    CONFIG_SCHEMA,
+    ConfigError,
+    create_config_file,
+    get_hash_path,
     main,
-    set_game_setting,
 )
 
 
-def test_check_value_valid(monkeypatch):
-    """
-    Test check value method with valid values
-
-    :param monkeypatch:
-    :return:
-    """
-    monkeypatch.setenv("FOO", "BAR")
-    check_value("FOO", ["BAR", "BAR2"], "BAR or BAR2")
-
-
-def test_check_value_invalid(monkeypatch):
-    """
-    Test check value method with invalid values
-
-    :param monkeypatch:
-    :return:
-    """
-    monkeypatch.setenv("FOO", "BAR")
-    with pytest.raises(ValueError, match="Wrong Value! FOO needs Bar or Bar2"):
-        check_value("FOO", ["Bar", "Bar2"], "Bar or Bar2")
-
-
-def test_check_bool_value_true(monkeypatch):
-    """
-    Test check bool method with true boolean
-
-    :param monkeypatch:
-    :return:
-    """
-    monkeypatch.setenv("FOO", "true")
-    assert check_bool_value("FOO") is True
-
-
-def test_check_bool_value_false(monkeypatch):
-    """
-    Test check bool method with false boolean
-
-    :param monkeypatch:
-    :return:
-    """
-    monkeypatch.setenv("FOO", "false")
-    assert check_bool_value("FOO") is False
-
-
-def test_check_bool_value_default(monkeypatch):
-    """
-    Test check bool method with default value
-
-    :param monkeypatch:
-    :return:
-    """
-    if "FOO" in os.environ:
-        monkeypatch.delenv("FOO", raising=False)
-    assert check_bool_value("FOO") is False
-
-
-def test_check_int_value_valid(monkeypatch):
-    """
-    Test check int method with valid value
-
-    :param monkeypatch:
-    :return:
-    """
-    monkeypatch.setenv("FOO", "42")
-    assert check_int_value("FOO", 0) == 42
-
-
-def test_check_int_value_default(monkeypatch):
-    """
-    Test check int method with default value
-
-    :param monkeypatch:
-    :return:
-    """
-    if "FOO" in os.environ:
-        monkeypatch.delenv("FOO", raising=False)
-    assert check_int_value("FOO", 0) == 0
-
-
-def test_check_float_value_valid(monkeypatch):
-    """
-    Test check float method with valid value
-
-    :param monkeypatch:
-    :return:
-    """
-    monkeypatch.setenv("FOO", "4.2")
-    assert check_float_value("FOO", 2.4) == 4.2
-
-
-def test_check_float_value_default(monkeypatch):
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("true", True),
+        ("True", True),
+        ("false", False),
+        ("", False),
+        # Only true and false are bools, other values stop the container
+        ("1", ConfigError),
+        ("yes", ConfigError),
+    ],
+)
+def test_create_config_bool(value, expected):
     """
-    Test check float method with default value
+    Test parsing bool settings, empty values fall back to the default
 
-    :param monkeypatch:
+    :param value:
+    :param expected:
     :return:
     """
-    if "FOO" in os.environ:
-        monkeypatch.delenv("FOO", raising=False)
-    assert check_float_value("FOO", 0.0) == 0.0
-
-
-test_data = [
-    ("true", True, bool),
-    ("false", False, bool),
-    ("42", 42, int),
-    ("4.2", 4.2, float),
-    ("BAR", "BAR", lambda x: check_value("FOO", ["BAR"], "BAR")),
-    ("BOO", ValueError, lambda x: check_value("FOO", ["BAR"], "BAR")),
-    (None, True, bool),
-]
-
-
-@pytest.mark.parametrize("val, expected, types", test_data)
-def test_game_setting(val, expected, types, monkeypatch):
+    environ: dict[str, str] = {"SKIPNETWORKACCESSIBILITYTEST": value}
+    if expected is ConfigError:
+        with pytest.raises(
+            ConfigError, match="SKIPNETWORKACCESSIBILITYTEST needs Bool"
+        ):
+            CONFIG_SCHEMA.create_config(environ)
+    else:
+        config = CONFIG_SCHEMA.create_config(environ)
+        assert config["SkipNetworkAccessibilityTest"] is expected
+
+
+@pytest.mark.parametrize(
+    "environ, key, expected",
+    [
+        ({"MAXPLAYERS": "4"}, "MaxPlayers", 4),
+        ({"IDLEDAYCYCLESPEED": "4.2"}, "IdleDayCycleSpeed", 4.2),
+        ({"SAVEMODE": "Continue"}, "SaveMode", "Continue"),
+        ({"SAVEINTERVAL": ""}, "SaveInterval", 600),
+    ],
+)
+def test_create_config_values(environ, key, expected):
     """
-    Test set game settings method
+    Test converting settings to their type
 
-    :param val:
+    :param environ:
+    :param key:
     :param expected:
-    :param types:
-    :param monkeypatch:
     :return:
     """
-    config = {}
-    if val is not None:
-        monkeypatch.setenv("FOO", val)
-        if expected is not ValueError:
-            set_game_setting(
-                config=config, env_var="FOO", setting_key="test", value_check=types
-            )
-            assert config["test"] == expected
-        else:
-            with pytest.raises(ValueError, match="Wrong Value! FOO needs BAR"):
-                set_game_setting(
-                    config=config, env_var="FOO", setting_key="test", value_check=types
-                )
-    else:
-        monkeypatch.delenv("FOO", raising=False)
-        set_game_setting(
-            config=config, env_var="FOO", setting_key="test", value_check=types
-        )
-        assert "test" not in config
+    assert CONFIG_SCHEMA.create_config(environ)[key] == expected
 
 
 def test_main_without_extra_settings_valid(monkeypatch, capsys):
@@ -271,3 +177,253 @@ def test_main_with_extra_settings_valid(monkeypatch, capsys):
         "GameSetting.Environment.PrecipitationFrequency"
         not in config["CustomGameModeSettings"]
     )
+
+
+def test_main_reports_all_errors(monkeypatch, capsys):
+    """
+    Test main method reports every invalid value in one run
+
+    :param monkeypatch:
+    :param capsys:
+    :return:
+    """
+    monkeypatch.setenv("GAMEMODE", "FOOBAR")
+    monkeypatch.setenv("GAMEPORT", "eight")
+    monkeypatch.setenv("LANONLY", "maybe")
+    monkeypatch.setenv("ENEMYHEALTH", "Extreme")
+
+    with pytest.raises(SystemExit) as info:
+        main()
+    assert info.value.code == 1
+
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert captured.err.splitlines() == [
+        "Error: Wrong Value! GAMEPORT needs Integer",
+        "Error: Wrong Value! LANONLY needs Bool",
+        "Error: Wrong Value! GAMEMODE needs "
+        "Normal, Hard, Hardsurvival, Peaceful, Creative or Custom",
+        "Error: Wrong Value! ENEMYHEALTH needs Low, Normal or High",
+    ]
+
+
+def test_create_config_from_snapshot():
+    """
+    Test creating the config from a mapping instead of the process environment
+
+    :return:
+    """
+    config = CONFIG_SCHEMA.create_config(
+        {"MAXPLAYERS": "4", "ENEMYSPAWN": "false", "SEASONLENGTH": "Long"}
+    )
+
+    assert config["MaxPlayers"] == 4
+    assert config["GameSettings"] == {}
+    assert config["CustomGameModeSettings"] == {
+        "GameSetting.Vail.EnemySpawn": False,
+        "GameSetting.Environment.SeasonLength": "Long",
+    }
+
+
+def test_create_config_invalid():
+    """
+    Test that all errors are collected in the raised error
+
+    :return:
+    """
+    with pytest.raises(ConfigError) as info:
+        CONFIG_SCHEMA.create_config({"SAVEMODE": "Load", "SAVEINTERVAL": "1.5"})
+
+    assert info.value.errors == [
+        "Wrong Value! SAVEMODE needs New or Continue",
+        "Wrong Value! SAVEINTERVAL needs Integer",
+    ]
+
+
+def test_json_schema():
+    """
+    Test JSON Schema export
+
+    :return:
+    """
+    schema = CONFIG_SCHEMA.json_schema()
+
+    assert schema["properties"]["GamePort"]["type"] == "integer"
+    assert schema["properties"]["GamePort"]["default"] == 8766
+    assert schema["properties"]["SaveMode"]["enum"] == ["New", "Continue"]
+    assert "GamePort" in schema["required"]
+    custom_settings = schema["properties"]["CustomGameModeSettings"]
+    assert custom_settings["properties"]["GameSetting.Multiplayer.Cheats"] == {
+        "type": "boolean",
+        "default": False,
+        "description": "Allows cheats on the server.",
+    }
+
+
+def test_readme_tables_are_up_to_date():
+    """
+    Test that the README settings tables match the schema
+
+    :return:
+    """
+    readme: str = (Path(__file__).parent.parent / "README.md").read_text()
+
+    for section in (None, *CONFIG_SCHEMA.sections):
+        assert CONFIG_SCHEMA.markdown_table(section) in readme
+
+
+def test_main_validate(tmp_path, capsys):
+    """
+    Test validating server definitions in bulk
+
+    :param tmp_path:
+    :param capsys:
+    :return:
+    """
+    valid = tmp_path / "valid.json"
+    valid.write_text(json.dumps({"MAXPLAYERS": 8, "LANONLY": True}))
+    mixed = tmp_path / "mixed.json"
+    mixed.write_text(json.dumps([{"GAMEMODE": "Hard"}, {"GAMEMODE": "Easy"}]))
+
+    main(["--validate", str(valid)])
+    assert capsys.readouterr().out == "1 of 1 server definitions are valid\n"
+
+    with pytest.raises(SystemExit) as info:
+        main(["--validate", str(valid), str(mixed)])
+    assert info.value.code == 1
+
+    captured = capsys.readouterr()
+    assert captured.out == "2 of 3 server definitions are valid\n"
+    assert captured.err.startswith(f"{mixed}[1]: Wrong Value! GAMEMODE needs")
+
+
+def test_create_config_file_skips_unchanged_config(tmp_path):
+    """
+    Test that the config file is only written when the environment changes
+
+    :param tmp_path:
+    :return:
+    """
+    path: Path = tmp_path / "dedicatedserver.cfg"
+
+    assert create_config_file(path, {"SERVERNAME": "Foo", "PATH": "/bin"}) is True
+    assert json.loads(path.read_text())["ServerName"] == "Foo"
+    assert get_hash_path(path).exists()
+
+    assert create_config_file(path, {"SERVERNAME": "Foo", "PATH": "/usr"}) is False
+    assert create_config_file(path, {"SERVERNAME": "Bar"}) is True
+    assert json.loads(path.read_text())["ServerName"] == "Bar"
+
+    path.unlink()
+    assert create_config_file(path, {"SERVERNAME": "Bar"}) is True
+    assert sorted(tmp_path.iterdir()) == sorted([path, get_hash_path(path)])
+
+
+@pytest.mark.parametrize("content", ['{"trunc', '{"ServerName": "Edited"}\n'])
+def test_create_config_file_rewrites_changed_file(tmp_path, content):
+    """
+    Test that a corrupt or edited config file is rewritten from the environment
+
+    :param tmp_path:
+    :param content:
+    :return:
+    """
+    path: Path = tmp_path / "dedicatedserver.cfg"
+    create_config_file(path, {"SERVERNAME": "Foo"})
+    path.write_text(content)
+
+    assert create_config_file(path, {"SERVERNAME": "Foo"}) is True
+    assert json.loads(path.read_text())["ServerName"] == "Foo"
+    assert create_config_file(path, {"SERVERNAME": "Foo"}) is False
+
+
+def test_create_config_file_schema_version_change(tmp_path, monkeypatch):
+    """
+    Test that a new schema version rewrites the config file
+
+    :param tmp_path:
+    :param monkeypatch:
+    :return:
+    """
+    path: Path = tmp_path / "dedicatedserver.cfg"
+    create_config_file(path, {})
+    monkeypatch.setattr(config_creator, "SCHEMA_VERSION", 2)
+
+    assert create_config_file(path, {}) is True
+
+
+def test_create_config_file_invalid_keeps_existing_file(tmp_path):
+    """
+    Test that an invalid environment leaves the existing config untouched
+
+    :param tmp_path:
+    :return:
+    """
+    path: Path = tmp_path / "dedicatedserver.cfg"
+    create_config_file(path, {"SERVERNAME": "Foo"})
+    content: str = path.read_text()
+
+    with pytest.raises(ConfigError):
+        create_config_file(path, {"SERVERNAME": "Bar", "GAMEPORT": "foo"})
+
+    assert path.read_text() == content
+    assert sorted(tmp_path.iterdir()) == sorted([path, get_hash_path(path)])
+
+
+def test_create_config_file_merge(tmp_path):
+    """
+    Test merging an operator edited config file
+
+    :param tmp_path:
+    :return:
+    """
+    path: Path = tmp_path / "dedicatedserver.cfg"
+    path.write_text(
+        json.dumps(
+            {
+                "ServerName": "Edited",
+                "MaxPlayers": 4,
+                "Unknown": "kept",
+                "GameSettings": {"Structure.Damage": False},
+            }
+        )
+    )
+
+    create_config_file(path, {"MAXPLAYERS": "6", "TREEREGROWTH": "false"}, merge=True)
+
+    config = json.loads(path.read_text())
+    assert config["ServerName"] == "Edited"
+    assert config["MaxPlayers"] == 6
+    assert config["Unknown"] == "kept"
+    assert config["GamePort"] == 8766
+    assert config["GameSettings"] == {
+        "Structure.Damage": False,
+        "Gameplay.TreeRegrowth": False,
+    }
+
+    edited: dict = {**config, "ServerName": "Edited again"}
+    path.write_text(json.dumps(edited))
+    create_config_file(path, {"MAXPLAYERS": "6", "TREEREGROWTH": "false"}, merge=True)
+
+    assert json.loads(path.read_text()) == edited
+
+
+def test_main_output(tmp_path, monkeypatch, capsys):
+    """
+    Test main method writing the config file
+
+    :param tmp_path:
+    :param monkeypatch:
+    :param capsys:
+    :return:
+    """
+    path: Path = tmp_path / "dedicatedserver.cfg"
+    monkeypatch.setenv("SERVERNAME", "Test Server")
+
+    main(["--output", str(path)])
+    main(["--output", str(path)])
+
+    assert capsys.readouterr().out == (
+        f"Config written to {path}\nConfig {path} is up to date\n"
+    )
+    assert json.loads(path.read_text())["ServerName"] == "Test Server"
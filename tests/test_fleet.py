@@ -0,0 +1,192 @@
+"""Tests fleet generation."""
+
+import json
+import time
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner, Result
+
+from build.config.config_creator import ConfigError
+from build.fleet import (
+    Instance,
+    allocate_ports,
+    expand_instances,
+    generate_fleet,
+    load_spec,
+    main,
+)
+
+SPEC: dict = {
+    "image": "sotf:test",
+    "defaults": {"SKIPNETWORKACCESSIBILITYTEST": True, "PASSWORD": "letmein"},
+    "servers": [
+        {"name": "alpha", "environment": {"SERVERNAME": "Alpha", "GAMEPORT": 8768}},
+        {"name": "pve", "count": 3, "environment": {"GAMEMODE": "Peaceful"}},
+    ],
+}
+
+
+def test_expand_instances():
+    """Test merging defaults and overrides, and expanding counted servers.
+
+    :return:
+    """
+    instances: list[Instance] = expand_instances(SPEC)
+
+    assert [instance.name for instance in instances] == [
+        "alpha",
+        "pve-1",
+        "pve-2",
+        "pve-3",
+    ]
+    assert instances[0].environ == {
+        "SKIPNETWORKACCESSIBILITYTEST": "true",
+        "PASSWORD": "letmein",
+        "SERVERNAME": "Alpha",
+        "GAMEPORT": "8768",
+    }
+    assert instances[3].environ["GAMEMODE"] == "Peaceful"
+
+
+def test_allocate_ports_skips_reserved_ports():
+    """Test that allocated ports never collide with each other or explicit ports.
+
+    :return:
+    """
+    instances: list[Instance] = expand_instances(SPEC)
+
+    allocate_ports(instances)
+
+    assert instances[0].ports == [8768, 8766, 8767]
+    ports: list[int] = [port for instance in instances for port in instance.ports]
+    assert len(ports) == len(set(ports)) == 12
+    assert max(ports) == 8777
+
+
+def test_allocate_ports_errors():
+    """Test that duplicate explicit ports and exhausted ranges are reported.
+
+    :return:
+    """
+    duplicate: list[Instance] = [
+        Instance("a", {"GAMEPORT": "9000"}),
+        Instance("b", {"QUERYPORT": "9000"}),
+    ]
+    with pytest.raises(ConfigError) as error:
+        allocate_ports(duplicate)
+    assert error.value.errors == ["b: QUERYPORT 9000 is already used by a"]
+
+    with pytest.raises(ConfigError, match="No free ports left"):
+        allocate_ports([Instance("a", {}), Instance("b", {})], 9000, 9004)
+
+
+def test_invalid_specs_report_all_errors():
+    """Test that errors of all servers are reported together.
+
+    :return:
+    """
+    with pytest.raises(ConfigError) as error:
+        expand_instances(
+            {
+                "servers": [
+                    {"name": "a"},
+                    {"name": "a"},
+                    {"name": "b", "count": 2, "environment": {"GAMEPORT": 9000}},
+                    {"name": "bad name"},
+                    {"name": "c", "count": "two"},
+                ]
+            }
+        )
+    assert error.value.errors == [
+        "a: duplicate server name",
+        "b: servers with a count cannot set ports",
+        "bad name: invalid server name",
+        "c: count needs Integer",
+    ]
+
+    with pytest.raises(ConfigError) as error:
+        generate_fleet(
+            {
+                "servers": [
+                    {"name": "a", "environment": {"MAXPLAYERS": "many"}},
+                    {"name": "b", "environment": {"GAMEMODE": "chaos"}},
+                ]
+            },
+            Path("/nonexistent"),
+        )
+    assert [message.split(":")[0] for message in error.value.errors] == ["a", "b"]
+
+
+def test_generate_fleet(tmp_path: Path):
+    """Test writing every config and a compose file, skipping unchanged configs.
+
+    :param tmp_path:
+    :return:
+    """
+    instances, written = generate_fleet(SPEC, tmp_path)
+
+    assert written == 4
+    config: dict = json.loads(
+        (tmp_path / "alpha" / "userdata" / "dedicatedserver.cfg").read_text()
+    )
+    assert config["ServerName"] == "Alpha"
+    assert [config["GamePort"], config["QueryPort"], config["BlobSyncPort"]] == [
+        8768,
+        8766,
+        8767,
+    ]
+
+    compose: dict = json.loads((tmp_path / "compose.yaml").read_text())
+    assert list(compose["services"]) == ["alpha", "pve-1", "pve-2", "pve-3"]
+    service: dict = compose["services"]["pve-1"]
+    assert service["image"] == "sotf:test"
+    assert service["environment"] == instances[1].environ
+    assert service["ports"] == [f"{port}:{port}/udp" for port in instances[1].ports]
+    assert service["volumes"] == ["./pve-1/userdata:/srv/sotf/userdata"]
+
+    assert generate_fleet(SPEC, tmp_path)[1] == 0
+
+
+def test_generate_large_fleet(tmp_path: Path):
+    """Test generating thousands of servers in one pass.
+
+    :param tmp_path:
+    :return:
+    """
+    start: float = time.perf_counter()
+    instances, written = generate_fleet(
+        {"servers": [{"name": "sotf", "count": 2000}]}, tmp_path
+    )
+    duration: float = time.perf_counter() - start
+
+    ports: list[int] = [port for instance in instances for port in instance.ports]
+    assert written == 2000
+    assert len(set(ports)) == 6000
+    assert duration < 30
+
+
+def test_main_yaml_spec(tmp_path: Path):
+    """Test the CLI with a YAML spec.
+
+    :param tmp_path:
+    :return:
+    """
+    spec_path: Path = tmp_path / "fleet.yaml"
+    spec_path.write_text(
+        "defaults:\n"
+        "  SKIPNETWORKACCESSIBILITYTEST: true\n"
+        "servers:\n"
+        "  - name: alpha\n"
+        "  - name: beta\n"
+        "    environment:\n"
+        "      MAXPLAYERS: 4\n"
+    )
+    assert load_spec(spec_path)["servers"][1]["environment"]["MAXPLAYERS"] == 4
+
+    result: Result = CliRunner().invoke(
+        main, [str(spec_path), "--output", str(tmp_path / "fleet")]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "2 servers, 2 configs written" in result.output
@@ -0,0 +1,121 @@
+"""Tests game files layer caching."""
+
+from pathlib import Path
+
+from build.game_files import (
+    GameFilesReport,
+    get_build_args,
+    get_depot_manifests,
+    report_game_files,
+)
+from build.product_info import ProductInfoCache
+from build.utils import get_sotf_depot_manifests
+from tests.fakes import FakeSteamTransport
+
+DEPOTS: dict[str, dict] = {
+    "228989": {
+        "config": {"oslist": "windows"},
+        "manifests": {"public": {"gid": "111", "size": "100"}},
+    },
+    "2465201": {
+        "config": {"oslist": "windows"},
+        "manifests": {
+            "public": {"gid": "222", "size": "1000"},
+            "release": {"gid": "333", "size": "1000"},
+        },
+    },
+    "2465202": {
+        "config": {"oslist": "linux"},
+        "manifests": {"public": "444"},
+    },
+    "2465203": {"manifests": {"public": "555"}},
+    "2465204": {"config": {"oslist": "windows"}},
+}
+CACHED_LOGS: list[str] = [
+    "#7 [linux/amd64 game-files 2/2] RUN --mount=type=cache steamcmd\n",
+    "#7 CACHED\n",
+    "#8 [linux/amd64 stage-1 2/7] RUN apt update\n",
+    "#8 DONE 10.0s\n",
+]
+DOWNLOAD_LOGS: list[str] = [
+    "#8 [stage-1 2/7] RUN apt update\n",
+    "#7 [game-files 2/2] RUN --mount=type=cache steamcmd\n",
+    "#7 40.1 Update state (0x61) downloading, progress: 10.00 (100 / 1000)\n",
+    "#8 DONE 10.0s\n",
+    "#7 50.2 Update state (0x61) downloading, progress: 99.00 (990 / 1000)\n",
+    "#7 51.0 Success! App '2465200' fully installed.\n",
+    "#7 DONE 52.1s\n",
+]
+
+
+def test_get_depot_manifests():
+    """Test selecting the manifests of Windows depots for a branch.
+
+    :return:
+    """
+    app_info: dict = {"depots": {**DEPOTS, "branches": {"public": {"buildid": "1"}}}}
+
+    assert get_depot_manifests(app_info) == {
+        "228989": "111",
+        "2465201": "222",
+        "2465203": "555",
+    }
+    assert get_depot_manifests(app_info, branch="release") == {
+        "228989": "111",
+        "2465201": "333",
+        "2465203": "555",
+    }
+
+
+def test_get_sotf_depot_manifests(tmp_path: Path):
+    """Test reading depot manifests from the product info cache.
+
+    :param tmp_path:
+    :return:
+    """
+    transport = FakeSteamTransport({"release": "100"}, depots=DEPOTS)
+    cache = ProductInfoCache(tmp_path / "info.json", ttl=60, transport=transport)
+
+    assert get_sotf_depot_manifests(product_info_cache=cache)["2465201"] == "333"
+    assert transport.requests == 1
+
+
+def test_get_build_args():
+    """Test that build args are independent of the depot order.
+
+    :return:
+    """
+    build_args: dict[str, str] = get_build_args(
+        "100", {"2465201": "222", "228989": "111"}
+    )
+
+    assert build_args == {
+        "SOTF_BUILD_ID": "100",
+        "SOTF_DEPOT_MANIFESTS": "228989:111,2465201:222",
+    }
+
+
+def test_report_game_files_cache_hit():
+    """Test reporting a cached game files layer.
+
+    :return:
+    """
+    report = GameFilesReport()
+
+    assert list(report_game_files(CACHED_LOGS, report)) == CACHED_LOGS
+    assert report.cache_hit is True
+    assert report.bytes_downloaded == 0
+    assert str(report) == "Game files layer: cache hit, 0 bytes downloaded"
+
+
+def test_report_game_files_cache_miss():
+    """Test reporting a downloaded game files layer.
+
+    :return:
+    """
+    report = GameFilesReport()
+
+    assert list(report_game_files(DOWNLOAD_LOGS, report)) == DOWNLOAD_LOGS
+    assert report.cache_hit is False
+    assert report.bytes_downloaded == 1000
+    assert str(report) == "Game files layer: cache miss, 1000 bytes downloaded"
@@ -0,0 +1,59 @@
+"""Benchmarks Docker image build, image size and container cold start."""
+
+import os
+from pathlib import Path
+
+import pytest
+from python_on_whales import Builder, DockerClient
+from testcontainers.registry import DockerRegistryContainer
+
+from build.benchmark import (
+    BASELINE_PATH,
+    RESULTS_PATH,
+    Regression,
+    compare,
+    load_baseline,
+    run_benchmarks,
+    write_results,
+)
+from tests.constants import REGISTRY_PASSWORD, REGISTRY_USERNAME
+
+
+@pytest.mark.benchmark
+def test_image_benchmark(docker_client: DockerClient, buildx_builder: Builder):
+    """Test that the image does not regress against the stored baseline.
+
+    Writes the results to BENCHMARK_RESULTS, benchmark-results.json by default.
+
+    :param docker_client:
+    :param buildx_builder:
+    :return:
+    """
+    with DockerRegistryContainer(
+        username=REGISTRY_USERNAME, password=REGISTRY_PASSWORD
+    ).with_bind_ports(5000, 5000) as registry_container:
+        registry: str = registry_container.get_registry()
+        docker_client.login(
+            server=registry,
+            username=REGISTRY_USERNAME,
+            password=REGISTRY_PASSWORD,
+        )
+
+        metrics, layers = run_benchmarks(docker_client, buildx_builder, registry)
+
+    write_results(
+        Path(os.environ.get("BENCHMARK_RESULTS", RESULTS_PATH)), metrics, layers
+    )
+    assert layers
+    assert metrics["image.compressed_size.bytes"] < metrics["image.size.bytes"]
+    assert metrics["build.cached.seconds"] < metrics["build.full.seconds"]
+    # The Wine prefix baked into the image skips wineboot
+    assert (
+        metrics["cold_start.wineboot.seconds"]
+        < metrics["cold_start.without_prefix.wineboot.seconds"]
+    )
+    baseline: dict = load_baseline(BASELINE_PATH)
+    if not baseline["metrics"]:
+        pytest.skip("The baseline has no metrics, record them with --update-baseline")
+    regressions: list[Regression] = compare(metrics, baseline)
+    assert not regressions, "\n".join(map(str, regressions))
@@ -1,6 +1,7 @@
 """Tests Docker image build."""
 
 from datetime import date
+from pathlib import Path
 
 from furl import furl
 from python_on_whales import Builder, DockerClient
@@ -8,7 +9,9 @@ from requests import Response, get
 from requests.auth import HTTPBasicAuth
 from testcontainers.registry import DockerRegistryContainer
 
-from build.constants import PLATFORMS
+from build.constants import DEFAULT_BRANCH, IMAGE_REPOSITORY, PLATFORMS
+from build.publish import Publisher, PushReport, RegistryTarget
+from build.tag_index import TagIndex, registry_tags_url
 from build.utils import get_image_reference
 from tests.constants import CONTEXT, REGISTRY_PASSWORD, REGISTRY_USERNAME
 
@@ -18,11 +21,13 @@ BASIC_AUTH: HTTPBasicAuth = HTTPBasicAuth(REGISTRY_USERNAME, REGISTRY_PASSWORD)
 def test_image_build(
     docker_client: DockerClient,
     buildx_builder: Builder,
+    tmp_path: Path,
 ):
     """Test building the Docker image.
 
     :param docker_client:
     :param buildx_builder:
+    :param tmp_path:
     :return:
     """
     with DockerRegistryContainer(
@@ -70,3 +75,57 @@ def test_image_build(
         response_image_tags: list[str] = response.json()["tags"]
 
         assert not {date_tag, latest_tag}.difference(set(response_image_tags))
+
+        tag_index = TagIndex(
+            registry_tags_url(f"http://{registry}", IMAGE_REPOSITORY),
+            tmp_path / "tag_index.json",
+            auth=BASIC_AUTH,
+        )
+
+        assert {date_tag, latest_tag} <= tag_index.tags
+
+
+def test_publish_to_two_registries(docker_client: DockerClient, tmp_path: Path):
+    """Test building the image once and pushing it to two registries.
+
+    :param docker_client:
+    :param tmp_path:
+    :return:
+    """
+    with (
+        DockerRegistryContainer(
+            username=REGISTRY_USERNAME, password=REGISTRY_PASSWORD
+        ).with_bind_ports(5000, 5000) as first_registry,
+        DockerRegistryContainer(
+            username=REGISTRY_USERNAME, password=REGISTRY_PASSWORD
+        ).with_bind_ports(5000, 5001) as second_registry,
+    ):
+        targets: list[RegistryTarget] = [
+            RegistryTarget(
+                container.get_registry(), REGISTRY_USERNAME, REGISTRY_PASSWORD
+            )
+            for container in (first_registry, second_registry)
+        ]
+        publisher = Publisher(
+            targets=targets,
+            cache_to=None,
+            cache_from=None,
+            docker_client=docker_client,
+        )
+        try:
+            reports: list[PushReport] = publisher.build(DEFAULT_BRANCH, "1", {})
+        finally:
+            publisher.close()
+
+        for report in reports:
+            assert report.error is None
+            assert report.image_bytes > 0
+
+        for number, target in enumerate(targets):
+            tag_index = TagIndex(
+                registry_tags_url(f"http://{target.registry}", IMAGE_REPOSITORY),
+                tmp_path / f"tag_index_{number}.json",
+                auth=BASIC_AUTH,
+            )
+
+            assert {"build-1", "latest"} <= tag_index.tags
@@ -0,0 +1,315 @@
+"""Test log_follower.py"""
+# ruff: noqa: D400
+
+import gzip
+import io
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from build.config.log_follower import (
+    Inotify,
+    LogFollower,
+    Retention,
+    apply_retention,
+    create_watcher,
+    main,
+    parse_line,
+)
+
+JOIN: str = "[2024/05/01 20:00:00.123] Player Kelvin (76561198000000001) joined"
+LEAVE: str = "[2024/05/01 21:00:00.456] Player Kelvin (76561198000000001) disconnected"
+SAVE: str = "[2024/05/01 21:00:01.000] Game saved"
+ERROR: str = "[2024/05/01 21:00:02.000] NullReferenceException: Object reference"
+
+
+def read_output(output: io.StringIO) -> list[dict]:
+    """
+    Read the JSON events written by a follower
+
+    :param output:
+    :return:
+    """
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def write_log(path: Path, *lines: str, mode: str = "a") -> None:
+    """
+    Write lines to a log file
+
+    :param path:
+    :param lines:
+    :param mode:
+    :return:
+    """
+    with path.open(mode) as file:
+        file.writelines(f"{line}\n" for line in lines)
+
+
+def test_parse_line():
+    """
+    Test parsing log lines into events
+
+    :return:
+    """
+    assert parse_line(JOIN) == {
+        "event": "player_joined",
+        "time": "2024/05/01 20:00:00.123",
+        "player": "Kelvin",
+        "steam_id": "76561198000000001",
+        "message": "Player Kelvin (76561198000000001) joined",
+    }
+    assert parse_line(LEAVE)["event"] == "player_left"
+    assert parse_line("Player 'Virginia' has left")["player"] == "Virginia"
+    assert parse_line(SAVE)["event"] == "game_saved"
+    assert parse_line(ERROR)["event"] == "error"
+    assert parse_line("Error: Failed to load asset")["event"] == "error"
+    assert parse_line("[2024/05/01 21:00:00] Loading scene Island") is None
+    assert parse_line("Recovered from error state") is None
+
+
+def test_follow_rotations(tmp_path):
+    """
+    Test following new, replaced and truncated log files
+
+    :param tmp_path:
+    :return:
+    """
+    old: Path = tmp_path / "sotf_log_2024-05-01_19-00-00.txt"
+    write_log(old, JOIN)
+    output = io.StringIO()
+    follower = LogFollower(tmp_path, output=output)
+    follower.follow(old, at_end=True)
+
+    write_log(old, SAVE)
+    follower.poll()
+    new: Path = tmp_path / "sotf_log_2024-05-01_20-00-00.txt"
+    write_log(new, JOIN)
+    with new.open("a") as file:
+        file.write("Player Kelvin (76561198000000001) jo")
+    os.utime(new, (time.time() + 1, time.time() + 1))
+    follower.poll()
+    # The rest of a line written before the file was replaced
+    write_log(new, "ined")
+
+    replacement: Path = tmp_path / "replacement.txt"
+    write_log(replacement, LEAVE)
+    replacement.replace(new)
+    os.utime(new, (time.time() + 1, time.time() + 1))
+    follower.poll()
+    write_log(new, ERROR, mode="w")
+    follower.poll()
+
+    events: list[dict] = read_output(output)
+    assert [event["event"] for event in events] == [
+        "log_file",
+        "game_saved",
+        "log_file",
+        "player_joined",
+        "player_joined",
+        "log_file",
+        "player_left",
+        "log_truncated",
+        "error",
+    ]
+    assert events[1]["file"] == old.name
+    assert events[3]["file"] == new.name
+    assert follower.stats.lines == 5
+
+
+def test_long_lines_are_cut(tmp_path):
+    """
+    Test that lines longer than the maximum do not grow the buffer
+
+    :param tmp_path:
+    :return:
+    """
+    path: Path = tmp_path / "sotf_log.txt"
+    write_log(path, "ERROR " + "x" * 100_000, SAVE)
+    output = io.StringIO()
+    follower = LogFollower(tmp_path, output=output, read_size=1024, max_line_length=64)
+    follower.follow(path)
+    follower.poll()
+
+    error, saved = read_output(output)[1:]
+    assert error["event"] == "error"
+    assert len(error["message"]) == 64
+    assert saved["event"] == "game_saved"
+    assert follower.stats.lines == 2
+
+
+def test_retention(tmp_path):
+    """
+    Test compressing old log files and removing them by count and age
+
+    :param tmp_path:
+    :return:
+    """
+    now: float = time.time()
+    paths: list[Path] = []
+    for index in range(5):
+        path: Path = tmp_path / f"sotf_log_2024-05-0{index + 1}_00-00-00.txt"
+        write_log(path, f"line {index}")
+        os.utime(path, (now - (5 - index) * 3600, now - (5 - index) * 3600))
+        paths.append(path)
+    expired: Path = tmp_path / "sotf_log_2024-01-01_00-00-00.txt.gz"
+    expired.write_bytes(gzip.compress(b"expired\n"))
+    os.utime(expired, (now - 30 * 86400, now - 30 * 86400))
+
+    result: dict[str, int] = apply_retention(
+        tmp_path, Retention(days=14, files=3), paths[-1]
+    )
+
+    assert result == {"compressed": 4, "removed": 2}
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "sotf_log_2024-05-02_00-00-00.txt.gz",
+        "sotf_log_2024-05-03_00-00-00.txt.gz",
+        "sotf_log_2024-05-04_00-00-00.txt.gz",
+        "sotf_log_2024-05-05_00-00-00.txt",
+    ]
+    compressed: Path = tmp_path / "sotf_log_2024-05-04_00-00-00.txt.gz"
+    assert gzip.decompress(compressed.read_bytes()) == b"line 3\n"
+    assert compressed.stat().st_mtime == pytest.approx(now - 7200, abs=1)
+
+
+def test_inotify_watcher(tmp_path):
+    """
+    Test waiting for changes with inotify
+
+    :param tmp_path:
+    :return:
+    """
+    watcher = create_watcher(tmp_path)
+    if not isinstance(watcher, Inotify):
+        pytest.skip("inotify is not available")
+    try:
+        assert watcher.wait(0.01) == []
+        write_log(tmp_path / "sotf_log.txt", SAVE)
+        assert "sotf_log.txt" in watcher.wait(1)
+    finally:
+        watcher.close()
+
+
+def test_run_follows_new_lines(tmp_path):
+    """
+    Test that the follower skips old lines and stops after reading the last ones
+
+    :param tmp_path:
+    :return:
+    """
+    path: Path = tmp_path / "sotf_log.txt"
+    write_log(path, JOIN)
+    output = io.StringIO()
+    follower = LogFollower(tmp_path, output=output)
+    stop = threading.Event()
+    thread = threading.Thread(target=follower.run, args=(stop,))
+    thread.start()
+    try:
+        time.sleep(0.1)
+        write_log(path, LEAVE)
+        deadline: float = time.monotonic() + 5
+        while follower.stats.events < 1:
+            assert time.monotonic() < deadline, "Timed out"
+            time.sleep(0.01)
+        write_log(path, SAVE)
+    finally:
+        stop.set()
+        thread.join()
+
+    events: list[dict] = read_output(output)
+    assert [event["event"] for event in events] == [
+        "log_file",
+        "player_left",
+        "game_saved",
+    ]
+
+    since_output = io.StringIO()
+    LogFollower(tmp_path, output=since_output).run(stop, since=time.time() - 60)
+    assert len(read_output(since_output)) == 4
+
+
+def test_main_once(tmp_path, capsys):
+    """
+    Test printing the events of the current log file
+
+    :param tmp_path:
+    :param capsys:
+    :return:
+    """
+    write_log(tmp_path / "sotf_log.txt", JOIN, SAVE)
+
+    main(["--logs", str(tmp_path), "--once"])
+
+    events: list[dict] = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+    assert [event["event"] for event in events] == [
+        "log_file",
+        "player_joined",
+        "game_saved",
+    ]
+
+
+def follow_synthetic_log(tmp_path: Path, lines: int) -> tuple[LogFollower, float]:
+    """
+    Follow a synthetic log with a few events among many other lines
+
+    :param tmp_path:
+    :param lines:
+    :return: follower and seconds it took
+    """
+    templates: tuple[str, ...] = (
+        "[2024/05/01 20:00:00.000] [Bolt] Entity {0} attached",
+        "[2024/05/01 20:00:00.000] [Net] Sent {0} bytes to peer",
+        "[2024/05/01 20:00:00.000] Loading chunk {0} of terrain",
+        JOIN,
+        SAVE,
+        ERROR,
+    )
+    weights: tuple[int, ...] = (400, 400, 196, 1, 1, 2)
+    pattern: list[str] = [
+        template for template, weight in zip(templates, weights) for _ in range(weight)
+    ]
+    path: Path = tmp_path / "sotf_log.txt"
+    with path.open("w") as file:
+        for index in range(lines):
+            file.write(pattern[index % len(pattern)].format(index) + "\n")
+
+    follower = LogFollower(tmp_path, output=io.StringIO())
+    stop = threading.Event()
+    stop.set()
+    started: float = time.perf_counter()
+    follower.run(stop, from_start=True)
+    return follower, time.perf_counter() - started
+
+
+def test_follow_large_log(tmp_path):
+    """
+    Test that all lines of a large log are read and only events are printed
+
+    :param tmp_path:
+    :return:
+    """
+    follower, _ = follow_synthetic_log(tmp_path, 20_000)
+
+    assert follower.stats.lines == 20_000
+    assert follower.stats.events == 20 * 4
+
+
+@pytest.mark.benchmark
+def test_log_follower_benchmark(tmp_path):
+    """
+    Measure the throughput of following a large synthetic log
+
+    :param tmp_path:
+    :return:
+    """
+    lines: int = 500_000
+    follower, duration = follow_synthetic_log(tmp_path, lines)
+
+    assert follower.stats.lines == lines
+    assert lines / duration > 100_000
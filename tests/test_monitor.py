@@ -0,0 +1,211 @@
+"""Tests A2S monitor."""
+
+import asyncio
+import json
+import socket
+from pathlib import Path
+
+import pytest
+
+from build.monitor import (
+    A2SClient,
+    A2SError,
+    Monitor,
+    TargetStatus,
+    get_fleet_targets,
+    parse_info,
+    parse_target,
+)
+from tests.fakes import FakeA2SServer
+
+
+async def start_servers(
+    count: int, **kwargs
+) -> tuple[list[str], list[asyncio.DatagramTransport]]:
+    """Start fake A2S servers on free local ports.
+
+    :param count:
+    :param kwargs:
+    :return: targets and transports of the servers
+    """
+    loop = asyncio.get_running_loop()
+    targets: list[str] = []
+    transports: list[asyncio.DatagramTransport] = []
+    for _ in range(count):
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: FakeA2SServer(**kwargs), local_addr=("127.0.0.1", 0)
+        )
+        targets.append(f"127.0.0.1:{transport.get_extra_info('sockname')[1]}")
+        transports.append(transport)
+    return targets, transports
+
+
+def get_unused_port() -> int:
+    """Return a local UDP port nobody listens on.
+
+    :return:
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_query_info_and_players():
+    """Test querying a server that requires a challenge.
+
+    :return:
+    """
+
+    async def query() -> tuple:
+        targets, transports = await start_servers(
+            1, name="Sons", players=("Kelvin", "Virginia")
+        )
+        client = A2SClient(timeout=1)
+        try:
+            address = parse_target(targets[0])
+            return (
+                await client.query_info(address),
+                await client.query_players(address),
+            )
+        finally:
+            client.close()
+            transports[0].close()
+
+    (info, info_latency), (players, players_latency) = asyncio.run(query())
+
+    assert info.name == "Sons"
+    assert info.game == "Sons Of The Forest"
+    assert (info.players, info.max_players) == (2, 8)
+    assert [player.name for player in players] == ["Kelvin", "Virginia"]
+    assert players[0].duration == 60
+    assert 0 < info_latency < 1
+    assert 0 < players_latency < 1
+
+
+def test_parse_truncated_info():
+    """Test that truncated responses raise an A2S error.
+
+    :return:
+    """
+    with pytest.raises(A2SError):
+        parse_info(b"\x11Sons\x00Forest")
+
+
+def test_monitor_hundreds_of_servers():
+    """Test polling hundreds of servers at once from one socket.
+
+    :return:
+    """
+
+    async def poll() -> list[TargetStatus]:
+        targets, transports = await start_servers(300)
+        monitor = Monitor(targets, timeout=2)
+        try:
+            return await monitor.poll()
+        finally:
+            monitor.client.close()
+            for transport in transports:
+                transport.close()
+
+    statuses: list[TargetStatus] = asyncio.run(poll())
+
+    assert len(statuses) == 300
+    assert all(status.up for status in statuses)
+    assert all(len(status.players) == 1 for status in statuses)
+
+
+def test_monitor_detects_unresponsive_servers(capsys: pytest.CaptureFixture):
+    """Test that servers not answering are reported down and then up again.
+
+    :param capsys:
+    :return:
+    """
+
+    async def poll() -> tuple[TargetStatus, ...]:
+        targets, transports = await start_servers(1)
+        monitor = Monitor(targets, timeout=0.2)
+        try:
+            first: TargetStatus = await monitor.poll()
+            up = TargetStatus(**vars(first[0]))
+            transports[0].close()
+            await monitor.poll()
+            down = TargetStatus(**vars(monitor.status[targets[0]]))
+            return up, down
+        finally:
+            monitor.client.close()
+
+    up, down = asyncio.run(poll())
+
+    assert up.up
+    assert not down.up
+    assert down.failures == 1
+    assert down.last_response == up.last_response
+    assert "stopped responding" in capsys.readouterr().err
+
+
+def test_metrics_endpoint():
+    """Test serving metrics of up and down servers in the Prometheus format.
+
+    :return:
+    """
+
+    async def scrape() -> str:
+        targets, transports = await start_servers(1, players=("A", "B", "C"))
+        targets.append(f"127.0.0.1:{get_unused_port()}")
+        monitor = Monitor(targets, timeout=0.2)
+        server = await monitor.serve("127.0.0.1", 0)
+        try:
+            await monitor.poll()
+            port: int = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response: bytes = await reader.read()
+            writer.close()
+            return response.decode()
+        finally:
+            server.close()
+            monitor.client.close()
+            transports[0].close()
+
+    response: str = asyncio.run(scrape())
+    head, body = response.split("\r\n\r\n", 1)
+    samples: dict[str, str] = dict(
+        line.rsplit(" ", 1) for line in body.splitlines() if not line.startswith("#")
+    )
+    up_target, down_target = (
+        line.split('"')[1] for line in body.splitlines() if line.startswith("sotf_up")
+    )
+
+    assert head.startswith("HTTP/1.1 200 OK")
+    assert "# TYPE sotf_players gauge" in body
+    assert samples[f'sotf_up{{target="{up_target}"}}'] == "1"
+    assert samples[f'sotf_up{{target="{down_target}"}}'] == "0"
+    assert samples[f'sotf_players{{target="{up_target}"}}'] == "3"
+    assert samples[f'sotf_max_players{{target="{up_target}"}}'] == "8"
+    assert samples[f'sotf_query_failures{{target="{down_target}"}}'] == "1"
+    assert f'sotf_query_latency_seconds{{target="{up_target}",query="info"}}' in (
+        samples
+    )
+    assert f'sotf_players{{target="{down_target}"}}' not in samples
+
+
+def test_get_fleet_targets(tmp_path: Path):
+    """Test reading query ports from a fleet compose file.
+
+    :param tmp_path:
+    :return:
+    """
+    compose_path: Path = tmp_path / "compose.yaml"
+    compose_path.write_text(
+        json.dumps(
+            {
+                "services": {
+                    "a": {"environment": {"QUERYPORT": "8767"}},
+                    "b": {"environment": {"QUERYPORT": "8770"}},
+                }
+            }
+        )
+    )
+
+    assert get_fleet_targets(compose_path) == ["127.0.0.1:8767", "127.0.0.1:8770"]
+    assert parse_target("example.com") == ("example.com", 27016)
@@ -0,0 +1,118 @@
+"""Tests Steam product info cache."""
+
+import time
+from pathlib import Path
+
+import pytest
+
+from build.constants import SOTF_APP_ID
+from build.product_info import ProductInfoCache
+from build.utils import get_sotf_build_id, get_sotf_build_ids
+from tests.fakes import FakeSteamTransport
+
+
+@pytest.fixture
+def transport() -> FakeSteamTransport:
+    """Provide a fake Steam responder.
+
+    :return:
+    """
+    return FakeSteamTransport({"release": "100", "public-beta": "101"})
+
+
+def test_cache_reuses_fresh_entry(tmp_path: Path, transport: FakeSteamTransport):
+    """Test that a fresh entry is served without asking Steam.
+
+    :param tmp_path:
+    :param transport:
+    :return:
+    """
+    cache = ProductInfoCache(tmp_path / "info.json", ttl=60, transport=transport)
+
+    assert get_sotf_build_id(product_info_cache=cache) == "100"
+    assert get_sotf_build_id(product_info_cache=cache) == "100"
+    assert transport.requests == 1
+    assert cache.get_change_number(SOTF_APP_ID) == 1
+
+
+def test_cache_is_persisted(tmp_path: Path, transport: FakeSteamTransport):
+    """Test that a second cache instance reads the stored product info.
+
+    :param tmp_path:
+    :param transport:
+    :return:
+    """
+    path: Path = tmp_path / "info.json"
+    ProductInfoCache(path, ttl=60, transport=transport).get_app_info(SOTF_APP_ID)
+    ProductInfoCache(path, ttl=60, transport=transport).get_app_info(SOTF_APP_ID)
+
+    assert transport.requests == 1
+
+
+def test_cache_refreshes_expired_entry(tmp_path: Path, transport: FakeSteamTransport):
+    """Test that an expired entry is fetched again.
+
+    :param tmp_path:
+    :param transport:
+    :return:
+    """
+    cache = ProductInfoCache(tmp_path / "info.json", ttl=0.01, transport=transport)
+    assert get_sotf_build_id(product_info_cache=cache) == "100"
+
+    transport.branches["release"] = "200"
+    transport.change_number = 2
+    time.sleep(0.02)
+
+    assert get_sotf_build_id(product_info_cache=cache) == "200"
+    assert transport.requests == 2
+    assert cache.get_change_number(SOTF_APP_ID) == 2
+
+
+def test_cache_falls_back_to_stale_entry(tmp_path: Path, transport: FakeSteamTransport):
+    """Test that a stale entry is used when Steam does not answer.
+
+    :param tmp_path:
+    :param transport:
+    :return:
+    """
+    cache = ProductInfoCache(tmp_path / "info.json", ttl=0, transport=transport)
+    cache.get_app_info(SOTF_APP_ID)
+    transport.fail = True
+
+    assert get_sotf_build_id(product_info_cache=cache) == "100"
+
+
+def test_cache_without_entry_raises(tmp_path: Path, transport: FakeSteamTransport):
+    """Test that a Steam error is raised when nothing is cached.
+
+    :param tmp_path:
+    :param transport:
+    :return:
+    """
+    cache = ProductInfoCache(tmp_path / "info.json", ttl=60, transport=transport)
+    transport.fail = True
+
+    with pytest.raises(TimeoutError):
+        cache.get_app_info(SOTF_APP_ID)
+
+
+def test_get_sotf_build_ids_multiple_branches(
+    tmp_path: Path, transport: FakeSteamTransport
+):
+    """Test looking up several branches with one request.
+
+    :param tmp_path:
+    :param transport:
+    :return:
+    """
+    cache = ProductInfoCache(tmp_path / "info.json", ttl=60, transport=transport)
+
+    build_ids: dict[str, str] = get_sotf_build_ids(
+        ["release", "public-beta"], product_info_cache=cache
+    )
+
+    assert build_ids == {"release": "100", "public-beta": "101"}
+    assert transport.requests == 1
+
+    with pytest.raises(KeyError, match="Branch unknown not found"):
+        get_sotf_build_ids(["unknown"], product_info_cache=cache)
@@ -0,0 +1,130 @@
+"""Tests multi-registry publishing."""
+
+from pathlib import Path
+
+import click
+import pytest
+
+from build.publish import (
+    Publisher,
+    PushReport,
+    RegistryTarget,
+    parse_registry_targets,
+    read_registry_credentials,
+)
+from tests.fakes import FakeBuildx, FakeDockerClient
+
+TARGETS: list[RegistryTarget] = [
+    RegistryTarget("docker.io", "hub", "secret"),
+    RegistryTarget("registry.internal:5000", "internal", "secret"),
+]
+
+
+def create_publisher(buildx: FakeBuildx) -> tuple[Publisher, FakeDockerClient]:
+    """Create a publisher pushing to the fake registries.
+
+    :param buildx:
+    :return:
+    """
+    docker_client = FakeDockerClient(buildx)
+    publisher = Publisher(
+        targets=TARGETS,
+        cache_to=None,
+        cache_from=None,
+        push_attempts=2,
+        retry_delay=0.0,
+        docker_client=docker_client,
+    )
+    return publisher, docker_client
+
+
+def test_parse_registry_targets():
+    """Test that registries use their own or the Docker Hub credentials.
+
+    :return:
+    """
+    targets: list[RegistryTarget] = parse_registry_targets(
+        ["docker.io", "registry.internal:5000", "localhost:5000"],
+        ["registry.internal:5000=internal:pass:word"],
+        "hub",
+        "secret",
+    )
+
+    assert targets == [
+        RegistryTarget("docker.io", "hub", "secret"),
+        RegistryTarget("registry.internal:5000", "internal", "pass:word"),
+        RegistryTarget("localhost:5000", "hub", "secret"),
+    ]
+    with pytest.raises(click.BadParameter):
+        parse_registry_targets(["docker.io"], ["docker.io=hub"])
+
+
+def test_read_registry_credentials(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test reading credentials from the environment and a file.
+
+    :param tmp_path:
+    :param monkeypatch:
+    :return:
+    """
+    path: Path = tmp_path / "registry-credentials"
+    path.write_text("registry.internal:5000=internal:secret\n\n")
+    monkeypatch.setenv("REGISTRY_CREDENTIALS", "ghcr.io=github:token\nquay.io=q:p")
+
+    assert read_registry_credentials(path) == [
+        "ghcr.io=github:token",
+        "quay.io=q:p",
+        "registry.internal:5000=internal:secret",
+    ]
+    monkeypatch.delenv("REGISTRY_CREDENTIALS")
+    assert read_registry_credentials() == []
+
+
+def test_build_once_and_push_in_parallel():
+    """Test that the image is built once and pushed to all registries at once.
+
+    :return:
+    """
+    buildx = FakeBuildx(push_failures={}, push_duration=0.2)
+    publisher, docker_client = create_publisher(buildx)
+
+    reports: list[PushReport] = publisher.build("release", "100", {"2465201": "1"})
+
+    assert len(buildx.builds) == 1
+    assert "tags" not in buildx.builds[0]
+    assert buildx.max_running_pushes == 2
+    assert sorted(docker_client.logins) == sorted(t.registry for t in TARGETS)
+    assert [report.registry for report in reports] == [t.registry for t in TARGETS]
+    for report in reports:
+        assert report.error is None
+        assert report.attempts == 1
+        assert report.image_bytes == 1210
+        assert report.duration >= 0.2
+
+
+def test_failing_registry_does_not_block_others():
+    """Test that pushes are retried and a failing registry only fails its push.
+
+    :return:
+    """
+    buildx = FakeBuildx(
+        push_failures={"docker.io": 1, "registry.internal:5000": 5},
+    )
+    publisher, docker_client = create_publisher(buildx)
+
+    hub, internal = publisher.build("release", "100", {"2465201": "1"})
+
+    assert hub.error is None
+    assert hub.attempts == 2
+    assert isinstance(internal.error, RuntimeError)
+    assert internal.attempts == 2
+    assert "failed after 2 attempts" in str(internal)
+    assert sorted(docker_client.logins) == sorted(t.registry for t in TARGETS)
+
+    # Building again only retries the failed push
+    buildx.push_failures.clear()
+    buildx.pushes.clear()
+    (retried,) = publisher.build("release", "100", {"2465201": "1"})
+    assert retried.registry == "registry.internal:5000"
+    assert retried.error is None
+    assert buildx.pushes == ["registry.internal:5000"]
+    assert publisher.build("release", "100", {"2465201": "1"}) == []
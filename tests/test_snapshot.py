@@ -0,0 +1,331 @@
+"""Test snapshot.py"""
+# ruff: noqa: D400
+
+import json
+import random
+import threading
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+
+from build.config.snapshot import (
+    RateLimiter,
+    Repository,
+    SnapshotStats,
+    find_save_dir,
+    main,
+    watch,
+)
+
+SAVE_PATH: str = "Saves/0/DedicatedServer/0000000001"
+
+
+def write_save(userdata: Path, files: dict[str, str]) -> Path:
+    """
+    Write save files like the game server
+
+    :param userdata:
+    :param files: content by file name
+    :return: save directory
+    """
+    directory: Path = userdata / SAVE_PATH
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, content in files.items():
+        (directory / name).write_text(content)
+    return directory
+
+
+def read_save(directory: Path) -> dict[str, str]:
+    """
+    Read all save files
+
+    :param directory:
+    :return:
+    """
+    return {path.name: path.read_text() for path in directory.iterdir()}
+
+
+def test_find_save_dir(tmp_path):
+    """
+    Test finding the save directory of a SaveSlot
+
+    :param tmp_path:
+    :return:
+    """
+    assert find_save_dir(tmp_path, 1) is None
+    directory: Path = write_save(tmp_path, {"GameStateSaveData.json": "{}"})
+    (tmp_path / "Saves" / "0" / "DedicatedServer" / "0000000002").mkdir()
+
+    assert find_save_dir(tmp_path, 1) == directory
+    assert find_save_dir(tmp_path, 2) is None
+
+
+def test_snapshots_are_incremental(tmp_path):
+    """
+    Test that unchanged files are not read and equal chunks are stored once
+
+    :param tmp_path:
+    :return:
+    """
+    userdata: Path = tmp_path / "userdata"
+    directory: Path = write_save(
+        userdata, {"a.json": "a" * 1000, "b.json": "b" * 1000, "c.json": "a" * 1000}
+    )
+    repository = Repository(tmp_path / "repository")
+
+    first_id, first = repository.create_snapshot(directory, userdata)
+    assert first.files == 3
+    assert first.bytes_read == 3000
+    assert first.chunks_stored == 2
+
+    second_id, second = repository.create_snapshot(directory, userdata)
+    assert second.files_unchanged == 3
+    assert second.bytes_read == second.bytes_stored == 0
+
+    time.sleep(0.01)
+    write_save(userdata, {"b.json": "c" * 1000})
+    third_id, third = repository.create_snapshot(directory, userdata)
+    assert third.files_unchanged == 2
+    assert third.bytes_read == 1000
+    assert third.chunks_stored == 1
+    assert repository.snapshots() == [first_id, second_id, third_id]
+
+
+def test_restore_point_in_time(tmp_path):
+    """
+    Test restoring earlier saves exactly, skipping files already restored
+
+    :param tmp_path:
+    :return:
+    """
+    userdata: Path = tmp_path / "userdata"
+    directory: Path = write_save(userdata, {"a.json": "first", "b.json": "first"})
+    repository = Repository(tmp_path / "repository")
+    first_id, _ = repository.create_snapshot(directory, userdata)
+    first_save: dict[str, str] = read_save(directory)
+
+    time.sleep(0.01)
+    write_save(userdata, {"a.json": "second", "c.json": "second"})
+    second_id, _ = repository.create_snapshot(directory, userdata)
+
+    stats: SnapshotStats = repository.restore(first_id, userdata)
+    assert read_save(directory) == first_save
+    assert stats.files_unchanged == 1
+
+    assert repository.restore(first_id, userdata).files_unchanged == 2
+
+    restored: Path = tmp_path / "restored"
+    repository.restore(repository.find_snapshot("latest"), restored)
+    assert read_save(restored / SAVE_PATH) == {
+        "a.json": "second",
+        "b.json": "first",
+        "c.json": "second",
+    }
+
+
+def test_find_snapshot(tmp_path):
+    """
+    Test selecting snapshots by ID and by time
+
+    :param tmp_path:
+    :return:
+    """
+    userdata: Path = tmp_path / "userdata"
+    directory: Path = write_save(userdata, {"a.json": "first"})
+    repository = Repository(tmp_path / "repository")
+    first_id, _ = repository.create_snapshot(directory, userdata)
+    between: datetime = datetime.now(UTC)
+    time.sleep(0.01)
+    second_id, _ = repository.create_snapshot(directory, userdata)
+
+    assert repository.find_snapshot() == second_id
+    assert repository.find_snapshot(first_id) == first_id
+    assert repository.find_snapshot(between.isoformat()) == first_id
+    assert repository.load_manifest(first_id)["path"] == SAVE_PATH
+    with pytest.raises(LookupError):
+        repository.find_snapshot("2000-01-01T00:00:00")
+
+
+def test_slots_share_the_repository(tmp_path, capsys):
+    """
+    Test that listing, restoring and reusing files only use snapshots of the slot
+
+    :param tmp_path:
+    :param capsys:
+    :return:
+    """
+    userdata: Path = tmp_path / "userdata"
+    first: Path = write_save(userdata, {"a.json": "slot 1"})
+    second: Path = first.with_name("0000000002")
+    second.mkdir()
+    (second / "a.json").write_text("slot 2")
+    repository = Repository(tmp_path / "repository")
+    first_id, _ = repository.create_snapshot(first, userdata)
+    time.sleep(0.01)
+    second_id, _ = repository.create_snapshot(second, userdata)
+    time.sleep(0.01)
+
+    _, stats = repository.create_snapshot(first, userdata)
+    assert stats.files_unchanged == 1
+    assert repository.snapshots(2) == [second_id]
+    assert repository.find_snapshot(slot=2) == second_id
+    with pytest.raises(LookupError, match="not of SaveSlot 1"):
+        repository.find_snapshot(second_id, slot=1)
+
+    (first / "a.json").write_text("changed")
+    options: list[str] = [
+        "--repository",
+        str(repository.path),
+        "--userdata",
+        str(userdata),
+        "--slot",
+        "1",
+    ]
+    main([*options, "restore", "latest"])
+    main([*options, "list"])
+
+    assert read_save(first) == {"a.json": "slot 1"}
+    assert read_save(second) == {"a.json": "slot 2"}
+    listed: list[str] = [
+        line.split()[0]
+        for line in capsys.readouterr().out.splitlines()
+        if not line.startswith("{")
+    ]
+    assert first_id in listed
+    assert second_id not in listed
+    assert len(listed) == 2
+
+
+def test_watch_snapshots_completed_saves(tmp_path):
+    """
+    Test that saves are snapshotted once they are complete and when stopping
+
+    :param tmp_path:
+    :return:
+    """
+    userdata: Path = tmp_path / "userdata"
+    repository = Repository(tmp_path / "repository")
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch,
+        args=(repository, userdata, 1, stop),
+        kwargs={"interval": 0.02, "settle": 0.2},
+    )
+    thread.start()
+    try:
+        write_save(userdata, {"a.json": "first"})
+        time.sleep(0.1)
+        assert repository.snapshots() == []
+        time.sleep(0.4)
+        assert len(repository.snapshots()) == 1
+
+        write_save(userdata, {"a.json": "second"})
+    finally:
+        stop.set()
+        thread.join()
+
+    assert len(repository.snapshots()) == 2
+    latest: dict = repository.load_manifest(repository.find_snapshot())
+    assert latest["files"]["a.json"]["size"] == len("second")
+
+
+def test_rate_limiter():
+    """
+    Test that the rate limiter throttles transfers
+
+    :return:
+    """
+    limiter = RateLimiter(10_000)
+    started: float = time.monotonic()
+    limiter.consume(10_000)
+    limiter.consume(5_000)
+
+    assert time.monotonic() - started >= 0.4
+
+
+def test_main_restore_without_snapshots(tmp_path, capsys):
+    """
+    Test that restoring the latest snapshot is skipped on the first start
+
+    :param tmp_path:
+    :param capsys:
+    :return:
+    """
+    main(
+        [
+            "--repository",
+            str(tmp_path / "repository"),
+            "--userdata",
+            str(tmp_path),
+            "restore",
+        ]
+    )
+
+    assert capsys.readouterr().out == "No snapshots to restore\n"
+
+
+def snapshot_generations(
+    tmp_path: Path, generations: int
+) -> tuple[int, int, list[float]]:
+    """
+    Snapshot a save rewriting a few of its files in every generation
+
+    :param tmp_path:
+    :param generations:
+    :return: bytes of all saves, bytes stored and durations of the snapshots
+    """
+    random.seed(0)
+    userdata: Path = tmp_path / "userdata"
+    files: dict[str, str] = {
+        f"Save{number}.json": json.dumps(
+            [{"id": index, "position": random.random()} for index in range(5000)]
+        )
+        for number in range(20)
+    }
+    directory: Path = write_save(userdata, files)
+    repository = Repository(tmp_path / "repository")
+
+    raw_bytes: int = 0
+    stored_bytes: int = 0
+    durations: list[float] = []
+    for generation in range(generations):
+        if generation:
+            # Each save rewrites a few files, like the game does for changed state
+            for name in random.sample(sorted(files), 2):
+                files[name] = files[name].replace(
+                    f'"id": {generation},', f'"id": {generation}, "changed": true,'
+                )
+            time.sleep(0.001)
+            write_save(userdata, files)
+        _, stats = repository.create_snapshot(directory, userdata)
+        raw_bytes += sum(len(content) for content in files.values())
+        stored_bytes += stats.bytes_stored
+        durations.append(stats.duration)
+    return raw_bytes, stored_bytes, durations
+
+
+def test_snapshots_store_changes_only(tmp_path):
+    """
+    Test that save generations only store the chunks of changed files
+
+    :param tmp_path:
+    :return:
+    """
+    raw_bytes, stored_bytes, _ = snapshot_generations(tmp_path, 20)
+
+    assert stored_bytes < raw_bytes * 0.1
+
+
+@pytest.mark.benchmark
+def test_snapshot_benchmark(tmp_path):
+    """
+    Measure that incremental snapshots are faster than the first one
+
+    :param tmp_path:
+    :return:
+    """
+    _, _, durations = snapshot_generations(tmp_path, 50)
+
+    assert sum(durations[1:]) / (len(durations) - 1) < durations[0]
@@ -0,0 +1,561 @@
+"""Test supervisor.py"""
+# ruff: noqa: D400
+
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from build.config.snapshot import Repository
+from build.config.supervisor import (
+    A2S_INFO,
+    CgroupFreezer,
+    Hibernator,
+    SignalFreezer,
+    Supervisor,
+    create_freezer,
+    read_receive_queue,
+    wine_prefix_is_current,
+)
+
+FAKE_XVFB: str = """
+import os, sys, time
+time.sleep(float(os.environ.get("XVFB_DELAY", "0")))
+fd = int(sys.argv[sys.argv.index("-displayfd") + 1])
+os.write(fd, sys.argv[1].lstrip(":").encode() + b"\\n")
+os.close(fd)
+time.sleep(60)
+"""
+FAKE_WINEBOOT: str = """
+import os, pathlib, time
+time.sleep(float(os.environ.get("WINEBOOT_DELAY", "0")))
+prefix = pathlib.Path(os.environ["WINEPREFIX"])
+prefix.mkdir(exist_ok=True)
+(prefix / "system.reg").touch()
+"""
+FAKE_GAME: str = """
+import signal, sys, time
+signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+time.sleep(60)
+sys.exit(3)
+"""
+FAKE_LOGGING_GAME: str = """
+import pathlib, signal, sys, time
+signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+log = pathlib.Path(sys.argv[1]) / "sotf_log_2024-05-01_20-00-00.txt"
+log.write_text("[2024/05/01 20:00:00.000] Player Kelvin (76561198000000001) joined\\n")
+time.sleep(60)
+"""
+
+FAKE_IDLE_GAME: str = """
+import os, select, signal, socket, sys
+signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+game = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+game.bind(("127.0.0.1", int(os.environ["GAMEPORT"])))
+query = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+query.bind(("127.0.0.1", int(os.environ["QUERYPORT"])))
+info = b"\\xff" * 4 + b"I\\x11Idle\\x00Map\\x00sotf\\x00Sons\\x00" + bytes([0, 0, 0, 8])
+while True:
+    for sock in select.select([game, query], [], [])[0]:
+        data, address = sock.recvfrom(1400)
+        if sock is query:
+            query.sendto(info, address)
+"""
+
+
+def create_supervisor(tmp_path: Path, **kwargs) -> Supervisor:
+    """
+    Create a supervisor running fake commands
+
+    :param tmp_path:
+    :param kwargs:
+    :return:
+    """
+    options: dict = {
+        "environ": {
+            "WINEPREFIX": str(tmp_path / "prefix"),
+            "XVFB_DELAY": "0.5",
+            "WINEBOOT_DELAY": "0.5",
+            "SERVERNAME": "Supervised",
+        },
+        "config_path": tmp_path / "dedicatedserver.cfg",
+        "display": ":4242",
+        "xvfb_command": [sys.executable, "-c", FAKE_XVFB],
+        "wineboot_command": [sys.executable, "-c", FAKE_WINEBOOT],
+        "wineserver_command": ["true"],
+        "game_command": [sys.executable, "-c", FAKE_GAME],
+        "wine_inf_paths": [tmp_path / "wine.inf"],
+        "ready_timeout": 5,
+    }
+    options.update(kwargs)
+    return Supervisor(**options)
+
+
+def read_records(output: str) -> dict[str, dict]:
+    """
+    Read the timing records from the supervisor output
+
+    :param output:
+    :return:
+    """
+    records: dict[str, dict] = {}
+    for line in output.splitlines():
+        if line.startswith("{"):
+            record: dict = json.loads(line)
+            records[record["phase"]] = record
+    return records
+
+
+def test_supervisor_runs_phases_concurrently(tmp_path, capsys):
+    """
+    Test that the startup phases run at the same time and are timed
+
+    :param tmp_path:
+    :param capsys:
+    :return:
+    """
+    supervisor = create_supervisor(tmp_path)
+    try:
+        supervisor.start()
+        assert supervisor.game.poll() is None
+    finally:
+        supervisor.game.terminate()
+        supervisor.game.wait()
+        supervisor.stop()
+
+    records = read_records(capsys.readouterr().out)
+    assert set(records) == {
+        "settings",
+        "xvfb",
+        "wineboot",
+        "config",
+        "game",
+        "startup",
+    }
+    assert all(record["status"] == "ok" for record in records.values())
+    assert records["xvfb"]["duration"] >= 0.5
+    assert records["wineboot"]["duration"] >= 0.5
+    assert records["startup"]["duration"] < 1.0
+    assert json.loads(supervisor.config_path.read_text())["ServerName"] == "Supervised"
+    assert supervisor.xvfb.poll() is not None
+
+
+def test_supervisor_forwards_signals(tmp_path):
+    """
+    Test that a stop signal is forwarded to the game for a clean shutdown
+
+    :param tmp_path:
+    :return:
+    """
+    supervisor = create_supervisor(tmp_path)
+
+    def stop() -> None:
+        while supervisor.game is None:
+            time.sleep(0.05)
+        # Give the game time to install its signal handler
+        time.sleep(0.5)
+        supervisor.handle_signal(signal.SIGTERM, None)
+
+    thread = threading.Thread(target=stop)
+    thread.start()
+    try:
+        assert supervisor.run() == 0
+    finally:
+        thread.join()
+
+
+@pytest.mark.parametrize(
+    "kwargs, phase",
+    [
+        ({"xvfb_command": ["false"]}, "xvfb"),
+        ({"wineserver_command": ["false"]}, "wineboot"),
+        ({"wineboot_command": ["true"]}, "wineboot"),
+        ({"config_path": Path("/nonexistent/dedicatedserver.cfg")}, "config"),
+        ({"environ": {"HIBERNATEAFTER": "10m"}}, "settings"),
+    ],
+)
+def test_supervisor_failed_phase(tmp_path, capsys, kwargs, phase):
+    """
+    Test that a failed phase stops the startup without launching the game
+
+    :param tmp_path:
+    :param capsys:
+    :param kwargs:
+    :param phase:
+    :return:
+    """
+    supervisor = create_supervisor(tmp_path, **kwargs)
+
+    assert supervisor.run() == 1
+
+    assert supervisor.game is None
+    records = read_records(capsys.readouterr().out)
+    assert records[phase]["status"] == "failed"
+
+
+def test_supervisor_validates_settings(tmp_path, capsys):
+    """
+    Test that all invalid settings are reported before anything is started
+
+    :param tmp_path:
+    :param capsys:
+    :return:
+    """
+    supervisor = create_supervisor(
+        tmp_path,
+        environ={
+            "HIBERNATEAFTER": "10m",
+            "SNAPSHOTS": "yes",
+            "LOGRETENTIONFILES": "-1",
+        },
+    )
+
+    assert supervisor.run() == 1
+
+    output = capsys.readouterr()
+    records = read_records(output.out)
+    assert set(records) == {"settings"}
+    assert records["settings"]["error"].splitlines() == [
+        "Wrong Value! HIBERNATEAFTER needs seconds",
+        "Wrong Value! SNAPSHOTS needs true or false",
+        "Wrong Value! LOGRETENTIONFILES needs a number of files",
+    ]
+    assert "Error: Wrong Value! HIBERNATEAFTER needs seconds" in output.err
+    assert supervisor.xvfb is None
+
+
+def bake_wine_prefix(tmp_path: Path) -> Path:
+    """
+    Create a Wine prefix like the one initialized at image build time
+
+    :param tmp_path:
+    :return:
+    """
+    wine_inf: Path = tmp_path / "wine.inf"
+    wine_inf.touch()
+    prefix: Path = tmp_path / "prefix"
+    prefix.mkdir()
+    (prefix / "system.reg").touch()
+    (prefix / ".update-timestamp").write_text(f"{int(wine_inf.stat().st_mtime)}\n")
+    return prefix
+
+
+def test_wine_prefix_is_current(tmp_path):
+    """
+    Test detecting missing and stale Wine prefixes
+
+    :param tmp_path:
+    :return:
+    """
+    wine_inf_paths: list[Path] = [tmp_path / "missing.inf", tmp_path / "wine.inf"]
+    assert not wine_prefix_is_current(tmp_path / "prefix", wine_inf_paths)
+
+    prefix: Path = bake_wine_prefix(tmp_path)
+    assert wine_prefix_is_current(prefix, wine_inf_paths)
+    assert wine_prefix_is_current(prefix, [tmp_path / "missing.inf"])
+
+    (prefix / ".update-timestamp").write_text("1\n")
+    assert not wine_prefix_is_current(prefix, wine_inf_paths)
+
+    (prefix / ".update-timestamp").unlink()
+    assert not wine_prefix_is_current(prefix, wine_inf_paths)
+
+
+def test_prebaked_wine_prefix_skips_wineboot(tmp_path, capsys):
+    """
+    Test that wineboot only runs without a current Wine prefix from the image
+
+    :param tmp_path:
+    :param capsys:
+    :return:
+    """
+    for source in ("wineboot", "image"):
+        run_path: Path = tmp_path / source
+        run_path.mkdir()
+        if source == "image":
+            bake_wine_prefix(run_path)
+        supervisor = create_supervisor(
+            run_path,
+            environ={"WINEPREFIX": str(run_path / "prefix"), "WINEBOOT_DELAY": "0.5"},
+        )
+        try:
+            supervisor.start()
+        finally:
+            supervisor.game.terminate()
+            supervisor.game.wait()
+            supervisor.stop()
+
+        records = read_records(capsys.readouterr().out)
+        assert records["wineboot"]["prefix"] == source
+        # The fake wineboot takes WINEBOOT_DELAY, skipping it returns at once
+        assert (records["wineboot"]["duration"] >= 0.5) == (source == "wineboot")
+
+
+def get_unused_port() -> int:
+    """
+    Return a local UDP port nobody listens on
+
+    :return:
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    """
+    Wait until a condition is true
+
+    :param condition:
+    :param timeout:
+    :return:
+    """
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def read_events(output: str, event: str) -> list[dict]:
+    """
+    Read the records of an event from the supervisor output
+
+    :param output:
+    :param event:
+    :return:
+    """
+    return [
+        record
+        for record in map(json.loads, filter(None, output.splitlines()))
+        if record["event"] == event
+    ]
+
+
+def test_read_receive_queue():
+    """
+    Test reading the bytes queued for an unread UDP socket
+
+    :return:
+    """
+    with (
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver,
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender,
+    ):
+        receiver.bind(("127.0.0.1", 0))
+        port: int = receiver.getsockname()[1]
+        assert read_receive_queue([port]) == 0
+
+        sender.sendto(b"wake up", ("127.0.0.1", port))
+        wait_for(lambda: read_receive_queue([port]) > 0)
+        assert read_receive_queue([get_unused_port()]) == 0
+
+
+def test_create_freezer(tmp_path, monkeypatch):
+    """
+    Test using the cgroup freezer when available and SIGSTOP otherwise
+
+    :param tmp_path:
+    :param monkeypatch:
+    :return:
+    """
+    (tmp_path / "sotf-game").mkdir()
+    (tmp_path / "sotf-game" / "cgroup.freeze").write_text("0\n")
+    freezer = create_freezer(1234, tmp_path)
+    assert isinstance(freezer, CgroupFreezer)
+    assert (tmp_path / "sotf-game" / "cgroup.procs").read_text() == "1234\n"
+    freezer.freeze()
+    assert (tmp_path / "sotf-game" / "cgroup.freeze").read_text() == "1\n"
+    freezer.thaw()
+    assert (tmp_path / "sotf-game" / "cgroup.freeze").read_text() == "0\n"
+    # cgroupfs removes the interface files with the cgroup
+    monkeypatch.setattr(Path, "rmdir", shutil.rmtree)
+    freezer.close()
+    assert not (tmp_path / "sotf-game").exists()
+    assert (tmp_path / "cgroup.procs").read_text() == "1234\n"
+
+    freezer = create_freezer(os.getpid(), tmp_path / "missing")
+    assert isinstance(freezer, SignalFreezer)
+
+
+def test_hibernator_does_not_suspend_when_stopping(tmp_path):
+    """
+    Test that a stopping hibernator never freezes the game again
+
+    :param tmp_path:
+    :return:
+    """
+    (tmp_path / "sotf-game").mkdir()
+    (tmp_path / "sotf-game" / "cgroup.freeze").write_text("0\n")
+    hibernator = Hibernator(
+        create_freezer(1234, tmp_path),
+        ("127.0.0.1", get_unused_port()),
+        [],
+        idle_timeout=0,
+        log=lambda event, **fields: None,
+    )
+    stop = threading.Event()
+    stop.set()
+    hibernator.run(stop)
+
+    hibernator.suspend()
+
+    assert not hibernator.suspended
+    assert (tmp_path / "sotf-game" / "cgroup.freeze").read_text() == "0\n"
+
+
+def test_hibernation(tmp_path, capsys):
+    """
+    Test suspending the idle game and waking it up on traffic to the game port
+
+    :param tmp_path:
+    :param capsys:
+    :return:
+    """
+    game_port: int = get_unused_port()
+    query_port: int = get_unused_port()
+    supervisor = create_supervisor(
+        tmp_path,
+        environ={
+            "WINEPREFIX": str(tmp_path / "prefix"),
+            "GAMEPORT": str(game_port),
+            "QUERYPORT": str(query_port),
+            "HIBERNATEAFTER": "0.2",
+        },
+        game_command=[sys.executable, "-c", FAKE_IDLE_GAME],
+        cgroup_root=tmp_path / "cgroup",
+        hibernation_options={"check_interval": 0.05, "wake_interval": 0.01},
+    )
+    try:
+        supervisor.start()
+        wait_for(lambda: supervisor.hibernator and supervisor.hibernator.suspended)
+        stat: str = Path(f"/proc/{supervisor.game.pid}/stat").read_text()
+        assert stat.rsplit(")", 1)[1].split()[0] == "T"
+
+        output: list[str] = []
+
+        def resumed() -> bool:
+            output.append(capsys.readouterr().out)
+            return '"action": "resume"' in "".join(output)
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+            # Server browser queries do not wake the game by default
+            client.sendto(A2S_INFO, ("127.0.0.1", query_port))
+            time.sleep(0.2)
+            assert supervisor.hibernator.suspended
+            client.sendto(b"connect", ("127.0.0.1", game_port))
+        # The resume is logged once the game answers queries again
+        wait_for(resumed)
+    finally:
+        supervisor.handle_signal(signal.SIGTERM, None)
+        assert supervisor.hibernator_stop.is_set()
+        assert supervisor.game.wait(timeout=5) == 0
+        supervisor.stop()
+
+    output.append(capsys.readouterr().out)
+    suspend, resume = read_events("".join(output), "hibernation")
+    assert suspend["action"] == "suspend"
+    assert suspend["freezer"] == "signal"
+    assert suspend["idle"] >= 0.2
+    assert resume["action"] == "resume"
+    assert resume["trigger"] == "traffic"
+    assert 0 < resume["wake_latency"] < 1
+    assert resume["suspended"] == resume["suspended_total"] > 0
+
+
+def test_snapshots(tmp_path, capfd):
+    """
+    Test restoring the latest snapshot on startup and snapshotting on shutdown
+
+    :param tmp_path:
+    :param capfd:
+    :return:
+    """
+    origin: Path = tmp_path / "origin"
+    save_dir: Path = origin / "Saves" / "0" / "DedicatedServer" / "0000000001"
+    save_dir.mkdir(parents=True)
+    (save_dir / "GameStateSaveData.json").write_text('{"day": 1}')
+    repository = Repository(tmp_path / "snapshots")
+    snapshot_id, _ = repository.create_snapshot(save_dir, origin)
+
+    userdata: Path = tmp_path / "userdata"
+    userdata.mkdir()
+    supervisor = create_supervisor(
+        tmp_path,
+        environ={
+            "WINEPREFIX": str(tmp_path / "prefix"),
+            "SNAPSHOTS": "true",
+            "SNAPSHOTRESTORE": "latest",
+            "SNAPSHOTDIR": str(repository.path),
+        },
+        config_path=userdata / "dedicatedserver.cfg",
+    )
+    restored: Path = userdata / save_dir.relative_to(origin)
+    try:
+        supervisor.start()
+        assert (restored / "GameStateSaveData.json").read_text() == '{"day": 1}'
+        (restored / "GameStateSaveData.json").write_text('{"day": 2}')
+        # Gives the snapshot tool time to install its signal handlers
+        time.sleep(1)
+    finally:
+        supervisor.game.terminate()
+        supervisor.game.wait()
+        supervisor.stop()
+
+    output: str = "\n".join(
+        line for line in capfd.readouterr().out.splitlines() if line.startswith("{")
+    )
+    phases: dict[str, dict] = {
+        record["phase"]: record for record in read_events(output, "startup_phase")
+    }
+    assert phases["restore"]["status"] == "ok"
+    (restore,) = read_events(output, "restore")
+    assert restore["id"] == snapshot_id
+    latest: str = repository.find_snapshot()
+    assert latest != snapshot_id
+    assert repository.load_manifest(latest)["files"]["GameStateSaveData.json"][
+        "size"
+    ] == len('{"day": 2}')
+
+
+def test_log_events(tmp_path, capfd):
+    """
+    Test printing events of the game's new log file and compressing old ones
+
+    :param tmp_path:
+    :param capfd:
+    :return:
+    """
+    logs: Path = tmp_path / "logs"
+    logs.mkdir()
+    old_log: Path = logs / "sotf_log_2024-04-30_20-00-00.txt"
+    old_log.write_text("[2024/04/30 20:00:00.000] Player Virginia joined\n")
+    os.utime(old_log, (time.time() - 60, time.time() - 60))
+    supervisor = create_supervisor(
+        tmp_path,
+        environ={"WINEPREFIX": str(tmp_path / "prefix"), "LOGEVENTS": "true"},
+        game_command=[sys.executable, "-c", FAKE_LOGGING_GAME, str(logs)],
+    )
+    try:
+        supervisor.start()
+        wait_for(lambda: (logs / "sotf_log_2024-04-30_20-00-00.txt.gz").exists())
+    finally:
+        supervisor.game.terminate()
+        supervisor.game.wait()
+        supervisor.stop()
+
+    output: str = "\n".join(
+        line for line in capfd.readouterr().out.splitlines() if line.startswith("{")
+    )
+    (joined,) = read_events(output, "player_joined")
+    assert joined["player"] == "Kelvin"
+    assert joined["file"] == "sotf_log_2024-05-01_20-00-00.txt"
+    assert read_events(output, "log_retention") == [
+        {"event": "log_retention", "compressed": 1, "removed": 0}
+    ]
@@ -0,0 +1,72 @@
+"""Tests tag index."""
+
+from pathlib import Path
+
+from build.tag_index import TagIndex, registry_tags_url
+from build.utils import tag_exists
+from tests.fakes import TAGS, FakeTagsHandler
+
+
+def test_registry_tags_are_paginated(tags_server: str, tmp_path: Path):
+    """Test that all pages of a Registry v2 tags list are followed.
+
+    :param tags_server:
+    :param tmp_path:
+    :return:
+    """
+    url: str = registry_tags_url(tags_server, "pfeiffermax/sotf", page_size=10)
+    tag_index = TagIndex(url, tmp_path / "tags.json")
+
+    assert tag_index.refresh() == set(TAGS)
+    assert len(FakeTagsHandler.requests) == 3
+    assert tag_exists("1024", tag_index=tag_index)
+
+
+def test_docker_hub_tags_are_paginated(tags_server: str, tmp_path: Path):
+    """Test that all pages of a Docker Hub tags list are followed.
+
+    :param tags_server:
+    :param tmp_path:
+    :return:
+    """
+    url: str = f"{tags_server}/v2/namespaces/pfeiffermax/repositories/sotf/tags"
+    tag_index = TagIndex(f"{url}?page_size=10", tmp_path / "tags.json")
+
+    assert tag_index.refresh() == set(TAGS)
+    assert tag_exists("1024", tag_index=tag_index)
+
+
+def test_tag_exists_matches_exact_tag(tags_server: str, tmp_path: Path):
+    """Test that a build ID contained in another build ID is not matched.
+
+    :param tags_server:
+    :param tmp_path:
+    :return:
+    """
+    tag_index = TagIndex(
+        registry_tags_url(tags_server, "pfeiffermax/sotf"), tmp_path / "tags.json"
+    )
+
+    assert tag_exists("1000", tag_index=tag_index)
+    assert not tag_exists("100", tag_index=tag_index)
+    assert not tag_exists("10001", tag_index=tag_index)
+
+
+def test_unchanged_pages_are_not_downloaded_again(tags_server: str, tmp_path: Path):
+    """Test that stored ETags are sent and 304 responses reuse stored pages.
+
+    :param tags_server:
+    :param tmp_path:
+    :return:
+    """
+    url: str = registry_tags_url(tags_server, "pfeiffermax/sotf", page_size=10)
+    path: Path = tmp_path / "tags.json"
+    TagIndex(url, path).refresh()
+
+    FakeTagsHandler.tags.append("new-tag")
+    tag_index = TagIndex(url, path)
+
+    assert "new-tag" in tag_index
+    assert "build-1000" in tag_index
+    assert len(FakeTagsHandler.requests) == 6
+    assert FakeTagsHandler.not_modified == 2
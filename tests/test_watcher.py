@@ -0,0 +1,263 @@
+"""Tests build watcher."""
+
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner, Result
+
+from build import publish, utils
+from build.publish import Publisher, PushReport
+from build.watcher import BuildWatcher, backoff, jitter
+from tests.fakes import FakeSteamTransport
+
+
+class FakeTagSource:
+    """Registry tags held in memory."""
+
+    def __init__(self, tags: set[str]):
+        """Initialize the fake tag source.
+
+        :param tags:
+        """
+        self.tags = set(tags)
+        self.refreshes: int = 0
+
+    def refresh(self) -> set[str]:
+        """Count the refresh and return the tags.
+
+        :return:
+        """
+        self.refreshes += 1
+        return self.tags
+
+
+class FakeBuilder:
+    """Build callable recording builds and their concurrency."""
+
+    def __init__(self, duration: float = 0.0, fail: bool = False):
+        """Initialize the fake builder.
+
+        :param duration: seconds each build takes
+        :param fail:
+        """
+        self.duration = duration
+        self.fail = fail
+        self.builds: list[tuple[str, str]] = []
+        self.running: int = 0
+        self.max_running: int = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, branch: str, build_id: str) -> None:
+        """Record a build.
+
+        :param branch:
+        :param build_id:
+        :return:
+        """
+        with self._lock:
+            self.builds.append((branch, build_id))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.duration)
+        with self._lock:
+            self.running -= 1
+        if self.fail:
+            raise RuntimeError("Build failed")
+
+
+def test_poll_builds_missing_tags_once():
+    """Test that builds start for tags missing in any registry, once per branch.
+
+    :return:
+    """
+    sources: list[FakeTagSource] = [
+        FakeTagSource({"build-100"}),
+        FakeTagSource({"build-100", "build-101"}),
+    ]
+    builder = FakeBuilder()
+    watcher = BuildWatcher(
+        get_build_ids=lambda: {"release": "100", "beta": "101", "experimental": "101"},
+        tag_sources=sources,
+        build=builder,
+    )
+
+    started: list[tuple[str, str]] = asyncio.run(watcher.run_once())
+
+    # Both branches need their moving tag on the build
+    assert started == [("beta", "101"), ("experimental", "101")]
+    assert sorted(builder.builds) == started
+    assert all(source.refreshes == 1 for source in sources)
+    assert not watcher.failed
+
+
+def test_builds_are_bounded():
+    """Test that no more than max_concurrent_builds builds run at the same time.
+
+    :return:
+    """
+    builder = FakeBuilder(duration=0.2)
+    watcher = BuildWatcher(
+        get_build_ids=lambda: {"a": "1", "b": "2", "c": "3", "d": "4"},
+        tag_sources=[FakeTagSource(set())],
+        build=builder,
+        max_concurrent_builds=2,
+    )
+
+    asyncio.run(watcher.run_once())
+
+    assert len(builder.builds) == 4
+    assert builder.max_running == 2
+
+
+def test_running_build_is_not_started_again():
+    """Test that a poll during a running build only starts other branches.
+
+    :return:
+    """
+    builder = FakeBuilder(duration=0.2)
+    build_ids: dict[str, str] = {"release": "100"}
+    watcher = BuildWatcher(
+        get_build_ids=lambda: dict(build_ids),
+        tag_sources=[FakeTagSource(set())],
+        build=builder,
+        max_concurrent_builds=2,
+    )
+
+    async def poll_twice() -> list[tuple[str, str]]:
+        started: list[tuple[str, str]] = await watcher.poll()
+        build_ids["beta"] = "100"
+        started += await watcher.poll()
+        await watcher.wait_for_builds()
+        return started
+
+    assert asyncio.run(poll_twice()) == [("release", "100"), ("beta", "100")]
+    assert sorted(builder.builds) == [("beta", "100"), ("release", "100")]
+
+
+def test_failed_build_is_retried():
+    """Test that a failed build is recorded and started again by the next poll.
+
+    :return:
+    """
+    builder = FakeBuilder(fail=True)
+    watcher = BuildWatcher(
+        get_build_ids=lambda: {"release": "100"},
+        tag_sources=[FakeTagSource(set())],
+        build=builder,
+    )
+
+    asyncio.run(watcher.run_once())
+    assert set(watcher.failed) == {("build-100", "release")}
+
+    builder.fail = False
+    asyncio.run(watcher.run_once())
+    assert builder.builds == [("release", "100"), ("release", "100")]
+    assert not watcher.failed
+
+
+def test_failed_poll_backs_off():
+    """Test that polling continues after Steam failed to answer.
+
+    :return:
+    """
+    transport = FakeSteamTransport({"release": "100"})
+    transport.fail = True
+    builder = FakeBuilder()
+
+    def get_build_ids() -> dict[str, str]:
+        try:
+            info: dict = transport.get_product_info(0)
+        finally:
+            # Steam answers again after the first failure
+            transport.fail = False
+        return {
+            branch: entry["buildid"]
+            for branch, entry in info["depots"]["branches"].items()
+        }
+
+    watcher = BuildWatcher(
+        get_build_ids=get_build_ids,
+        tag_sources=[FakeTagSource(set())],
+        build=builder,
+        interval=0.01,
+    )
+
+    asyncio.run(watcher.run(rounds=2))
+
+    assert transport.requests == 2
+    assert builder.builds == [("release", "100")]
+
+
+@pytest.mark.parametrize("failures", [1, 2, 5, 20])
+def test_backoff(failures: int):
+    """Test that the backoff grows exponentially up to the maximum.
+
+    :param failures:
+    :return:
+    """
+    delays: list[float] = [backoff(failures, 1.0, 10.0) for _ in range(100)]
+
+    assert all(0 <= delay <= min(10.0, 2 ** (failures - 1)) for delay in delays)
+
+
+def test_jitter():
+    """Test that jitter stays within its spread.
+
+    :return:
+    """
+    assert all(90 <= jitter(100, spread=0.1) <= 110 for _ in range(100))
+
+
+def test_publish_offline(
+    tags_server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """Test publishing from a product info file against a local registry.
+
+    :param tags_server:
+    :param tmp_path:
+    :param monkeypatch:
+    :return:
+    """
+    product_info: Path = tmp_path / "product_info.json"
+    product_info.write_text(
+        json.dumps(
+            FakeSteamTransport(
+                {"release": "1000", "beta": "2000"},
+                depots={"2465201": {"manifests": {"public": "222"}}},
+            ).get_product_info(2465200)
+        )
+    )
+    builds: list[tuple[str, str, dict[str, str]]] = []
+
+    def build(
+        self: Publisher, branch: str, build_id: str, manifests: dict[str, str]
+    ) -> list[PushReport]:
+        builds.append((branch, build_id, manifests))
+        return [PushReport(registry=target.registry) for target in self.targets]
+
+    monkeypatch.setattr(publish, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(utils, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(Publisher, "build", build)
+    utils.get_tag_index.cache_clear()
+
+    result: Result = CliRunner().invoke(
+        publish.main,
+        [
+            "--registry",
+            tags_server.removeprefix("http://"),
+            "--branch",
+            "release",
+            "--branch",
+            "beta",
+            "--steam-product-info",
+            str(product_info),
+        ],
+    )
+    utils.get_tag_index.cache_clear()
+
+    assert result.exit_code == 0, result.output
+    assert builds == [("beta", "2000", {"2465201": "222"})]